@@ -8,313 +8,40 @@
 import streamlit as st
 import pandas as pd
 import datetime
-import os
-import io
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Text
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship, joinedload
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+from time import sleep
+from sqlalchemy.exc import IntegrityError
 import streamlit_javascript as st_js
 import plotly.express as px
 
-# Database setup
-engine = create_engine('sqlite:///dental_clinic.db', echo=True)
-Base = declarative_base()
-Session = sessionmaker(bind=engine)
-
-# Models (unchanged)
-class Patient(Base):
-    __tablename__ = 'patients'
-    id = Column(Integer, primary_key=True)
-    name = Column(String)
-    age = Column(Integer)
-    gender = Column(String)
-    phone = Column(String)
-    address = Column(String)
-    medical_history = Column(Text)
-    image_path = Column(String)
-
-class Doctor(Base):
-    __tablename__ = 'doctors'
-    id = Column(Integer, primary_key=True)
-    name = Column(String)
-    specialty = Column(String)
-    phone = Column(String)
-    email = Column(String)
-
-class Treatment(Base):
-    __tablename__ = 'treatments'
-    id = Column(Integer, primary_key=True)
-    name = Column(String)
-    base_cost = Column(Float)
-
-class TreatmentPercentage(Base):
-    __tablename__ = 'treatment_percentages'
-    id = Column(Integer, primary_key=True)
-    treatment_id = Column(Integer, ForeignKey('treatments.id'))
-    doctor_id = Column(Integer, ForeignKey('doctors.id'))
-    clinic_percentage = Column(Float)
-    doctor_percentage = Column(Float)
-    treatment = relationship("Treatment")
-    doctor = relationship("Doctor")
-
-class Appointment(Base):
-    __tablename__ = 'appointments'
-    id = Column(Integer, primary_key=True)
-    patient_id = Column(Integer, ForeignKey('patients.id'))
-    doctor_id = Column(Integer, ForeignKey('doctors.id'))
-    treatment_id = Column(Integer, ForeignKey('treatments.id'))
-    date = Column(DateTime)
-    status = Column(String)
-    notes = Column(Text)
-    patient = relationship("Patient")
-    doctor = relationship("Doctor")
-    treatment = relationship("Treatment")
-
-class Payment(Base):
-    __tablename__ = 'payments'
-    id = Column(Integer, primary_key=True)
-    appointment_id = Column(Integer, ForeignKey('appointments.id'))
-    total_amount = Column(Float)
-    paid_amount = Column(Float)
-    clinic_share = Column(Float)
-    doctor_share = Column(Float)
-    payment_method = Column(String)
-    discounts = Column(Float)
-    taxes = Column(Float)
-    date_paid = Column(DateTime)
-    appointment = relationship("Appointment")
-
-Base.metadata.create_all(engine)
-
-# Functions (added edit/delete)
-def add_patient(name, age, gender, phone, address, medical_history, image):
-    session = Session()
-    patient = Patient(name=name, age=age, gender=gender, phone=phone, address=address, medical_history=medical_history)
-    if image:
-        image_path = f"images/{name}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.png"
-        os.makedirs('images', exist_ok=True)
-        with open(image_path, "wb") as f:
-            f.write(image.getvalue())
-        patient.image_path = image_path
-    session.add(patient)
-    session.commit()
-    session.close()
-
-def edit_patient(patient_id, name, age, gender, phone, address, medical_history, image):
-    session = Session()
-    patient = session.query(Patient).get(patient_id)
-    if patient:
-        patient.name = name
-        patient.age = age
-        patient.gender = gender
-        patient.phone = phone
-        patient.address = address
-        patient.medical_history = medical_history
-        if image:
-            image_path = f"images/{name}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.png"
-            with open(image_path, "wb") as f:
-                f.write(image.getvalue())
-            patient.image_path = image_path
-        session.commit()
-    session.close()
-
-def delete_patient(patient_id):
-    session = Session()
-    patient = session.query(Patient).get(patient_id)
-    if patient:
-        session.delete(patient)
-        session.commit()
-    session.close()
-
-def get_patients():
-    session = Session()
-    patients = session.query(Patient).all()
-    session.close()
-    return patients
-
-# Similar edit/delete for doctors, treatments, appointments (implementing briefly)
-def add_doctor(name, specialty, phone, email):
-    session = Session()
-    doctor = Doctor(name=name, specialty=specialty, phone=phone, email=email)
-    session.add(doctor)
-    session.commit()
-    session.close()
-
-def edit_doctor(doctor_id, name, specialty, phone, email):
-    session = Session()
-    doctor = session.query(Doctor).get(doctor_id)
-    if doctor:
-        doctor.name = name
-        doctor.specialty = specialty
-        doctor.phone = phone
-        doctor.email = email
-        session.commit()
-    session.close()
-
-def delete_doctor(doctor_id):
-    session = Session()
-    doctor = session.query(Doctor).get(doctor_id)
-    if doctor:
-        session.delete(doctor)
-        session.commit()
-    session.close()
-
-def get_doctors():
-    session = Session()
-    doctors = session.query(Doctor).all()
-    session.close()
-    return doctors
-
-def add_treatment(name, base_cost):
-    session = Session()
-    treatment = Treatment(name=name, base_cost=base_cost)
-    session.add(treatment)
-    session.commit()
-    session.close()
-
-def edit_treatment(treatment_id, name, base_cost):
-    session = Session()
-    treatment = session.query(Treatment).get(treatment_id)
-    if treatment:
-        treatment.name = name
-        treatment.base_cost = base_cost
-        session.commit()
-    session.close()
-
-def delete_treatment(treatment_id):
-    session = Session()
-    treatment = session.query(Treatment).get(treatment_id)
-    if treatment:
-        session.delete(treatment)
-        session.commit()
-    session.close()
-
-def get_treatments():
-    session = Session()
-    treatments = session.query(Treatment).all()
-    session.close()
-    return treatments
-
-def add_treatment_percentage(treatment_id, doctor_id, clinic_percentage, doctor_percentage):
-    session = Session()
-    perc = TreatmentPercentage(treatment_id=treatment_id, doctor_id=doctor_id, 
-                                clinic_percentage=clinic_percentage, doctor_percentage=doctor_percentage)
-    session.add(perc)
-    session.commit()
-    session.close()
-
-def add_appointment(patient_id, doctor_id, treatment_id, date, status, notes):
-    session = Session()
-    appointment = Appointment(patient_id=patient_id, doctor_id=doctor_id, treatment_id=treatment_id, 
-                              date=date, status=status, notes=notes)
-    session.add(appointment)
-    session.commit()
-    session.close()
-
-def edit_appointment(appointment_id, patient_id, doctor_id, treatment_id, date, status, notes):
-    session = Session()
-    appointment = session.query(Appointment).get(appointment_id)
-    if appointment:
-        appointment.patient_id = patient_id
-        appointment.doctor_id = doctor_id
-        appointment.treatment_id = treatment_id
-        appointment.date = date
-        appointment.status = status
-        appointment.notes = notes
-        session.commit()
-    session.close()
-
-def delete_appointment(appointment_id):
-    session = Session()
-    appointment = session.query(Appointment).get(appointment_id)
-    if appointment:
-        session.delete(appointment)
-        session.commit()
-    session.close()
-
-def get_appointments():
-    session = Session()
-    appointments = session.query(Appointment).options(
-        joinedload(Appointment.patient),
-        joinedload(Appointment.doctor),
-        joinedload(Appointment.treatment)
-    ).all()
-    session.close()
-    return appointments
-
-def calculate_shares(appointment_id, total_amount, discounts=0, taxes=0):
-    session = Session()
-    appointment = session.query(Appointment).options(
-        joinedload(Appointment.patient),
-        joinedload(Appointment.doctor),
-        joinedload(Appointment.treatment)
-    ).get(appointment_id)
-    perc = session.query(TreatmentPercentage).filter_by(treatment_id=appointment.treatment_id, doctor_id=appointment.doctor_id).first()
-    if not perc:
-        clinic_perc = 50.0
-        doctor_perc = 50.0
-    else:
-        clinic_perc = perc.clinic_percentage
-        doctor_perc = perc.doctor_percentage
-    net_amount = total_amount - discounts + taxes
-    clinic_share = net_amount * (clinic_perc / 100)
-    doctor_share = net_amount * (doctor_perc / 100)
-    session.close()
-    return clinic_share, doctor_share
-
-def add_payment(appointment_id, total_amount, paid_amount, payment_method, discounts, taxes):
-    session = Session()
-    clinic_share, doctor_share = calculate_shares(appointment_id, total_amount, discounts, taxes)
-    payment = Payment(appointment_id=appointment_id, total_amount=total_amount, paid_amount=paid_amount,
-                      clinic_share=clinic_share, doctor_share=doctor_share, payment_method=payment_method,
-                      discounts=discounts, taxes=taxes, date_paid=datetime.datetime.now())
-    session.add(payment)
-    session.commit()
-    session.close()
-
-# Reports (added plotly charts)
-def get_payments():
-    session = Session()
-    payments = session.query(Payment).options(joinedload(Payment.appointment)).all()
-    session.close()
-    return payments
-
-def generate_report(start_date, end_date):
-    session = Session()
-    payments = session.query(Payment).filter(Payment.date_paid.between(start_date, end_date + pd.Timedelta(days=1))).all()
-    data = [{'موعد': p.appointment_id, 'إجمالي': p.total_amount, 'نصيب العيادة': p.clinic_share, 'نصيب الطبيب': p.doctor_share, 'تاريخ': p.date_paid} for p in payments]
-    df = pd.DataFrame(data)
-    session.close()
-    return df
-
-def export_to_pdf(df):
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    c.drawString(100, 750, "تقرير المحاسبة")
-    y = 700
-    x_positions = [100, 200, 300, 400]
-    for i, col in enumerate(df.columns):
-        c.drawString(x_positions[i], y, col)
-    y -= 20
-    for index, row in df.iterrows():
-        for i, value in enumerate(row):
-            c.drawString(x_positions[i], y, str(value))
-        y -= 20
-        if y < 50:
-            c.showPage()
-            y = 750
-    c.save()
-    buffer.seek(0)
-    return buffer
-
-def export_to_excel(df):
-    buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False)
-    buffer.seek(0)
-    return buffer
+# Database setup (tuned engine from database.py; set CURA_DATABASE_ECHO=1 to log SQL)
+from database import engine, begin_request
+
+# Schema upgrade (indexes, search index), data functions and reports shared with functions.py / reports.py
+from migrations import upgrade
+from functions import (add_patient, edit_patient, delete_patient,
+                       add_doctor, edit_doctor, delete_doctor, get_doctors,
+                       add_treatment, edit_treatment, delete_treatment, get_treatments,
+                       add_treatment_percentage, add_appointment, edit_appointment, delete_appointment,
+                       add_payment, add_payout, get_payouts,
+                       get_patient, get_doctor, get_treatment, get_appointment,
+                       CALENDAR_VIEWS, calendar_window, search_patients)
+from readmodel import (patients_frame, doctors_frame, treatments_frame, appointments_frame, payments_frame,
+                       calendar_frame)
+from reports import PERIODS, GROUPINGS, aggregate_report, export_to_excel, pdf_font_path
+from receivables import (receivables_report, receivables_summary, patient_receivables, AGING_BUCKETS,
+                         RECEIVABLE_LABELS)
+from jobs import export_jobs
+from images import get_thumbnail, get_preview
+from importer import ENTITIES, import_file, errors_frame
+from settlement import PeriodClosed, close_period, doctor_statement, doctor_balances, get_settlement_periods, next_month
+from scheduling import AppointmentConflict, scheduler, default_duration
+from instrumentation import diagnostics, N_PLUS_ONE_THRESHOLD
+from cache import reference_cache
+
+upgrade(engine)
+
+# One session per script run: everything the page loads stays attached to it until the next rerun
+begin_request(st.session_state)
 
 # Streamlit App
 st.set_page_config(layout="wide", page_title="إدارة عيادة الأسنان 🦷", page_icon="🦷")
@@ -357,9 +84,77 @@ elif ui_width < 1000:
 else:
     num_cols = 3  # Desktop
 
+# Server-side pagination: keeps a stack of keyset cursors per table in session_state
+# (reset whenever the filters change)
+def paginated(key, fetch, filters=None, page_size=50):
+    if st.session_state.get(f"{key}_filters") != filters:
+        st.session_state[f"{key}_filters"] = filters
+        st.session_state[f"{key}_cursors"] = [None]
+    cursors = st.session_state.setdefault(f"{key}_cursors", [None])
+    page = fetch(cursor=cursors[-1], page_size=page_size)
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if len(cursors) > 1 and st.button("السابق ⬅️", key=f"{key}_prev"):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        st.caption(f"صفحة {len(cursors)}")
+    with col3:
+        if page.next_cursor is not None and st.button("التالي ➡️", key=f"{key}_next"):
+            cursors.append(page.next_cursor)
+            st.rerun()
+    return page
+
+# Searchable patient picker: loads at most PICKER_LIMIT matches instead of the whole registry.
+# Must be placed outside st.form so typing in the search box reruns the page.
+PICKER_LIMIT = 20
+
+def patient_picker(key, selected_id=None):
+    term = st.text_input("بحث عن مريض (الاسم أو الهاتف) 🔍", key=f"{key}_search")
+    options = [(f"{p.name} - {p.phone or ''} (#{p.id})", p.id) for p in search_patients(term, limit=PICKER_LIMIT)]
+    ids = [option[1] for option in options]
+    if selected_id is not None and selected_id not in ids:
+        current = get_patient(selected_id)
+        if current:
+            options.insert(0, (f"{current.name} - {current.phone or ''} (#{current.id})", current.id))
+            ids.insert(0, current.id)
+    index = ids.index(selected_id) if selected_id in ids else 0
+    return st.selectbox("المريض", options=options, format_func=lambda x: x[0], index=index, key=f"{key}_select")
+
+CALENDAR_LABELS = {"day": "يوم", "week": "أسبوع"}
+
+# Receivables page shows the largest balances only; exports contain every patient
+RECEIVABLES_DISPLAY_LIMIT = 500
+
+# Payments table: read-model columns -> displayed headers
+PAYMENT_LABELS = {'id': 'id', 'appointment_id': 'موعد', 'total_amount': 'إجمالي', 'paid_amount': 'مدفوع',
+                  'clinic_share': 'نصيب العيادة', 'doctor_share': 'نصيب الطبيب'}
+
+EXPORT_FORMATS = {
+    "Excel": ("excel", "report.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "PDF": ("pdf", "report.pdf", "application/pdf"),
+    "CSV": ("csv", "report.csv", "text/csv"),
+    "Parquet": ("parquet", "report.parquet", "application/octet-stream"),
+}
+
+IMPORT_ENTITIES = {
+    "patients": "المرضى",
+    "doctors": "الأطباء",
+    "treatments": "العلاجات",
+    "appointments": "المواعيد",
+    "payments": "الدفعات",
+}
+
 st.sidebar.title("مرحباً بك في نظام إدارة العيادة الأسنانية 🦷")
 
-page = st.sidebar.selectbox("اختر القسم", ["إدارة المرضى 👥", "إدارة الأطباء 👨‍⚕️", "إدارة خطط العلاج 💊", "إدارة المواعيد 📅", "المحاسبة 💰", "التقارير 📊"])
+PAGES = ["إدارة المرضى 👥", "إدارة الأطباء 👨‍⚕️", "إدارة خطط العلاج 💊", "إدارة المواعيد 📅", "المحاسبة 💰", "التقارير 📊", "الذمم المدينة 🧾", "استيراد البيانات 📥"]
+# Hidden admin page: open the app with ?diagnostics=1
+if st.query_params.get("diagnostics") == "1":
+    PAGES.append("التشخيص 🩺")
+page = st.sidebar.selectbox("اختر القسم", PAGES)
+
+# Per-run query counters (instrumentation.py); the previous run's summary goes to the JSON log
+diagnostics.begin_run(st.session_state, page)
 
 if page == "إدارة المرضى 👥":
     st.title("إدارة المرضى 👥")
@@ -382,19 +177,21 @@ if page == "إدارة المرضى 👥":
                 add_patient(name, age, gender, phone, address, medical_history, image)
                 st.success("تم إضافة المريض ✅")
 
-    # Search and display
-    patients = get_patients()
-    df = pd.DataFrame([{'id': p.id, 'name': p.name, 'age': p.age, 'gender': p.gender, 'phone': p.phone, 'address': p.address} for p in patients])
+    # Search and display (one page at a time)
     search_term = st.text_input("بحث عن مريض 🔍")
-    if search_term:
-        df = df[df.apply(lambda row: search_term.lower() in ' '.join(row.astype(str)).lower(), axis=1)]
+    df = paginated("patients", lambda **kw: patients_frame(search=search_term, **kw), filters=search_term).items
     st.dataframe(df, use_container_width=True)
 
     # Edit/Delete
     with st.expander("تعديل أو حذف مريض ✏️🗑️"):
         patient_id = st.number_input("معرف المريض للتعديل/الحذف", min_value=1)
-        patient = next((p for p in patients if p.id == patient_id), None)
+        patient = get_patient(patient_id)
         if patient:
+            thumbnail = get_thumbnail(patient.image_path)
+            if thumbnail:
+                st.image(thumbnail, caption="صورة الأشعة الحالية")
+                if st.checkbox("عرض الصورة بحجم أكبر", key="patient_preview"):
+                    st.image(get_preview(patient.image_path))
             with st.form("تعديل مريض"):
                 name = st.text_input("الاسم", value=patient.name)
                 age = st.number_input("العمر", value=patient.age)
@@ -410,8 +207,11 @@ if page == "إدارة المرضى 👥":
                         st.success("تم التعديل ✅")
                 with col2:
                     if st.form_submit_button("حذف"):
-                        delete_patient(patient_id)
-                        st.success("تم الحذف ✅")
+                        try:
+                            delete_patient(patient_id)
+                            st.success("تم الحذف ✅")
+                        except IntegrityError:
+                            st.error("لا يمكن الحذف: توجد سجلات مرتبطة ⚠️")
 
 # Similar enhancements for other sections (doctors, treatments, appointments) - abbreviated for brevity
 if page == "إدارة الأطباء 👨‍⚕️":
@@ -430,16 +230,13 @@ if page == "إدارة الأطباء 👨‍⚕️":
                 add_doctor(name, specialty, phone, email)
                 st.success("تم إضافة الطبيب ✅")
 
-    doctors = get_doctors()
-    df = pd.DataFrame([{'id': d.id, 'name': d.name, 'specialty': d.specialty, 'phone': d.phone, 'email': d.email} for d in doctors])
     search_term = st.text_input("بحث عن طبيب 🔍")
-    if search_term:
-        df = df[df.apply(lambda row: search_term.lower() in ' '.join(row.astype(str)).lower(), axis=1)]
+    df = paginated("doctors", lambda **kw: doctors_frame(search=search_term, **kw), filters=search_term).items
     st.dataframe(df, use_container_width=True)
 
     with st.expander("تعديل أو حذف طبيب ✏️🗑️"):
         doctor_id = st.number_input("معرف الطبيب", min_value=1)
-        doctor = next((d for d in doctors if d.id == doctor_id), None)
+        doctor = get_doctor(doctor_id)
         if doctor:
             with st.form("تعديل طبيب"):
                 name = st.text_input("الاسم", value=doctor.name)
@@ -453,8 +250,11 @@ if page == "إدارة الأطباء 👨‍⚕️":
                         st.success("تم التعديل ✅")
                 with col2:
                     if st.form_submit_button("حذف"):
-                        delete_doctor(doctor_id)
-                        st.success("تم الحذف ✅")
+                        try:
+                            delete_doctor(doctor_id)
+                            st.success("تم الحذف ✅")
+                        except IntegrityError:
+                            st.error("لا يمكن الحذف: توجد سجلات مرتبطة ⚠️")
 
 if page == "إدارة خطط العلاج 💊":
     st.title("إدارة خطط العلاج 💊")
@@ -462,35 +262,38 @@ if page == "إدارة خطط العلاج 💊":
         with st.form("إضافة علاج"):
             name = st.text_input("اسم العلاج")
             base_cost = st.number_input("التكلفة الأساسية", min_value=0.0)
+            duration = st.number_input("مدة الموعد (دقيقة)", min_value=0, value=30, step=5)
             if st.form_submit_button("إضافة"):
-                add_treatment(name, base_cost)
+                add_treatment(name, base_cost, duration or None)
                 st.success("تم إضافة العلاج ✅")
 
-    treatments = get_treatments()
-    df = pd.DataFrame([{'id': t.id, 'name': t.name, 'base_cost': t.base_cost} for t in treatments])
     search_term = st.text_input("بحث عن علاج 🔍")
-    if search_term:
-        df = df[df.apply(lambda row: search_term.lower() in ' '.join(row.astype(str)).lower(), axis=1)]
+    df = paginated("treatments", lambda **kw: treatments_frame(search=search_term, **kw), filters=search_term).items
     st.dataframe(df, use_container_width=True)
 
     with st.expander("تعديل أو حذف علاج ✏️🗑️"):
         treatment_id = st.number_input("معرف العلاج", min_value=1)
-        treatment = next((t for t in treatments if t.id == treatment_id), None)
+        treatment = get_treatment(treatment_id)
         if treatment:
             with st.form("تعديل علاج"):
                 name = st.text_input("اسم العلاج", value=treatment.name)
                 base_cost = st.number_input("التكلفة الأساسية", value=treatment.base_cost)
+                duration = st.number_input("مدة الموعد (دقيقة)", min_value=0, value=treatment.duration or 0, step=5)
                 col1, col2 = st.columns(2)
                 with col1:
                     if st.form_submit_button("تعديل"):
-                        edit_treatment(treatment_id, name, base_cost)
+                        edit_treatment(treatment_id, name, base_cost, duration or None)
                         st.success("تم التعديل ✅")
                 with col2:
                     if st.form_submit_button("حذف"):
-                        delete_treatment(treatment_id)
-                        st.success("تم الحذف ✅")
+                        try:
+                            delete_treatment(treatment_id)
+                            st.success("تم الحذف ✅")
+                        except IntegrityError:
+                            st.error("لا يمكن الحذف: توجد سجلات مرتبطة ⚠️")
 
     st.subheader("تخصيص النسب المئوية 📊")
+    treatments = get_treatments()
     doctors = get_doctors()
     with st.form("إضافة نسب"):
         treatment_opt = st.selectbox("العلاج", options=[(t.name, t.id) for t in treatments], format_func=lambda x: x[0])
@@ -503,14 +306,13 @@ if page == "إدارة خطط العلاج 💊":
 
 if page == "إدارة المواعيد 📅":
     st.title("إدارة المواعيد 📅")
+    doctors = get_doctors()
+    treatments = get_treatments()
     with st.expander("إضافة موعد جديد ➕", expanded=True):
+        patient_opt = patient_picker("new_appointment")
         with st.form("إضافة موعد"):
-            patients = get_patients()
-            doctors = get_doctors()
-            treatments = get_treatments()
             cols = st.columns(num_cols)
             with cols[0]:
-                patient_opt = st.selectbox("المريض", options=[(p.name, p.id) for p in patients], format_func=lambda x: x[0])
                 doctor_opt = st.selectbox("الطبيب", options=[(d.name, d.id) for d in doctors], format_func=lambda x: x[0])
             if num_cols > 1:
                 with cols[1]:
@@ -519,78 +321,321 @@ if page == "إدارة المواعيد 📅":
             if num_cols > 2:
                 with cols[2]:
                     time = st.time_input("الوقت")
+            duration = st.number_input("المدة (دقيقة)", min_value=0, value=0, step=5, help="0 = المدة الافتراضية للعلاج")
             status = st.selectbox("الحالة", ["مؤكد", "ملغى", "قيد الانتظار"])
             notes = st.text_area("ملاحظات")
             if st.form_submit_button("إضافة"):
                 full_date = datetime.datetime.combine(date, time)
-                add_appointment(patient_opt[1], doctor_opt[1], treatment_opt[1], full_date, status, notes)
-                st.success("تم إضافة الموعد ✅")
+                if patient_opt is None:
+                    st.error("اختر المريض أولاً ⚠️")
+                else:
+                    try:
+                        add_appointment(patient_opt[1], doctor_opt[1], treatment_opt[1], full_date, status, notes, duration or None)
+                        st.success("تم إضافة الموعد ✅")
+                    except AppointmentConflict as e:
+                        st.error(f"{e} ⚠️")
+
+    with st.expander("أقرب وقت متاح 🔎"):
+        # Free-slot search over the in-memory per-doctor schedule index (scheduling.py)
+        cols = st.columns(2)
+        with cols[0]:
+            slot_doctor = st.selectbox("الطبيب", options=[("أي طبيب", None)] + [(d.name, d.id) for d in doctors], format_func=lambda x: x[0], key="slot_doctor")
+            slot_treatment = st.selectbox("العلاج", options=[(t.name, t.id) for t in treatments], format_func=lambda x: x[0], key="slot_treatment")
+        with cols[1]:
+            slot_date = st.date_input("ابتداءً من", key="slot_date")
+            slot_count = st.number_input("عدد الأوقات", min_value=1, max_value=50, value=10, key="slot_count")
+        if st.button("بحث عن وقت متاح") and slot_treatment:
+            slot_after = max(datetime.datetime.combine(slot_date, datetime.time.min), datetime.datetime.now())
+            slot_doctors = None if slot_doctor[1] is None else [slot_doctor[1]]
+            slots = scheduler.find_free_slots(default_duration(slot_treatment[1]), slot_after, slot_doctors, limit=slot_count)
+            doctor_names = {d.id: d.name for d in doctors}
+            if slots:
+                st.dataframe(pd.DataFrame([{'الطبيب': doctor_names.get(slot.doctor_id), 'من': slot.start, 'إلى': slot.end} for slot in slots]), use_container_width=True)
+            else:
+                st.info("لا توجد أوقات متاحة في الفترة القادمة")
+
+    # Calendar: only the appointments of the visible window (day/week, optionally one doctor) are loaded
+    st.subheader("التقويم 🗓️")
+    cols = st.columns(3)
+    with cols[0]:
+        view = st.radio("العرض", list(CALENDAR_VIEWS), format_func=CALENDAR_LABELS.get, horizontal=True)
+    with cols[1]:
+        calendar_day = st.date_input("اليوم", key="calendar_day")
+    with cols[2]:
+        calendar_doctor = st.selectbox("الطبيب", options=[("كل الأطباء", None)] + [(d.name, d.id) for d in doctors], format_func=lambda x: x[0], key="calendar_doctor")
+    window_start, window_days = calendar_window(calendar_day, view)
+    calendar_appointments = calendar_frame(window_start, window_days, calendar_doctor[1])
+    if not calendar_appointments.empty:
+        # Rows = time of day, columns = doctor (day view) or day (week view)
+        column = 'الطبيب' if view == 'day' else 'اليوم'
+        show_doctor = view == 'week' and calendar_doctor[1] is None
+        doctor_names = calendar_appointments['doctor'].fillna('')
+        label = ("#" + calendar_appointments['id'].astype(str) + " " + calendar_appointments['patient'].fillna('')
+                 + " (" + calendar_appointments['treatment'].fillna('') + ")")
+        if show_doctor:
+            label = label + (" - " + doctor_names).where(doctor_names != '', '')
+        label = label + pd.Series(" ❌", index=label.index).where(calendar_appointments['status'] == "ملغى", '')
+        calendar_df = pd.DataFrame({
+            'الوقت': calendar_appointments['date'].dt.strftime('%H:%M'),
+            'اليوم': calendar_appointments['date'].dt.strftime('%a %Y-%m-%d'),
+            'الطبيب': doctor_names,
+            'الموعد': label.astype(object),
+        })
+        grid = calendar_df.pivot_table(index='الوقت', columns=column, values='الموعد', aggfunc=' / '.join, sort=False)
+        st.dataframe(grid.sort_index().fillna(''), use_container_width=True)
+    else:
+        st.info("لا توجد مواعيد في هذه الفترة")
 
-    appointments = get_appointments()
-    df = pd.DataFrame([{'id': a.id, 'patient': a.patient.name if a.patient else '', 'doctor': a.doctor.name if a.doctor else '', 'treatment': a.treatment.name if a.treatment else '', 'date': a.date, 'status': a.status} for a in appointments])
     search_term = st.text_input("بحث عن موعد 🔍")
-    if search_term:
-        df = df[df.apply(lambda row: search_term.lower() in ' '.join(row.astype(str)).lower(), axis=1)]
+    df = paginated("appointments", lambda **kw: appointments_frame(search=search_term, **kw), filters=search_term).items
     st.dataframe(df, use_container_width=True)
 
     with st.expander("تعديل أو حذف موعد ✏️🗑️"):
         appointment_id = st.number_input("معرف الموعد", min_value=1)
-        appointment = next((a for a in appointments if a.id == appointment_id), None)
+        appointment = get_appointment(appointment_id)
         if appointment:
+            patient_opt = patient_picker("edit_appointment", appointment.patient_id)
             with st.form("تعديل موعد"):
-                patient_opt = st.selectbox("المريض", options=[(p.name, p.id) for p in patients], format_func=lambda x: x[0], index=[p.id for p in patients].index(appointment.patient_id))
                 doctor_opt = st.selectbox("الطبيب", options=[(d.name, d.id) for d in doctors], format_func=lambda x: x[0], index=[d.id for d in doctors].index(appointment.doctor_id))
                 treatment_opt = st.selectbox("العلاج", options=[(t.name, t.id) for t in treatments], format_func=lambda x: x[0], index=[t.id for t in treatments].index(appointment.treatment_id))
                 date = st.date_input("التاريخ", value=appointment.date.date())
                 time = st.time_input("الوقت", value=appointment.date.time())
                 status = st.selectbox("الحالة", ["مؤكد", "ملغى", "قيد الانتظار"], index=["مؤكد", "ملغى", "قيد الانتظار"].index(appointment.status))
                 notes = st.text_area("ملاحظات", value=appointment.notes)
+                duration = st.number_input("المدة (دقيقة)", min_value=0, value=appointment.duration or 0, step=5)
                 col1, col2 = st.columns(2)
                 with col1:
                     if st.form_submit_button("تعديل"):
                         full_date = datetime.datetime.combine(date, time)
-                        edit_appointment(appointment_id, patient_opt[1], doctor_opt[1], treatment_opt[1], full_date, status, notes)
-                        st.success("تم التعديل ✅")
+                        try:
+                            edit_appointment(appointment_id, patient_opt[1], doctor_opt[1], treatment_opt[1], full_date, status, notes, duration or None)
+                            st.success("تم التعديل ✅")
+                        except (AppointmentConflict, PeriodClosed) as e:
+                            st.error(f"{e} ⚠️")
                 with col2:
                     if st.form_submit_button("حذف"):
-                        delete_appointment(appointment_id)
-                        st.success("تم الحذف ✅")
+                        try:
+                            delete_appointment(appointment_id)
+                            st.success("تم الحذف ✅")
+                        except IntegrityError:
+                            st.error("لا يمكن الحذف: توجد سجلات مرتبطة ⚠️")
 
 if page == "المحاسبة 💰":
     st.title("المحاسبة 💰")
-    appointments = get_appointments()
     with st.expander("إنشاء فاتورة جديدة ➕", expanded=True):
+        appointment_search = st.text_input("بحث عن موعد 🔍")
+        appointments = appointments_frame(search=appointment_search, page_size=100, columns=['id', 'patient', 'date']).items
         with st.form("إنشاء فاتورة"):
-            appointment_opt = st.selectbox("اختر الموعد", options=[(f"{a.id} - {a.patient.name if a.patient else 'غير معروف'} ({a.date})", a.id) for a in appointments], format_func=lambda x: x[0])
+            appointment_opt = st.selectbox("اختر الموعد", options=[(f"{a.id} - {a.patient if isinstance(a.patient, str) else 'غير معروف'} ({a.date})", int(a.id)) for a in appointments.itertuples()], format_func=lambda x: x[0])
             total_amount = st.number_input("المبلغ الإجمالي", min_value=0.0)
             paid_amount = st.number_input("المبلغ المدفوع", min_value=0.0)
             discounts = st.number_input("الخصومات", min_value=0.0)
             taxes = st.number_input("الضرائب", min_value=0.0)
             payment_method = st.selectbox("طريقة الدفع", ["نقدي", "بطاقة", "تحويل"])
             if st.form_submit_button("إنشاء"):
-                add_payment(appointment_opt[1], total_amount, paid_amount, payment_method, discounts, taxes)
-                st.success("تم إنشاء الفاتورة مع حساب النسب ✅")
-
-    # Display payments
-    payments = get_payments()
-    df = pd.DataFrame([{'id': p.id, 'موعد': p.appointment_id, 'إجمالي': p.total_amount, 'مدفوع': p.paid_amount, 'نصيب العيادة': p.clinic_share, 'نصيب الطبيب': p.doctor_share} for p in payments])
+                try:
+                    add_payment(appointment_opt[1], total_amount, paid_amount, payment_method, discounts, taxes)
+                    st.success("تم إنشاء الفاتورة مع حساب النسب ✅")
+                except PeriodClosed as e:
+                    st.error(f"{e} ⚠️")
+
+    # Display payments (one page at a time)
+    df = paginated("payments", lambda **kw: payments_frame(columns=list(PAYMENT_LABELS), **kw)).items.rename(columns=PAYMENT_LABELS)
     st.dataframe(df, use_container_width=True)
 
+    # Doctor settlements: balances and statements come from the monthly ledger (settlement.py), not from payments
+    st.subheader("مستحقات الأطباء 💼")
+    doctors = get_doctors()
+    doctor_names = {d.id: d.name for d in doctors}
+    balances = doctor_balances()
+    st.dataframe(pd.DataFrame([{'الطبيب': doctor_names.get(doctor_id, doctor_id), 'الرصيد المستحق': balance}
+                               for doctor_id, balance in balances.items()]), use_container_width=True)
+
+    with st.expander("صرف مستحقات ➖"):
+        with st.form("صرف مستحقات"):
+            payout_doctor = st.selectbox("الطبيب", options=[(d.name, d.id) for d in doctors], format_func=lambda x: x[0])
+            payout_amount = st.number_input("المبلغ", min_value=0.0)
+            payout_method = st.selectbox("طريقة الدفع", ["نقدي", "بطاقة", "تحويل"])
+            payout_notes = st.text_input("ملاحظات")
+            if st.form_submit_button("صرف"):
+                try:
+                    add_payout(payout_doctor[1], payout_amount, payout_method, payout_notes)
+                    st.success("تم تسجيل الصرف ✅")
+                except PeriodClosed as e:
+                    st.error(f"{e} ⚠️")
+
+    with st.expander("كشف حساب شهري 📄"):
+        cols = st.columns(2)
+        with cols[0]:
+            statement_doctor = st.selectbox("الطبيب", options=[(d.name, d.id) for d in doctors], format_func=lambda x: x[0], key="statement_doctor")
+        with cols[1]:
+            statement_month = st.date_input("الشهر", value=datetime.date.today().replace(day=1), key="statement_month")
+        if statement_doctor:
+            statement = doctor_statement(statement_doctor[1], statement_month)
+            metrics = st.columns(4)
+            metrics[0].metric("رصيد أول الشهر", f"{statement['opening_balance']:,.2f}")
+            metrics[1].metric("المستحق خلال الشهر", f"{statement['earned']:,.2f}", f"{statement['payments_count']} دفعة")
+            metrics[2].metric("المصروف", f"{statement['paid_out']:,.2f}", f"{statement['payouts_count']} صرف")
+            metrics[3].metric("رصيد آخر الشهر", f"{statement['closing_balance']:,.2f}")
+            if statement['closed']:
+                st.caption("هذا الشهر ضمن فترة مقفلة 🔒")
+            month_start = datetime.datetime.combine(statement['month'], datetime.time.min)
+            payouts = get_payouts(statement_doctor[1], month_start, datetime.datetime.combine(next_month(statement['month']), datetime.time.min))
+            if payouts:
+                st.dataframe(pd.DataFrame([{'id': p.id, 'المبلغ': p.amount, 'طريقة الدفع': p.payment_method, 'التاريخ': p.date_paid, 'ملاحظات': p.notes} for p in payouts]), use_container_width=True)
+
+    with st.expander("إقفال الفترة 🔒"):
+        previous_month = datetime.date.today().replace(day=1) - datetime.timedelta(days=1)
+        close_month = st.date_input("إقفال حتى نهاية شهر", value=previous_month.replace(day=1), max_value=previous_month,
+                                    key="close_month")
+        st.caption("بعد الإقفال لا يمكن تعديل الدفعات أو الصرف في الأشهر المقفلة")
+        if st.button("إقفال"):
+            try:
+                count = close_period(close_month)
+                st.success(f"تم إقفال الفترة لعدد {count} طبيب ✅")
+            except ValueError as e:  # فترة مقفلة بالفعل (PeriodClosed) أو شهر لم ينتهِ
+                st.error(f"{e} ⚠️")
+        periods = get_settlement_periods()
+        if periods:
+            st.dataframe(pd.DataFrame([{'الطبيب': doctor_names.get(p.doctor_id, p.doctor_id), 'من': p.period_start, 'إلى': p.period_end,
+                                        'رصيد افتتاحي': p.opening_balance, 'المستحق': p.earned, 'المصروف': p.paid_out,
+                                        'رصيد ختامي': p.closing_balance, 'تاريخ الإقفال': p.closed_at} for p in periods]), use_container_width=True)
+
 if page == "التقارير 📊":
     st.title("التقارير 📊")
     start_date = st.date_input("من تاريخ")
     end_date = st.date_input("إلى تاريخ")
+    cols = st.columns(2)
+    with cols[0]:
+        period = st.selectbox("الفترة", list(PERIODS), format_func=PERIODS.get)
+    with cols[1]:
+        group_by = st.selectbox("تجميع حسب", [None] + list(GROUPINGS), format_func=lambda g: "بدون" if g is None else GROUPINGS[g])
     if st.button("إنشاء تقرير"):
-        df = generate_report(start_date, end_date)
-        st.dataframe(df, use_container_width=True)
-        
+        st.session_state["report_params"] = (start_date, end_date, period, group_by)
+
+    if "report_params" in st.session_state:
+        report_start, report_end, report_period, report_group = st.session_state["report_params"]
+        # Aggregated in SQL: one row per period (and group), not one per payment
+        summary = aggregate_report(report_start, report_end, report_period, report_group)
+        st.dataframe(summary, use_container_width=True)
+
         # Plotly chart for revenues
-        if not df.empty:
-            fig = px.line(df, x='تاريخ', y=['إجمالي', 'نصيب العيادة', 'نصيب الطبيب'], title="الإيرادات مع مرور الوقت 📈")
+        if not summary.empty:
+            if report_group:
+                fig = px.bar(summary, x='الفترة', y='إجمالي', color=GROUPINGS[report_group], title="الإيرادات مع مرور الوقت 📈")
+            else:
+                fig = px.line(summary, x='الفترة', y=['إجمالي', 'نصيب العيادة', 'نصيب الطبيب'], title="الإيرادات مع مرور الوقت 📈")
             st.plotly_chart(fig, use_container_width=True)
-        
-        excel_buffer = export_to_excel(df)
-        st.download_button("تصدير إلى Excel 📥", data=excel_buffer, file_name="report.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-        
-        pdf_buffer = export_to_pdf(df)
-        st.download_button("تصدير إلى PDF 📥", data=pdf_buffer, file_name="report.pdf", mime="application/pdf")
+
+        # Exports run in the background job pool and only for the format requested;
+        # the same export on unchanged data is served from the job result cache
+        export_format = st.radio("صيغة التصدير", list(EXPORT_FORMATS), horizontal=True)
+        kind = EXPORT_FORMATS[export_format][0]
+        if kind == "pdf" and pdf_font_path() is None:
+            # Without an Arabic TTF the PDF falls back to Helvetica and Arabic text is unreadable
+            st.warning("لم يتم العثور على خط عربي لملفات PDF؛ حدد مسار الخط في CURA_PDF_FONT")
+        if st.button("تجهيز ملف التصدير"):
+            st.session_state["export_job"] = (export_format, export_jobs.submit(kind, report_start, report_end).key)
+        job_format, job_key = st.session_state.get("export_job", (None, None))
+        job = export_jobs.get(job_key)
+        if job is not None:
+            if not job.done():
+                st.progress(job.progress, text=f"جاري التجهيز... {job.rows_done} / {job.total_rows}")
+                sleep(0.5)
+                st.rerun()
+            elif job.error is not None:
+                st.error(f"فشل التصدير: {job.error}")
+            else:
+                _, job_file_name, job_mime = EXPORT_FORMATS[job_format]
+                with open(job.path, "rb") as export_file:
+                    st.download_button(f"تنزيل {job_format} 📥", data=export_file, file_name=job_file_name, mime=job_mime)
+
+if page == "استيراد البيانات 📥":
+    st.title("استيراد البيانات 📥")
+    # Bulk import from CSV/XLSX (see importer.py); column names match the model fields
+    entity = st.selectbox("نوع البيانات", list(IMPORT_ENTITIES), format_func=IMPORT_ENTITIES.get)
+    _, entity_columns, entity_required, _ = ENTITIES[entity]
+    st.caption(f"الأعمدة: {', '.join(entity_columns)} — المطلوبة: {', '.join(entity_required)}")
+    upload = st.file_uploader("ملف CSV أو Excel", type=["csv", "xlsx"])
+    if upload and st.button("استيراد"):
+        status = st.empty()
+        try:
+            result = import_file(entity, upload, progress=lambda rows: status.info(f"جاري الاستيراد... تمت معالجة {rows} صف"))
+        except ValueError as e:
+            status.empty()
+            st.error(str(e))
+        else:
+            status.empty()
+            st.success(f"تمت إضافة {result.inserted} صف")
+            if result.errors:
+                st.warning(f"عدد الصفوف المرفوضة: {len(result.errors)}")
+                errors = errors_frame(result.errors)
+                st.dataframe(errors, use_container_width=True)
+                st.download_button("تنزيل الأخطاء 📥", data=errors.to_csv(index=False).encode("utf-8-sig"),
+                                   file_name=f"import_errors_{entity}.csv", mime="text/csv")
+
+if page == "الذمم المدينة 🧾":
+    st.title("الذمم المدينة 🧾")
+    as_of = st.date_input("حتى تاريخ", value=datetime.date.today(), key="receivables_as_of")
+    # Totals and per-patient balances are grouped in SQL over unpaid payments only (partial index)
+    summary = receivables_summary(as_of)
+    metrics = st.columns(len(AGING_BUCKETS) + 2)
+    metrics[0].metric("عدد المرضى", summary['patients'])
+    metrics[1].metric("إجمالي المستحق", f"{summary['balance']:,.2f}")
+    for column, (bucket, _) in zip(metrics[2:], AGING_BUCKETS):
+        column.metric(RECEIVABLE_LABELS[bucket], f"{summary[bucket]:,.2f}")
+    aging = pd.DataFrame({'الفترة': [RECEIVABLE_LABELS[b] for b, _ in AGING_BUCKETS], 'المبلغ': [summary[b] for b, _ in AGING_BUCKETS]})
+    st.plotly_chart(px.bar(aging, x='الفترة', y='المبلغ', title="أعمار الديون"), use_container_width=True)
+
+    # Only the displayed top balances are queried on each rerun; the full export is built on request
+    receivables = receivables_report(as_of, limit=RECEIVABLES_DISPLAY_LIMIT).rename(columns=RECEIVABLE_LABELS)
+    st.caption(f"أعلى {RECEIVABLES_DISPLAY_LIMIT} رصيد (الملف المُصدَّر يحتوي كل المرضى)")
+    st.dataframe(receivables, use_container_width=True)
+    receivables_format = st.radio("صيغة التصدير", ["CSV", "Excel"], horizontal=True, key="receivables_format")
+    if st.button("تجهيز ملف التصدير", key="receivables_export_button"):
+        full = receivables_report(as_of).rename(columns=RECEIVABLE_LABELS)
+        data = full.to_csv(index=False).encode("utf-8-sig") if receivables_format == "CSV" else export_to_excel(full).getvalue()
+        st.session_state["receivables_export"] = (as_of, receivables_format, data)
+    export_as_of, export_format, export_data = st.session_state.get("receivables_export", (None, None, None))
+    if export_as_of == as_of and export_format == receivables_format:
+        if export_format == "CSV":
+            st.download_button("تصدير CSV 📥", data=export_data, file_name=f"receivables_{as_of}.csv", mime="text/csv")
+        else:
+            st.download_button("تصدير Excel 📥", data=export_data, file_name=f"receivables_{as_of}.xlsx",
+                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+    with st.expander("فواتير مريض غير مسددة 🔍"):
+        receivable_patient = patient_picker("receivables")
+        if receivable_patient:
+            invoices = patient_receivables(receivable_patient[1], as_of)
+            st.dataframe(pd.DataFrame(invoices, columns=['رقم الدفعة', 'الموعد', 'التاريخ', 'المستحق', 'المدفوع', 'المتبقي']), use_container_width=True)
+
+if page == "التشخيص 🩺":
+    st.title("التشخيص 🩺")
+    runs = diagnostics.run_stats()
+    st.subheader("آخر تشغيلات الصفحات")
+    st.caption(f"n_plus_one = استعلامات تكررت {N_PLUS_ONE_THRESHOLD} مرات أو أكثر في نفس التشغيل")
+    st.dataframe(pd.DataFrame(runs), use_container_width=True)
+
+    st.subheader("الاستعلامات (حسب البصمة)")
+    queries = pd.DataFrame(diagnostics.query_stats())
+    st.dataframe(queries, use_container_width=True)
+    if not queries.empty:
+        fig = px.bar(queries.head(15), x='fingerprint', y='total_ms', hover_data=['count', 'avg_ms', 'sql'], title="أبطأ الاستعلامات (الزمن الكلي)")
+        st.plotly_chart(fig, use_container_width=True)
+
+    st.subheader("خطط التنفيذ (EXPLAIN QUERY PLAN)")
+    st.caption("للاستعلامات البطيئة؛ full_scans = مرور كامل على جدول المواعيد أو الدفعات بدون فهرس")
+    st.dataframe(pd.DataFrame(diagnostics.plan_stats()), use_container_width=True)
+
+    st.subheader("عمليات التقارير والتصدير")
+    st.dataframe(pd.DataFrame(diagnostics.operation_stats()), use_container_width=True)
+
+    st.subheader("الذاكرة المؤقتة")
+    cache_stats = reference_cache.stats()
+    cache_stats["export_jobs"] = {"hits": export_jobs.hits, "misses": export_jobs.misses}
+    st.json(cache_stats)
+
+    if st.button("تصفير الإحصائيات"):
+        diagnostics.reset()
+        st.rerun()
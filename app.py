@@ -1,13 +1,19 @@
 import streamlit as st
-import pandas as pd
 import datetime
-from database import engine, Base, Session
+from database import engine, begin_request
 from models import *  # Import all models to create tables
+from migrations import upgrade
 from functions import *
 from reports import generate_report, export_to_pdf, export_to_excel
+from instrumentation import diagnostics
+from readmodel import patients_frame, doctors_frame, appointments_frame
+from scheduling import AppointmentConflict
 
-# Create tables if not exist
-Base.metadata.create_all(engine)
+# Create tables if not exist and add missing indexes to existing databases
+upgrade(engine)
+
+# جلسة واحدة لكل تشغيل للصفحة (الكائنات المعروضة تبقى مرتبطة بها)
+begin_request(st.session_state)
 
 # CSS لدعم RTL (العربية)
 st.markdown("""
@@ -24,6 +30,9 @@ st.sidebar.title("مرحباً بك في نظام إدارة العيادة")
 
 page = st.sidebar.selectbox("اختر القسم", ["إدارة المرضى", "إدارة الأطباء", "إدارة خطط العلاج", "إدارة المواعيد", "المحاسبة", "التقارير"])
 
+# عدّ الاستعلامات لكل تشغيل (تنبيه N+1 في سجل التشخيص)
+diagnostics.begin_run(st.session_state, page)
+
 if page == "إدارة المرضى":
     st.title("إدارة المرضى")
     with st.form("إضافة مريض"):
@@ -39,8 +48,7 @@ if page == "إدارة المرضى":
             st.success("تم إضافة المريض")
     
     # عرض المرضى
-    patients = get_patients()
-    df = pd.DataFrame([{'id': p.id, 'name': p.name, 'age': p.age, 'phone': p.phone} for p in patients])
+    df = patients_frame(page_size=None, columns=['id', 'name', 'age', 'phone']).items
     st.dataframe(df)
     
     # يمكن إضافة تعديل/حذف هنا
@@ -56,8 +64,7 @@ if page == "إدارة الأطباء":
             add_doctor(name, specialty, phone, email)
             st.success("تم إضافة الطبيب")
     
-    doctors = get_doctors()
-    df = pd.DataFrame([{'id': d.id, 'name': d.name, 'specialty': d.specialty} for d in doctors])
+    df = doctors_frame(page_size=None, columns=['id', 'name', 'specialty']).items
     st.dataframe(df)
 
 if page == "إدارة خطط العلاج":
@@ -96,18 +103,20 @@ if page == "إدارة المواعيد":
         notes = st.text_area("ملاحظات")
         if st.form_submit_button("إضافة"):
             full_date = datetime.datetime.combine(date, time)
-            add_appointment(patient_id[1], doctor_id[1], treatment_id[1], full_date, status, notes)
-            st.success("تم إضافة الموعد")
+            try:
+                add_appointment(patient_id[1], doctor_id[1], treatment_id[1], full_date, status, notes)
+                st.success("تم إضافة الموعد")
+            except AppointmentConflict as e:
+                st.error(str(e))
     
-    appointments = get_appointments()
-    df = pd.DataFrame([{'id': a.id, 'patient': a.patient.name, 'doctor': a.doctor.name, 'treatment': a.treatment.name, 'date': a.date} for a in appointments])
+    df = appointments_frame(page_size=None, descending=False, columns=['id', 'patient', 'doctor', 'treatment', 'date']).items
     st.dataframe(df)
 
 if page == "المحاسبة":
     st.title("المحاسبة")
-    appointments = get_appointments()
+    appointments = appointments_frame(page_size=None, descending=False, columns=['id', 'patient']).items
     with st.form("إنشاء فاتورة"):
-        appointment_opt = st.selectbox("اختر الموعد", options=[(f"{a.id} - {a.patient.name}", a.id) for a in appointments], format_func=lambda x: x[0])
+        appointment_opt = st.selectbox("اختر الموعد", options=[(f"{a.id} - {a.patient}", int(a.id)) for a in appointments.itertuples()], format_func=lambda x: x[0])
         total_amount = st.number_input("المبلغ الإجمالي", min_value=0.0)
         paid_amount = st.number_input("المبلغ المدفوع", min_value=0.0)
         discounts = st.number_input("الخصومات", min_value=0.0)
@@ -0,0 +1,254 @@
+# قياس أداء طبقة البيانات والتقارير على بيانات تجريبية (synthetic.py) بأحجام مختلفة في ملف SQLite على القرص
+#   python benchmark.py [--sizes small medium large] [--baseline benchmark_baseline.json] [--save-baseline]
+# كل حجم يُقاس في عملية منفصلة (ذاكرة مؤقتة ومحرك قاعدة بيانات جديدان)، وقاعدة البيانات المولدة تُحفظ
+# في CURA_BENCH_DIR لإعادة استخدامها. أي قياس أبطأ من الأساس بأكثر من --threshold يُعتبر تراجعاً (exit 1)،
+# وكذلك ظهور N+1 أو مرور كامل على appointments/payments لم يكن في الأساس (instrumentation.py)
+# --postgres URL: نفس القياسات أيضاً على PostgreSQL (قاعدة فارغة مخصصة للقياس: تُحذف جداولها ويُعاد توليدها
+# عند تغيير الحجم أو البذرة) مع جدول مقارنة SQLite / PostgreSQL
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.environ.get('CURA_BENCH_DIR', 'bench_data')
+BASELINE_PATH = 'benchmark_baseline.json'
+DEFAULT_THRESHOLD = 1.25  # أبطأ بـ 25% = تراجع
+MIN_DELTA = 0.002  # فروق أقل من 2ms تُعتبر ضوضاء قياس
+MIN_ROUNDS = 3
+MAX_ROUNDS = 50
+TIME_BUDGET = 2.0  # ثوانٍ لكل قياس (القياسات البطيئة تُقاس مرة واحدة)
+
+def _measure(name, func):
+    # تشغيل تمهيدي (غير محسوب، مع عدّ الاستعلامات وخطط تنفيذها) ثم عدة جولات حتى الحد الزمني
+    from instrumentation import diagnostics
+    with diagnostics.watch(name) as run:
+        started = time.perf_counter()
+        func()
+        first = time.perf_counter() - started
+    timings = []
+    rounds = MIN_ROUNDS if first * MIN_ROUNDS <= TIME_BUDGET else 1
+    while len(timings) < rounds or (len(timings) < MAX_ROUNDS and sum(timings) + first < TIME_BUDGET):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return {'median': statistics.median(timings), 'min': min(timings), 'rounds': len(timings),
+            'queries': run.queries, 'n_plus_one': len(run.suspects()), 'full_scans': run.scanned_tables()}
+
+def _suite(end_date):
+    # المسارات المقاسة: (الاسم، دالة بدون معاملات)
+    from functions import (get_appointments, list_appointments, list_patients, search_patients, get_calendar,
+                           calculate_shares, calculate_shares_batch)
+    from reports import generate_report, aggregate_report, export_to_pdf, export_to_excel, export_report_csv
+    from readmodel import appointments_frame, calendar_frame
+    from scheduling import scheduler
+    from settlement import doctor_statement, doctor_balances
+    from receivables import receivables_report, receivables_summary
+    from database import unit_of_work
+    from models import Appointment
+
+    year_start = end_date - datetime.timedelta(days=365)
+    month_start = end_date - datetime.timedelta(days=30)
+    month_df = generate_report(month_start, end_date)
+    with unit_of_work() as session:
+        ids = [row[0] for row in session.query(Appointment.id).order_by(Appointment.id.desc()).limit(10000)]
+
+    def check_slots():
+        when = datetime.datetime.combine(end_date, datetime.time(10))
+        for doctor_id in range(1, 6):
+            scheduler.find_free_slots(30, when, [doctor_id], limit=5)
+
+    def shares_batch():
+        with unit_of_work() as session:
+            calculate_shares_batch(session, ids, [500.0] * len(ids), 0, 0)
+
+    def export_csv():
+        os.remove(export_report_csv(year_start, end_date))
+
+    return [
+        ('get_appointments', get_appointments),
+        ('list_appointments_page', lambda: list_appointments()),
+        ('appointments_frame_page', lambda: appointments_frame()),
+        ('appointments_frame_all', lambda: appointments_frame(page_size=None)),
+        ('search_patients_list', lambda: list_patients(search='محمد')),
+        ('search_patients_picker', lambda: search_patients('سارة', limit=20)),
+        ('search_appointments', lambda: list_appointments(search='متابعة')),
+        ('calendar_week', lambda: get_calendar(end_date - datetime.timedelta(days=6), 7)),
+        ('calendar_frame_week', lambda: calendar_frame(end_date - datetime.timedelta(days=6), 7)),
+        ('calculate_shares', lambda: calculate_shares(ids[0], 500, 50, 0)),
+        ('calculate_shares_batch_10k', shares_batch),
+        ('free_slots', check_slots),
+        ('doctor_statement', lambda: doctor_statement(1, end_date)),
+        ('doctor_balances', doctor_balances),
+        ('receivables_report', lambda: receivables_report(end_date)),
+        ('receivables_summary', lambda: receivables_summary(end_date)),
+        ('generate_report_year', lambda: generate_report(year_start, end_date)),
+        ('aggregate_report_year', lambda: aggregate_report(year_start, end_date, 'month', 'doctor')),
+        ('export_to_pdf_month', lambda: export_to_pdf(month_df)),
+        ('export_to_excel_month', lambda: export_to_excel(month_df)),
+        ('export_report_csv_year', export_csv),
+    ]
+
+def _postgres_data(url, size, seed):
+    # قاعدة PostgreSQL تحتوي حجماً واحداً فقط: آخر بيانات مولدة مسجلة في BENCH_DIR
+    from database import Base, make_engine
+    from synthetic import generate
+    state_path = os.path.join(BENCH_DIR, 'postgresql_data.json')
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        if state['size'] == size and state['seed'] == seed:
+            return state['meta']
+    engine = make_engine(url)
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+    started = time.perf_counter()
+    meta = generate(url, size, seed)
+    meta['generate_seconds'] = time.perf_counter() - started
+    with open(state_path, 'w') as f:
+        json.dump({'size': size, 'seed': seed, 'meta': meta}, f)
+    return meta
+
+def run_size(size, seed, postgres=None):
+    # يُنفَّذ داخل العملية الفرعية بعد ضبط CURA_DATABASE_URL
+    from synthetic import generate
+    path = os.path.join(BENCH_DIR, f"cura_{size}_{seed}.db")
+    meta_path = path + '.json'
+    if postgres:
+        meta = _postgres_data(postgres, size, seed)
+    elif not os.path.exists(meta_path):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        started = time.perf_counter()
+        meta = generate(f"sqlite:///{path}", size, seed)
+        meta['generate_seconds'] = time.perf_counter() - started
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+    if not postgres:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    backend = 'postgresql' if postgres else 'sqlite'
+    results = {}
+    for name, func in _suite(datetime.date.fromisoformat(meta['end_date'])):
+        results[name] = _measure(name, func)
+        print(f"  {backend:<10} {size:<8} {name:<28} {results[name]['median'] * 1000:10.1f} ms", file=sys.stderr)
+    return {'data': meta, 'results': results}
+
+def compare(current, baseline, threshold, backend='sizes'):
+    # قائمة (الحجم، القياس، الحالي، الأساس، النسبة) للقياسات الأبطأ من الأساس بأكثر من threshold
+    # المقارنة بأقل زمن (min) لأنه الأقل تأثراً بضوضاء الجهاز. backend: 'sizes' (SQLite) أو 'postgresql'
+    regressions = []
+    for size, entry in current.get(backend, {}).items():
+        base_results = baseline.get(backend, {}).get(size, {}).get('results', {})
+        for name, result in entry['results'].items():
+            base = base_results.get(name)
+            if base and base['min'] > 0 and result['min'] - base['min'] > MIN_DELTA:
+                ratio = result['min'] / base['min']
+                if ratio > threshold:
+                    regressions.append((size, name, result['min'], base['min'], ratio))
+    return regressions
+
+def compare_queries(current, baseline, backend='sizes'):
+    # قائمة (الحجم، القياس، الوصف) لاستعلامات N+1 أو مرور كامل جديد مقارنة بالأساس
+    problems = []
+    for size, entry in current.get(backend, {}).items():
+        base_results = baseline.get(backend, {}).get(size, {}).get('results', {})
+        for name, result in entry['results'].items():
+            base = base_results.get(name)
+            if not base or 'queries' not in base:
+                continue
+            if result['n_plus_one'] > base['n_plus_one']:
+                problems.append((size, name, f"N+1 ({result['queries']} استعلام مقابل {base['queries']})"))
+            new_scans = set(result['full_scans']) - set(base['full_scans'])
+            if new_scans:
+                problems.append((size, name, f"مرور كامل على {', '.join(sorted(new_scans))}"))
+    return problems
+
+def print_backends(current):
+    # أقل زمن لكل قياس على SQLite و PostgreSQL جنباً إلى جنب
+    for size, entry in current.get('postgresql', {}).items():
+        sqlite_results = current['sizes'].get(size, {}).get('results', {})
+        print(f"{size:<8} {'القياس':<28} {'SQLite ms':>12} {'PostgreSQL ms':>14} {'النسبة':>8}")
+        for name, result in entry['results'].items():
+            base = sqlite_results.get(name)
+            sqlite_ms = f"{base['min'] * 1000:12.1f}" if base else f"{'-':>12}"
+            ratio = f"x{result['min'] / base['min']:7.2f}" if base and base['min'] > 0 else f"{'-':>8}"
+            print(f"{'':<8} {name:<28} {sqlite_ms} {result['min'] * 1000:14.1f} {ratio}")
+
+def _run_worker(size, seed, env, postgres=None):
+    handle, result_path = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+    command = [sys.executable, os.path.abspath(__file__), '--worker', size, '--seed', str(seed),
+               '--output', result_path]
+    if postgres:
+        command += ['--postgres', postgres]
+    subprocess.run(command, env=env, check=True)
+    with open(result_path) as f:
+        result = json.load(f)
+    os.remove(result_path)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="قياس أداء طبقة البيانات والتقارير")
+    parser.add_argument('--sizes', nargs='+', default=['small', 'medium'])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--output', help="حفظ نتائج هذا التشغيل في ملف JSON")
+    parser.add_argument('--postgres', metavar='URL', help="القياس أيضاً على PostgreSQL (قاعدة مخصصة للقياس)")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        with open(args.output, 'w') as f:
+            json.dump(run_size(args.worker, args.seed, args.postgres), f)
+        return 0
+
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    current = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'platform': platform.platform(), 'sizes': {}}
+    for size in args.sizes:
+        env = dict(os.environ, CURA_DATABASE_URL=f"sqlite:///{os.path.join(BENCH_DIR, f'cura_{size}_{args.seed}.db')}",
+                   CURA_IMAGE_DIR=tempfile.mkdtemp(prefix='cura-bench-'))
+        current['sizes'][size] = _run_worker(size, args.seed, env)
+        if args.postgres:
+            env = dict(env, CURA_DATABASE_URL=args.postgres, CURA_DATABASE_BACKEND='postgresql')
+            current.setdefault('postgresql', {})[size] = _run_worker(size, args.seed, env, args.postgres)
+    print_backends(current)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2, ensure_ascii=False)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=2, ensure_ascii=False)
+        print(f"تم حفظ الأساس في {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"لا يوجد ملف أساس ({args.baseline}) - استخدم --save-baseline")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = []
+    query_problems = []
+    for backend in ('sizes', 'postgresql'):
+        label = '' if backend == 'sizes' else 'postgresql / '
+        regressions += [(label + size, *rest) for size, *rest in compare(current, baseline, args.threshold, backend)]
+        query_problems += [(label + size, *rest) for size, *rest in compare_queries(current, baseline, backend)]
+    for size, name, value, base, ratio in regressions:
+        print(f"تراجع: {size} / {name}: {value * 1000:.1f} ms مقابل {base * 1000:.1f} ms (x{ratio:.2f})")
+    for size, name, message in query_problems:
+        print(f"تراجع في الاستعلامات: {size} / {name}: {message}")
+    if not regressions and not query_problems:
+        print("لا يوجد تراجع في الأداء")
+    return 1 if regressions or query_problems else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+# ذاكرة مؤقتة مشتركة على مستوى العملية للبيانات المرجعية (الأطباء، العلاجات، مصفوفة النسب)
+# هذه الجداول صغيرة ونادراً ما تتغير، لذا تُقرأ مرة واحدة ويُعاد تحميلها فقط بعد الكتابة (invalidate)
+# القيم المُرجعة لقطات ثابتة (tuples / MappingProxyType) غير مرتبطة بأي Session
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+from database import Session
+from models import Doctor, Treatment, TreatmentPercentage
+
+DoctorRow = namedtuple('DoctorRow', ['id', 'name', 'specialty', 'phone', 'email'])
+TreatmentRow = namedtuple('TreatmentRow', ['id', 'name', 'base_cost', 'duration'])
+
+def _load_doctors(session):
+    rows = session.query(Doctor.id, Doctor.name, Doctor.specialty, Doctor.phone, Doctor.email).order_by(Doctor.id)
+    return tuple(DoctorRow(*row) for row in rows)
+
+def _load_treatments(session):
+    rows = session.query(Treatment.id, Treatment.name, Treatment.base_cost, Treatment.duration).order_by(Treatment.id)
+    return tuple(TreatmentRow(*row) for row in rows)
+
+def _load_percentages(session):
+    # (treatment_id, doctor_id) -> (clinic_percentage, doctor_percentage)
+    rows = session.query(TreatmentPercentage.treatment_id, TreatmentPercentage.doctor_id,
+                         TreatmentPercentage.clinic_percentage, TreatmentPercentage.doctor_percentage)
+    return MappingProxyType({(t, d): (clinic, doctor) for t, d, clinic, doctor in rows})
+
+class ReferenceCache:
+    def __init__(self, loaders):
+        self._loaders = loaders
+        self._lock = threading.Lock()
+        self._values = {}
+        self._generations = dict.fromkeys(loaders, 0)
+        self.hits = dict.fromkeys(loaders, 0)
+        self.misses = dict.fromkeys(loaders, 0)
+
+    def get(self, name):
+        with self._lock:
+            if name in self._values:
+                self.hits[name] += 1
+                return self._values[name]
+            self.misses[name] += 1
+            generation = self._generations[name]
+        session = Session()
+        try:
+            value = self._loaders[name](session)
+        finally:
+            session.close()
+        with self._lock:
+            # لا نخزّن القيمة إذا حدث invalidate أثناء التحميل (قد تكون قديمة)
+            if self._generations[name] == generation:
+                self._values[name] = value
+        return value
+
+    def invalidate(self, *names):
+        with self._lock:
+            for name in names or tuple(self._loaders):
+                self._values.pop(name, None)
+                self._generations[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return {name: {'hits': self.hits[name], 'misses': self.misses[name], 'cached': name in self._values}
+                    for name in self._loaders}
+
+reference_cache = ReferenceCache({
+    'doctors': _load_doctors,
+    'treatments': _load_treatments,
+    'percentages': _load_percentages,
+})
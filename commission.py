@@ -0,0 +1,74 @@
+# محرك العمولات: جدول مضغوط للنسب لكل زوج (علاج، طبيب) يُبنى من الذاكرة المؤقتة للنسب،
+# وحساب نصيب العيادة والطبيب لدفعة واحدة أو لعدة دفعات في تمريرة واحدة (numpy)
+import numpy as np
+from cache import reference_cache
+
+DEFAULT_CLINIC_PERCENTAGE = 50.0
+DEFAULT_DOCTOR_PERCENTAGE = 50.0
+
+def _as_ids(values):
+    return np.array([-1 if v is None else v for v in values], dtype=np.int64)
+
+def _as_amounts(values, size):
+    if np.isscalar(values) or values is None:
+        return np.full(size, values or 0.0, dtype=float)
+    return np.nan_to_num(np.array([np.nan if v is None else v for v in values], dtype=float))
+
+def _positions(sorted_values, values):
+    # موقع كل قيمة في مصفوفة مرتبة بدون تكرار (np.searchsorted)، وأي القيم موجودة فعلاً
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=np.int64), np.zeros(len(values), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return positions, sorted_values[positions] == values
+
+def _or_default(value, default):
+    return default if value is None else value
+
+class CommissionMatrix:
+    def __init__(self, percentages):
+        # المعرفات تُضغط إلى فهارس متتالية ورمز الزوج = فهرس العلاج × عدد الأطباء + فهرس الطبيب،
+        # والنسب مرتبة حسب الرمز: الحجم = عدد النسب المعرّفة وليس (أكبر معرف علاج × أكبر معرف طبيب)
+        keys = [(t, d) for t, d in percentages if t is not None and d is not None]
+        self.treatment_ids = np.unique(np.array([t for t, _ in keys], dtype=np.int64))
+        self.doctor_ids = np.unique(np.array([d for _, d in keys], dtype=np.int64))
+        codes, _ = self._codes(_as_ids([t for t, _ in keys]), _as_ids([d for _, d in keys]))
+        order = np.argsort(codes)
+        self.codes = codes[order]
+        self.clinic = np.array([_or_default(percentages[key][0], DEFAULT_CLINIC_PERCENTAGE) for key in keys],
+                               dtype=float)[order]
+        self.doctor = np.array([_or_default(percentages[key][1], DEFAULT_DOCTOR_PERCENTAGE) for key in keys],
+                               dtype=float)[order]
+
+    def _codes(self, t, d):
+        t_index, t_found = _positions(self.treatment_ids, t)
+        d_index, d_found = _positions(self.doctor_ids, d)
+        return t_index * len(self.doctor_ids) + d_index, t_found & d_found
+
+    def lookup(self, treatment_ids, doctor_ids):
+        codes, found = self._codes(_as_ids(treatment_ids), _as_ids(doctor_ids))
+        positions, known = _positions(self.codes, codes)
+        known &= found
+        clinic_perc = np.full(len(codes), DEFAULT_CLINIC_PERCENTAGE)
+        doctor_perc = np.full(len(codes), DEFAULT_DOCTOR_PERCENTAGE)
+        clinic_perc[known] = self.clinic[positions[known]]
+        doctor_perc[known] = self.doctor[positions[known]]
+        return clinic_perc, doctor_perc
+
+    def shares(self, treatment_ids, doctor_ids, total_amounts, discounts=0, taxes=0):
+        # المبلغ الصافي = الإجمالي - الخصومات + الضرائب، ثم يُقسم حسب النسب
+        size = len(treatment_ids)
+        net_amount = _as_amounts(total_amounts, size) - _as_amounts(discounts, size) + _as_amounts(taxes, size)
+        clinic_perc, doctor_perc = self.lookup(treatment_ids, doctor_ids)
+        return net_amount * (clinic_perc / 100), net_amount * (doctor_perc / 100)
+
+_current = (None, None)
+
+def get_commission_matrix():
+    # يُعاد بناء المصفوفة فقط عندما تتغير لقطة النسب في الذاكرة المؤقتة
+    global _current
+    percentages = reference_cache.get('percentages')
+    source, matrix = _current
+    if source is not percentages:
+        matrix = CommissionMatrix(percentages)
+        _current = (percentages, matrix)
+    return matrix
@@ -1,99 +1,489 @@
 import datetime
-import os
-from database import Session
-from models import Patient, Doctor, Treatment, TreatmentPercentage, Appointment, Payment
+from collections import namedtuple
+from sqlalchemy import or_, tuple_
+from sqlalchemy.orm import joinedload
+from database import unit_of_work, after_commit
+from models import Patient, Doctor, Treatment, TreatmentPercentage, Appointment, Payment, DoctorPayout
+from cache import reference_cache
+from commission import get_commission_matrix
+from rollup import apply_payments
+from settlement import apply_payouts, open_from, check_open
+from images import acquire_image, release_image, collect_garbage
+from scheduling import scheduler, default_duration, check_conflicts, CANCELLED_STATUSES
+from search import fts_available, index_patient, index_doctor, index_appointment, unindex, match_query, match_ids
+
+# استراتيجيات التحميل المسبق: العلاقات التي تعرضها الواجهة تُقرأ في نفس الاستعلام (بدون N+1)
+APPOINTMENT_DETAILS = (
+    joinedload(Appointment.patient),
+    joinedload(Appointment.doctor),
+    joinedload(Appointment.treatment),
+)
+PAYMENT_DETAILS = (
+    joinedload(Payment.appointment).joinedload(Appointment.patient),
+)
 
 def add_patient(name, age, gender, phone, address, medical_history, image):
-    session = Session()
-    patient = Patient(name=name, age=age, gender=gender, phone=phone, address=address, medical_history=medical_history)
-    if image:
-        image_path = f"images/{name}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.png"
-        os.makedirs('images', exist_ok=True)
-        with open(image_path, "wb") as f:
-            f.write(image.getvalue())
-        patient.image_path = image_path
-    session.add(patient)
-    session.commit()
-    session.close()
+    with unit_of_work() as session:
+        patient = Patient(name=name, age=age, gender=gender, phone=phone, address=address, medical_history=medical_history)
+        if image:
+            patient.image_path = acquire_image(session, image)
+        session.add(patient)
+        session.flush()
+        index_patient(session, patient)
+
+def edit_patient(patient_id, name, age, gender, phone, address, medical_history, image):
+    with unit_of_work() as session:
+        patient = session.get(Patient, patient_id)
+        if patient:
+            patient.name = name
+            patient.age = age
+            patient.gender = gender
+            patient.phone = phone
+            patient.address = address
+            patient.medical_history = medical_history
+            unused_files = []
+            if image:
+                # الصورة الجديدة أولاً ثم تحرير القديمة (إعادة رفع نفس الصورة لا تحذفها)
+                new_path = acquire_image(session, image)
+                unused_files = release_image(session, patient.image_path)
+                patient.image_path = new_path
+            index_patient(session, patient)
+            after_commit(session, lambda: collect_garbage(unused_files))
+
+def delete_patient(patient_id):
+    with unit_of_work() as session:
+        patient = session.get(Patient, patient_id)
+        if patient:
+            unused_files = release_image(session, patient.image_path)
+            session.delete(patient)
+            unindex(session, 'patients_fts', patient_id)
+            after_commit(session, lambda: collect_garbage(unused_files))
 
 def get_patients():
-    session = Session()
-    patients = session.query(Patient).all()
-    session.close()
-    return patients
+    with unit_of_work() as session:
+        return session.query(Patient).all()
 
-# وظائف مشابهة للأطباء، العلاجات، المواعيد، إلخ (يمكن إضافتها بنفس الطريقة)
+# وظائف مشابهة للأطباء، العلاجات، المواعيد، إلخ
 def add_doctor(name, specialty, phone, email):
-    session = Session()
-    doctor = Doctor(name=name, specialty=specialty, phone=phone, email=email)
-    session.add(doctor)
-    session.commit()
-    session.close()
+    with unit_of_work() as session:
+        doctor = Doctor(name=name, specialty=specialty, phone=phone, email=email)
+        session.add(doctor)
+        session.flush()
+        index_doctor(session, doctor)
+        after_commit(session, lambda: reference_cache.invalidate('doctors'))
+
+def edit_doctor(doctor_id, name, specialty, phone, email):
+    with unit_of_work() as session:
+        doctor = session.get(Doctor, doctor_id)
+        if doctor:
+            doctor.name = name
+            doctor.specialty = specialty
+            doctor.phone = phone
+            doctor.email = email
+            index_doctor(session, doctor)
+            after_commit(session, lambda: reference_cache.invalidate('doctors'))
+
+def delete_doctor(doctor_id):
+    with unit_of_work() as session:
+        doctor = session.get(Doctor, doctor_id)
+        if doctor:
+            session.delete(doctor)
+            unindex(session, 'doctors_fts', doctor_id)
+            after_commit(session, lambda: reference_cache.invalidate('doctors', 'percentages'))
+            after_commit(session, lambda: scheduler.invalidate(doctor_id))
 
 def get_doctors():
-    session = Session()
-    doctors = session.query(Doctor).all()
-    session.close()
-    return doctors
-
-def add_treatment(name, base_cost):
-    session = Session()
-    treatment = Treatment(name=name, base_cost=base_cost)
-    session.add(treatment)
-    session.commit()
-    session.close()
+    # لقطة ثابتة من الذاكرة المؤقتة (DoctorRow)
+    return reference_cache.get('doctors')
+
+def add_treatment(name, base_cost, duration=None):
+    with unit_of_work() as session:
+        treatment = Treatment(name=name, base_cost=base_cost, duration=duration)
+        session.add(treatment)
+        after_commit(session, lambda: reference_cache.invalidate('treatments'))
+
+def edit_treatment(treatment_id, name, base_cost, duration=None):
+    with unit_of_work() as session:
+        treatment = session.get(Treatment, treatment_id)
+        if treatment:
+            treatment.name = name
+            treatment.base_cost = base_cost
+            treatment.duration = duration
+            after_commit(session, lambda: reference_cache.invalidate('treatments'))
+            after_commit(session, scheduler.invalidate)  # المواعيد بدون مدة تأخذ مدة العلاج
+
+def delete_treatment(treatment_id):
+    with unit_of_work() as session:
+        treatment = session.get(Treatment, treatment_id)
+        if treatment:
+            session.delete(treatment)
+            after_commit(session, lambda: reference_cache.invalidate('treatments', 'percentages'))
 
 def get_treatments():
-    session = Session()
-    treatments = session.query(Treatment).all()
-    session.close()
-    return treatments
+    # لقطة ثابتة من الذاكرة المؤقتة (TreatmentRow)
+    return reference_cache.get('treatments')
 
 def add_treatment_percentage(treatment_id, doctor_id, clinic_percentage, doctor_percentage):
-    session = Session()
-    perc = TreatmentPercentage(treatment_id=treatment_id, doctor_id=doctor_id, 
-                                clinic_percentage=clinic_percentage, doctor_percentage=doctor_percentage)
-    session.add(perc)
-    session.commit()
-    session.close()
-
-def add_appointment(patient_id, doctor_id, treatment_id, date, status, notes):
-    session = Session()
-    appointment = Appointment(patient_id=patient_id, doctor_id=doctor_id, treatment_id=treatment_id, 
-                              date=date, status=status, notes=notes)
-    session.add(appointment)
-    session.commit()
-    session.close()
+    with unit_of_work() as session:
+        # نسبة واحدة لكل (علاج، طبيب): الإضافة مرة أخرى تعدّل النسبة الحالية
+        perc = session.query(TreatmentPercentage).filter_by(treatment_id=treatment_id, doctor_id=doctor_id).first()
+        if perc is None:
+            perc = TreatmentPercentage(treatment_id=treatment_id, doctor_id=doctor_id)
+            session.add(perc)
+        perc.clinic_percentage = clinic_percentage
+        perc.doctor_percentage = doctor_percentage
+        after_commit(session, lambda: reference_cache.invalidate('percentages'))
+
+def get_treatment_percentage(treatment_id, doctor_id):
+    # (نسبة العيادة، نسبة الطبيب) أو None إذا لم تُخصص نسبة
+    return reference_cache.get('percentages').get((treatment_id, doctor_id))
+
+def add_appointment(patient_id, doctor_id, treatment_id, date, status, notes, duration=None):
+    # يرفع scheduling.AppointmentConflict إذا كان الطبيب مشغولاً في هذا الوقت
+    duration = duration or default_duration(treatment_id)
+    with unit_of_work() as session:
+        appointment = Appointment(patient_id=patient_id, doctor_id=doctor_id, treatment_id=treatment_id, 
+                                  date=date, duration=duration, status=status, notes=notes)
+        session.add(appointment)
+        session.flush()
+        if status not in CANCELLED_STATUSES:
+            check_conflicts(session, doctor_id, date, duration, ignore_id=appointment.id)
+        index_appointment(session, appointment)
+        after_commit(session, lambda: scheduler.add(doctor_id, appointment.id, date, duration, status))
+
+def edit_appointment(appointment_id, patient_id, doctor_id, treatment_id, date, status, notes, duration=None):
+    with unit_of_work() as session:
+        appointment = session.get(Appointment, appointment_id)
+        if appointment:
+            duration = duration or appointment.duration or default_duration(treatment_id)
+            old_doctor_id = appointment.doctor_id
+            # تغيير الطبيب أو العلاج ينقل دفعات الموعد إلى مفتاح آخر في جدول التجميع
+            moved = (appointment.doctor_id, appointment.treatment_id) != (doctor_id, treatment_id)
+            if moved:
+                check_open(session, [Payment.appointment_id == appointment_id])
+                apply_payments(session, [Payment.appointment_id == appointment_id], -1)
+            appointment.patient_id = patient_id
+            appointment.doctor_id = doctor_id
+            appointment.treatment_id = treatment_id
+            appointment.date = date
+            appointment.duration = duration
+            appointment.status = status
+            appointment.notes = notes
+            index_appointment(session, appointment)
+            session.flush()
+            if status not in CANCELLED_STATUSES:
+                check_conflicts(session, doctor_id, date, duration, ignore_id=appointment_id)
+            if moved:
+                apply_payments(session, [Payment.appointment_id == appointment_id])
+            after_commit(session, lambda: scheduler.remove(old_doctor_id, appointment_id))
+            after_commit(session, lambda: scheduler.add(doctor_id, appointment_id, date, duration, status))
+
+def delete_appointment(appointment_id):
+    with unit_of_work() as session:
+        appointment = session.get(Appointment, appointment_id)
+        if appointment:
+            session.delete(appointment)
+            unindex(session, 'appointments_fts', appointment_id)
+            after_commit(session, lambda: scheduler.remove(appointment.doctor_id, appointment_id))
 
 def get_appointments():
-    session = Session()
-    appointments = session.query(Appointment).all()
-    session.close()
-    return appointments
+    with unit_of_work() as session:
+        return session.query(Appointment).options(*APPOINTMENT_DETAILS).all()
+
+def _appointment_keys(session, appointment_ids):
+    # appointment_id -> (treatment_id, doctor_id) باستعلام واحد لكل 500 معرف
+    keys = {}
+    ids = list(set(appointment_ids))
+    for start in range(0, len(ids), 500):
+        rows = session.query(Appointment.id, Appointment.treatment_id, Appointment.doctor_id).filter(
+            Appointment.id.in_(ids[start:start + 500]))
+        keys.update((a_id, (t_id, d_id)) for a_id, t_id, d_id in rows)
+    return keys
+
+def calculate_shares_batch(session, appointment_ids, total_amounts, discounts=0, taxes=0):
+    # مصفوفتا (نصيب العيادة، نصيب الطبيب) لكل الدفعات دفعة واحدة
+    keys = _appointment_keys(session, appointment_ids)
+    treatment_ids = [keys.get(a_id, (None, None))[0] for a_id in appointment_ids]
+    doctor_ids = [keys.get(a_id, (None, None))[1] for a_id in appointment_ids]
+    return get_commission_matrix().shares(treatment_ids, doctor_ids, total_amounts, discounts, taxes)
 
 def calculate_shares(appointment_id, total_amount, discounts=0, taxes=0):
-    session = Session()
-    appointment = session.query(Appointment).get(appointment_id)
-    perc = session.query(TreatmentPercentage).filter_by(treatment_id=appointment.treatment_id, doctor_id=appointment.doctor_id).first()
-    if not perc:
-        # افتراضي
-        clinic_perc = 50.0
-        doctor_perc = 50.0
-    else:
-        clinic_perc = perc.clinic_percentage
-        doctor_perc = perc.doctor_percentage
-    net_amount = total_amount - discounts + taxes
-    clinic_share = net_amount * (clinic_perc / 100)
-    doctor_share = net_amount * (doctor_perc / 100)
-    session.close()
-    return clinic_share, doctor_share
+    with unit_of_work() as session:
+        clinic_shares, doctor_shares = calculate_shares_batch(session, [appointment_id], [total_amount], discounts, taxes)
+        return float(clinic_shares[0]), float(doctor_shares[0])
 
 def add_payment(appointment_id, total_amount, paid_amount, payment_method, discounts, taxes):
-    session = Session()
-    clinic_share, doctor_share = calculate_shares(appointment_id, total_amount, discounts, taxes)
-    payment = Payment(appointment_id=appointment_id, total_amount=total_amount, paid_amount=paid_amount,
-                      clinic_share=clinic_share, doctor_share=doctor_share, payment_method=payment_method,
-                      discounts=discounts, taxes=taxes, date_paid=datetime.datetime.now())
-    session.add(payment)
-    session.commit()
-    session.close()
\ No newline at end of file
+    with unit_of_work() as session:
+        clinic_shares, doctor_shares = calculate_shares_batch(session, [appointment_id], [total_amount], discounts, taxes)
+        payment = Payment(appointment_id=appointment_id, total_amount=total_amount, paid_amount=paid_amount,
+                          clinic_share=float(clinic_shares[0]), doctor_share=float(doctor_shares[0]),
+                          payment_method=payment_method, discounts=discounts, taxes=taxes,
+                          date_paid=datetime.datetime.now())
+        session.add(payment)
+        session.flush()
+        apply_payments(session, [Payment.id == payment.id])
+
+def edit_payment(payment_id, total_amount, paid_amount, payment_method, discounts, taxes):
+    with unit_of_work() as session:
+        payment = session.get(Payment, payment_id)
+        if payment:
+            apply_payments(session, [Payment.id == payment_id], -1)
+            clinic_shares, doctor_shares = calculate_shares_batch(session, [payment.appointment_id], [total_amount], discounts, taxes)
+            payment.total_amount = total_amount
+            payment.paid_amount = paid_amount
+            payment.clinic_share = float(clinic_shares[0])
+            payment.doctor_share = float(doctor_shares[0])
+            payment.payment_method = payment_method
+            payment.discounts = discounts
+            payment.taxes = taxes
+            session.flush()
+            apply_payments(session, [Payment.id == payment_id])
+
+def delete_payment(payment_id):
+    with unit_of_work() as session:
+        payment = session.get(Payment, payment_id)
+        if payment:
+            apply_payments(session, [Payment.id == payment_id], -1)
+            session.delete(payment)
+
+def recompute_payment_shares(treatment_id=None, doctor_id=None):
+    # إعادة حساب الأنصبة للدفعات السابقة بعد تغيير النسب: استعلام واحد + تحديث مجمّع
+    with unit_of_work() as session:
+        criteria = []
+        if treatment_id is not None:
+            criteria.append(Appointment.treatment_id == treatment_id)
+        if doctor_id is not None:
+            criteria.append(Appointment.doctor_id == doctor_id)
+        start = open_from(session)
+        if start is not None:
+            # الدفعات في الفترات المقفلة تبقى بالأنصبة التي أُقفلت بها
+            criteria.append(or_(Payment.date_paid.is_(None), Payment.date_paid >= start))
+        query = session.query(Payment.id, Payment.total_amount, Payment.discounts, Payment.taxes,
+                              Appointment.treatment_id, Appointment.doctor_id).join(Payment.appointment)
+        rows = query.filter(*criteria).all()
+        if rows:
+            apply_payments(session, criteria, -1)
+            ids, totals, discounts, taxes, treatment_ids, doctor_ids = zip(*rows)
+            clinic_shares, doctor_shares = get_commission_matrix().shares(treatment_ids, doctor_ids, totals, discounts, taxes)
+            session.bulk_update_mappings(Payment, [
+                {'id': p_id, 'clinic_share': float(c), 'doctor_share': float(d)}
+                for p_id, c, d in zip(ids, clinic_shares, doctor_shares)
+            ])
+            session.flush()
+            apply_payments(session, criteria)
+        return len(rows)
+
+def get_payments():
+    with unit_of_work() as session:
+        return session.query(Payment).options(*PAYMENT_DETAILS).all()
+
+# صرف مستحقات الأطباء: الرصيد الجاري في doctor_ledger يُحدَّث في نفس المعاملة (settlement.py)
+def add_payout(doctor_id, amount, payment_method=None, notes=None, date_paid=None):
+    with unit_of_work() as session:
+        payout = DoctorPayout(doctor_id=doctor_id, amount=amount, payment_method=payment_method, notes=notes,
+                              date_paid=date_paid or datetime.datetime.now())
+        session.add(payout)
+        session.flush()
+        apply_payouts(session, [DoctorPayout.id == payout.id])
+        return payout.id
+
+def delete_payout(payout_id):
+    with unit_of_work() as session:
+        payout = session.get(DoctorPayout, payout_id)
+        if payout:
+            apply_payouts(session, [DoctorPayout.id == payout_id], -1)
+            session.delete(payout)
+
+def get_payouts(doctor_id=None, date_from=None, date_to=None):
+    with unit_of_work() as session:
+        query = session.query(DoctorPayout)
+        if doctor_id is not None:
+            query = query.filter(DoctorPayout.doctor_id == doctor_id)
+        if date_from is not None:
+            query = query.filter(DoctorPayout.date_paid >= date_from)
+        if date_to is not None:
+            query = query.filter(DoctorPayout.date_paid < date_to)
+        return query.order_by(DoctorPayout.date_paid.desc(), DoctorPayout.id.desc()).all()
+
+# القوائم المجزأة (keyset pagination): كل صفحة تُقرأ عبر الفهرس بدلاً من تحميل الجدول كاملاً
+# next_cursor يُمرَّر كما هو لطلب الصفحة التالية، ويكون None في الصفحة الأخيرة
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+DEFAULT_PAGE_SIZE = 50
+
+def _keyset(query, model, cursor=None, sort_column=None, descending=False):
+    # شرط المؤشر والترتيب؛ يعمل مع session.query و select (readmodel.py)
+    if sort_column is None:
+        key = model.id
+        columns = [model.id]
+    else:
+        key = tuple_(sort_column, model.id)
+        columns = [sort_column, model.id]
+    if cursor is not None:
+        bound = cursor if sort_column is None else tuple_(*cursor)
+        query = query.filter(key < bound if descending else key > bound)
+    return query.order_by(*[c.desc() if descending else c.asc() for c in columns])
+
+def _keyset_rows(rows, page_size, sort_column=None):
+    # الصفوف قُرئت بحد page_size + 1 لمعرفة وجود صفحة تالية
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = last.id if sort_column is None else (getattr(last, sort_column.key), last.id)
+    return Page(rows, next_cursor)
+
+def _keyset_queries(query, model, cursor=None, sort_column=None, descending=False):
+    # الصفوف التي عمود ترتيبها NULL تأتي أخيراً في الاتجاهين (NULLS LAST) باستعلام ثانٍ مرتب بالمعرف فقط، ومؤشرها
+    # (None، المعرف): مقارنة (عمود الترتيب، المعرف) لا تطابق NULL أبداً، و OR IS NULL في نفس الاستعلام تُفقده الفهرس
+    if sort_column is None:
+        return [_keyset(query, model, cursor, None, descending)]
+    queries = []
+    if cursor is None or cursor[0] is not None:
+        queries.append(_keyset(query.filter(sort_column.isnot(None)), model, cursor, sort_column, descending))
+    null_cursor = cursor[1] if cursor is not None and cursor[0] is None else None
+    queries.append(_keyset(query.filter(sort_column.is_(None)), model, null_cursor, None, descending))
+    return queries
+
+def _keyset_page(query, model, cursor=None, page_size=DEFAULT_PAGE_SIZE, sort_column=None, descending=False):
+    rows = []
+    for part in _keyset_queries(query, model, cursor, sort_column, descending):
+        rows += part.limit(page_size + 1 - len(rows)).all()
+        if len(rows) > page_size:
+            break
+    return _keyset_rows(rows, page_size, sort_column)
+
+def _search_filter(query, columns, search):
+    if search:
+        pattern = f"%{search}%"
+        query = query.filter(or_(*[c.ilike(pattern) for c in columns]))
+    return query
+
+def _fts_filter(query, session, conditions, columns, search):
+    # FTS5 على SQLite (بحث بالبادئة مع توحيد الحروف العربية)، و LIKE على غيرها
+    if not search:
+        return query
+    if not fts_available(session.get_bind()):
+        return _search_filter(query, columns, search)
+    if match_query(search) is None:
+        return query
+    return query.filter(or_(*[id_column.in_(match_ids(fts_table, search)) for id_column, fts_table in conditions]))
+
+# شروط البحث والتصفية لكل قائمة (مشتركة مع القراءة العمودية في readmodel.py)
+def filter_patients(query, session, search=None, gender=None):
+    if gender:
+        query = query.filter(Patient.gender == gender)
+    return _fts_filter(query, session, [(Patient.id, 'patients_fts')],
+                       [Patient.name, Patient.phone, Patient.address, Patient.medical_history], search)
+
+def filter_doctors(query, session, search=None, specialty=None):
+    if specialty:
+        query = query.filter(Doctor.specialty == specialty)
+    return _fts_filter(query, session, [(Doctor.id, 'doctors_fts')],
+                       [Doctor.name, Doctor.specialty, Doctor.email], search)
+
+def filter_treatments(query, session, search=None):
+    return _search_filter(query, [Treatment.name], search)
+
+def filter_appointments(query, session, search=None, patient_id=None, doctor_id=None, status=None,
+                        date_from=None, date_to=None, joined=False):
+    # joined=True إذا كان الاستعلام مربوطاً بالفعل بجدولي المرضى والأطباء
+    if patient_id is not None:
+        query = query.filter(Appointment.patient_id == patient_id)
+    if doctor_id is not None:
+        query = query.filter(Appointment.doctor_id == doctor_id)
+    if status:
+        query = query.filter(Appointment.status == status)
+    if date_from is not None:
+        query = query.filter(Appointment.date >= date_from)
+    if date_to is not None:
+        query = query.filter(Appointment.date < date_to)
+    if search and not joined and not fts_available(session.get_bind()):
+        query = query.outerjoin(Appointment.patient).outerjoin(Appointment.doctor)
+    # موعد يطابق إذا طابقت ملاحظاته أو بيانات مريضه أو طبيبه
+    return _fts_filter(query, session, [(Appointment.id, 'appointments_fts'),
+                                        (Appointment.patient_id, 'patients_fts'),
+                                        (Appointment.doctor_id, 'doctors_fts')],
+                       [Patient.name, Doctor.name, Appointment.status, Appointment.notes], search)
+
+def filter_payments(query, session, appointment_id=None, date_from=None, date_to=None):
+    if appointment_id is not None:
+        query = query.filter(Payment.appointment_id == appointment_id)
+    if date_from is not None:
+        query = query.filter(Payment.date_paid >= date_from)
+    if date_to is not None:
+        query = query.filter(Payment.date_paid < date_to)
+    return query
+
+def list_patients(cursor=None, page_size=DEFAULT_PAGE_SIZE, search=None, gender=None):
+    with unit_of_work() as session:
+        query = filter_patients(session.query(Patient), session, search, gender)
+        return _keyset_page(query, Patient, cursor, page_size)
+
+def list_doctors(cursor=None, page_size=DEFAULT_PAGE_SIZE, search=None, specialty=None):
+    with unit_of_work() as session:
+        query = filter_doctors(session.query(Doctor), session, search, specialty)
+        return _keyset_page(query, Doctor, cursor, page_size)
+
+def list_treatments(cursor=None, page_size=DEFAULT_PAGE_SIZE, search=None):
+    with unit_of_work() as session:
+        query = filter_treatments(session.query(Treatment), session, search)
+        return _keyset_page(query, Treatment, cursor, page_size)
+
+def list_appointments(cursor=None, page_size=DEFAULT_PAGE_SIZE, search=None, patient_id=None, doctor_id=None,
+                      status=None, date_from=None, date_to=None, descending=True):
+    # مرتبة حسب التاريخ (الأحدث أولاً)، المؤشر = (التاريخ، المعرف)
+    with unit_of_work() as session:
+        query = filter_appointments(session.query(Appointment).options(*APPOINTMENT_DETAILS), session, search,
+                                    patient_id, doctor_id, status, date_from, date_to)
+        return _keyset_page(query, Appointment, cursor, page_size, sort_column=Appointment.date, descending=descending)
+
+def list_payments(cursor=None, page_size=DEFAULT_PAGE_SIZE, appointment_id=None, date_from=None, date_to=None,
+                  descending=True):
+    # مرتبة حسب تاريخ الدفع (الأحدث أولاً)، المؤشر = (تاريخ الدفع، المعرف)
+    with unit_of_work() as session:
+        query = filter_payments(session.query(Payment).options(*PAYMENT_DETAILS), session, appointment_id,
+                                date_from, date_to)
+        return _keyset_page(query, Payment, cursor, page_size, sort_column=Payment.date_paid, descending=descending)
+
+# التقويم: مواعيد نافذة العرض فقط (يوم / أسبوع) باستعلام نطاق على فهرس التاريخ أو (الطبيب، التاريخ)
+CALENDAR_VIEWS = {'day': 1, 'week': 7}
+
+def calendar_window(day, view='day'):
+    # (بداية النافذة، عدد الأيام)؛ الأسبوع يبدأ يوم السبت
+    if view == 'week':
+        day = day - datetime.timedelta(days=(day.weekday() + 2) % 7)
+    return day, CALENDAR_VIEWS[view]
+
+def get_calendar(start, days=1, doctor_id=None):
+    window_start = datetime.datetime.combine(start, datetime.time.min)
+    window_end = window_start + datetime.timedelta(days=days)
+    with unit_of_work() as session:
+        query = session.query(Appointment).options(*APPOINTMENT_DETAILS).filter(
+            Appointment.date >= window_start, Appointment.date < window_end)
+        if doctor_id is not None:
+            query = query.filter(Appointment.doctor_id == doctor_id)
+        return query.order_by(Appointment.date, Appointment.id).all()
+
+def search_patients(search=None, limit=20):
+    # منتقي المرضى: أول `limit` نتيجة فقط (الأحدث أولاً) بدلاً من تحميل سجل المرضى كاملاً
+    with unit_of_work() as session:
+        query = session.query(Patient.id, Patient.name, Patient.phone)
+        query = _fts_filter(query, session, [(Patient.id, 'patients_fts')], [Patient.name, Patient.phone], search)
+        return query.order_by(Patient.id.desc()).limit(limit).all()
+
+def get_patient(patient_id):
+    with unit_of_work() as session:
+        return session.get(Patient, patient_id)
+
+def get_doctor(doctor_id):
+    with unit_of_work() as session:
+        return session.get(Doctor, doctor_id)
+
+def get_treatment(treatment_id):
+    with unit_of_work() as session:
+        return session.get(Treatment, treatment_id)
+
+def get_appointment(appointment_id):
+    with unit_of_work() as session:
+        return session.get(Appointment, appointment_id, options=APPOINTMENT_DETAILS)
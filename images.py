@@ -0,0 +1,283 @@
+# مخزن صور الأشعة حسب المحتوى: اسم الملف = sha256 للمحتوى، فالصورة المكررة تُخزن مرة واحدة
+# الكتابة تتم على دفعات إلى ملف مؤقت، ثم يُضاف السجل أو يُزاد عدد مراجعه (ref_count) بجملة upsert واحدة
+# في نفس معاملة تعديل المريض، ثم يُنقل الملف إلى مكانه بإعادة تسمية ذرية؛
+# الملفات التي لم يعد لها مراجع تُحذف بعد commit عبر collect_garbage()
+# النسخ المصغرة (thumb / preview) تُنشأ عند أول طلب في مجمّع خيوط وتُخزن في images/cache
+# مع حذف الأقل استخداماً (LRU) عند تجاوز الحجم المسموح (CURA_IMAGE_CACHE_MB)
+# ترحيل الصور القديمة (images/{name}_{timestamp}.png): python images.py --migrate-legacy
+# حذف الملفات التي ليس لها سجل: python images.py --collect-orphans
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from database import Session, unit_of_work, before_rollback
+from models import Patient, ImageBlob
+
+try:
+    from PIL import Image
+except ImportError:  # بدون Pillow لا تُنشأ صور مصغرة
+    Image = None
+
+IMAGE_DIR = os.environ.get('CURA_IMAGE_DIR', 'images')
+CHUNK_SIZE = 1 << 20  # 1MB
+DERIVATIVE_SIZES = {'thumb': 256, 'preview': 1024}
+DERIVATIVE_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+CACHE_MAX_BYTES = int(os.environ.get('CURA_IMAGE_CACHE_MB', '512')) * 1024 * 1024
+
+def _blob_path(sha256):
+    return os.path.join(IMAGE_DIR, 'blobs', sha256[:2], sha256)
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _stage_blob(upload):
+    # (sha256, temp_path, size) - المحتوى يُكتب على دفعات إلى ملف مؤقت في مجلد المخزن (لإعادة تسمية ذرية لاحقاً)
+    blob_dir = os.path.join(IMAGE_DIR, 'blobs')
+    os.makedirs(blob_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    handle, temp_path = tempfile.mkstemp(dir=blob_dir, prefix='.upload-')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            if hasattr(upload, 'seek'):
+                upload.seek(0)
+            for chunk in iter(lambda: upload.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return digest.hexdigest(), temp_path, size
+
+def _upsert_blob(dialect):
+    # إضافة السجل أو زيادة عدد مراجعه في جملة واحدة: رفعان متزامنان لنفس المحتوى الجديد لا يتعارضان على المفتاح
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    table = ImageBlob.__table__
+    return dialect_insert(table).on_conflict_do_update(
+        index_elements=['sha256'],
+        set_={'ref_count': table.c.ref_count + 1}
+    ).returning(table.c.ref_count, table.c.path)
+
+def acquire_image(session, upload):
+    # يخزن الصورة (إن لم تكن موجودة) ويزيد عدد مراجعها؛ يُرجع المسار لحفظه في Patient.image_path.
+    # الملف يُنقل إلى مكانه بعد وجود السجل؛ إذا أنشأت هذه المعاملة السجل ثم فشلت يُحذف الملف قبل التراجع
+    # (وسجلها ما زال يحجز المفتاح، فلا يمكن لرفع متزامن لنفس المحتوى أن يعتمد على الملف قبل حذفه)
+    sha256, temp_path, size = _stage_blob(upload)
+    path = _blob_path(sha256)
+    try:
+        statement = _upsert_blob(session.get_bind().dialect.name).values(sha256=sha256, path=path, size=size,
+                                                                          ref_count=1)
+        ref_count, path = session.execute(statement).one()  # المسار المسجل إذا كان المحتوى موجوداً بالفعل
+        created = ref_count == 1
+        if created or not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        else:
+            os.remove(temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if created:
+        before_rollback(session, lambda: _remove_file(path))
+    return path
+
+def release_image(session, path):
+    # ينقص عدد المراجع؛ يُرجع قائمة الملفات المرشحة للحذف (تُمرر إلى collect_garbage بعد commit)
+    if not path:
+        return []
+    blob = session.query(ImageBlob).filter_by(path=path).first()
+    if blob is None:  # صورة قديمة خارج المخزن
+        return []
+    blob.ref_count = ImageBlob.ref_count - 1
+    session.flush()
+    session.refresh(blob)
+    if blob.ref_count > 0:
+        return []
+    session.delete(blob)
+    return [blob.path]
+
+def collect_garbage(paths):
+    # حذف الملفات فقط إذا لم يعد أي سجل يشير إليها (قد تكون رُفعت مرة أخرى في جلسة أخرى)؛ يُرجع عدد المحذوف
+    paths = [p for p in paths if p]
+    if not paths:
+        return 0
+    session = Session()
+    referenced = {row[0] for row in session.query(ImageBlob.path).filter(ImageBlob.path.in_(paths))}
+    session.close()
+    removed = 0
+    for path in paths:
+        if path not in referenced:
+            derivative_cache.discard(path)
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+def collect_orphans(min_age=3600):
+    # ملفات في المخزن بدون سجل (توقف العملية بين نقل الملف و commit) وملفات رفع مؤقتة متروكة؛
+    # الأحدث من min_age ثانية لا تُلمس (قد تكون معاملتها ما زالت جارية)
+    blob_dir = os.path.join(IMAGE_DIR, 'blobs')
+    cutoff = time.time() - min_age
+    candidates = []
+    for directory, _, names in os.walk(blob_dir):
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.getmtime(path) > cutoff:
+                continue
+            if name.startswith('.upload-'):
+                _remove_file(path)
+            else:
+                candidates.append(path)
+    return sum(collect_garbage(candidates[i:i + 500]) for i in range(0, len(candidates), 500))
+
+class DerivativeCache:
+    def __init__(self, root, max_bytes, max_workers=2):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cura-image')
+        self._lock = threading.Lock()
+        self._entries = None  # path -> الحجم، مرتبة من الأقدم استخداماً إلى الأحدث
+        self._total = 0
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        # فحص المجلد مرة واحدة عند أول استخدام (الترتيب حسب وقت آخر استخدام mtime)
+        if self._entries is not None:
+            return
+        files = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if not name.startswith('.'):
+                    path = os.path.join(directory, name)
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime, path, stat.st_size))
+        self._entries = OrderedDict((path, size) for _, path, size in sorted(files))
+        self._total = sum(self._entries.values())
+
+    def _path(self, source_path, size, fmt):
+        key = os.path.splitext(os.path.basename(source_path))[0]
+        return os.path.join(self.root, size, key[:2], f"{key}.{fmt}")
+
+    def request(self, source_path, size='thumb', fmt='webp'):
+        # Future بمسار النسخة المصغرة؛ فك الترميز يتم في مجمّع الخيوط وليس في خيط الجلسة
+        path = self._path(source_path, size, fmt)
+        with self._lock:
+            self._load()
+            if path in self._entries:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                os.utime(path)
+                future = Future()
+                future.set_result(path)
+                return future
+            if path in self._pending:
+                return self._pending[path]
+            self.misses += 1
+            future = self._executor.submit(_render_derivative, source_path, path, DERIVATIVE_SIZES[size],
+                                           DERIVATIVE_FORMATS[fmt])
+            self._pending[path] = future
+        future.add_done_callback(lambda f: self._finished(path, f))
+        return future
+
+    def get(self, source_path, size='thumb', fmt='webp', timeout=30):
+        return self.request(source_path, size, fmt).result(timeout)
+
+    def _finished(self, path, future):
+        with self._lock:
+            self._pending.pop(path, None)
+            if future.exception() is not None:
+                return
+            file_size = os.path.getsize(path)
+            self._total += file_size - self._entries.get(path, 0)
+            self._entries[path] = file_size
+            # حذف الأقدم استخداماً حتى يعود الحجم للحد المسموح (مع إبقاء الأحدث دائماً)
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old_path, old_size = self._entries.popitem(last=False)
+                self._total -= old_size
+                _remove_file(old_path)
+
+    def discard(self, source_path):
+        # حذف كل النسخ المصغرة لصورة أصلية (عند حذفها من المخزن)
+        with self._lock:
+            self._load()
+            for size in DERIVATIVE_SIZES:
+                for fmt in DERIVATIVE_FORMATS:
+                    path = self._path(source_path, size, fmt)
+                    if path in self._entries:
+                        self._total -= self._entries.pop(path)
+                        _remove_file(path)  # قد تكون حُذفت من عملية أخرى
+
+def _render_derivative(source_path, path, max_size, image_format):
+    with Image.open(source_path) as img:
+        img.draft('RGB', (max_size, max_size))  # فك ترميز مصغر لملفات JPEG الكبيرة
+        img.thumbnail((max_size, max_size))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.derivative-')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                img.convert('RGB').save(f, image_format, quality=80)
+            os.replace(temp_path, path)
+        finally:
+            _remove_file(temp_path)
+    return path
+
+derivative_cache = DerivativeCache(os.path.join(IMAGE_DIR, 'cache'), CACHE_MAX_BYTES)
+
+def get_image_derivative(image_path, size='thumb', fmt='webp'):
+    # مسار نسخة مصغرة من صورة المريض (أو None إذا لم تتوفر الصورة أو Pillow)
+    if not image_path or Image is None or not os.path.exists(image_path):
+        return None
+    try:
+        return derivative_cache.get(image_path, size, fmt)
+    except (OSError, ValueError):  # ليست صورة صالحة
+        return None
+
+def get_thumbnail(image_path):
+    return get_image_derivative(image_path, 'thumb')
+
+def get_preview(image_path):
+    return get_image_derivative(image_path, 'preview')
+
+def migrate_legacy_images():
+    # نقل الصور القديمة إلى المخزن وحذف الملفات الأصلية
+    legacy_paths = set()
+    with unit_of_work() as session:
+        stored = session.query(ImageBlob.path)
+        patients = session.query(Patient).filter(Patient.image_path.isnot(None),
+                                                 Patient.image_path.notin_(stored)).all()
+        for patient in patients:
+            if not os.path.exists(patient.image_path):
+                continue
+            legacy_paths.add(patient.image_path)
+            with open(patient.image_path, 'rb') as f:
+                patient.image_path = acquire_image(session, f)
+            session.flush()
+    for path in legacy_paths:
+        os.remove(path)
+    return len(legacy_paths)
+
+if __name__ == '__main__':
+    if '--migrate-legacy' in sys.argv:
+        from migrations import upgrade
+        upgrade()
+        print(f"تم ترحيل {migrate_legacy_images()} صورة")
+    if '--collect-orphans' in sys.argv:
+        print(f"تم حذف {collect_orphans()} ملف بدون سجل")
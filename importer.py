@@ -0,0 +1,251 @@
+# استيراد البيانات بالجملة (المرضى، الأطباء، العلاجات، المواعيد والدفعات السابقة) من CSV / Excel
+# الملف يُقرأ على دفعات، والتحقق يتم على مستوى العمود (pandas) وليس صفاً صفاً،
+# والإدخال بعبارة INSERT واحدة لكل دفعة (executemany) داخل معاملة واحدة لكل دفعة.
+# الصفوف غير الصالحة لا توقف الاستيراد بل تُسجَّل مع رقم السطر وسبب الخطأ.
+# أسماء الأعمدة في الملف = أسماء الحقول في models.py (مثال: name, age, patient_id, date_paid)
+#   python importer.py <patients|doctors|treatments|appointments|payments> ملف.csv|ملف.xlsx [ملف_الأخطاء.csv]
+import datetime
+import sys
+from collections import namedtuple
+import pandas as pd
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from database import Session
+from migrations import reset_sequences
+from models import Patient, Doctor, Treatment, Appointment, Payment
+from cache import reference_cache
+from rollup import apply_payments
+from settlement import open_from
+from scheduling import scheduler
+from search import fts_available, index_rows, FTS_TABLES
+from functions import calculate_shares_batch
+
+IMPORT_CHUNK_SIZE = 5000
+IN_LIST_SIZE = 500  # أقصى عدد معرفات في شرط IN واحد (حد عدد المتغيرات في SQLite قد يكون 999)
+
+# الجدول، أنواع الأعمدة المسموح بها، الأعمدة المطلوبة، جدول البحث النصي
+ENTITIES = {
+    'patients': (Patient, {'id': 'int', 'name': 'str', 'age': 'int', 'gender': 'str', 'phone': 'str',
+                           'address': 'str', 'medical_history': 'str'}, ['name'], 'patients_fts'),
+    'doctors': (Doctor, {'id': 'int', 'name': 'str', 'specialty': 'str', 'phone': 'str', 'email': 'str'},
+                ['name'], 'doctors_fts'),
+    'treatments': (Treatment, {'id': 'int', 'name': 'str', 'base_cost': 'float', 'duration': 'int'}, ['name'], None),
+    'appointments': (Appointment, {'id': 'int', 'patient_id': 'int', 'doctor_id': 'int', 'treatment_id': 'int',
+                                   'date': 'datetime', 'duration': 'int', 'status': 'str', 'notes': 'str'},
+                     ['patient_id', 'doctor_id', 'date'], 'appointments_fts'),
+    'payments': (Payment, {'id': 'int', 'appointment_id': 'int', 'total_amount': 'float', 'paid_amount': 'float',
+                           'clinic_share': 'float', 'doctor_share': 'float', 'payment_method': 'str',
+                           'discounts': 'float', 'taxes': 'float', 'date_paid': 'datetime'},
+                 ['appointment_id', 'total_amount'], None),
+}
+FOREIGN_KEYS = {
+    'appointments': {'patient_id': Patient, 'doctor_id': Doctor, 'treatment_id': Treatment},
+    'payments': {'appointment_id': Appointment},
+}
+NON_NEGATIVE = {'age', 'base_cost', 'duration', 'total_amount', 'paid_amount', 'discounts', 'taxes'}
+
+RowError = namedtuple('RowError', ['row', 'message'])
+ImportResult = namedtuple('ImportResult', ['entity', 'inserted', 'errors'])
+
+def _excel_chunks(source, chunk_size):
+    from openpyxl import load_workbook
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    rows = workbook.active.iter_rows(values_only=True)
+    header = [str(h).strip() if h is not None else '' for h in next(rows, ())]
+    chunk = []
+    start = 0
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield pd.DataFrame(chunk, columns=header, index=range(start, start + len(chunk)), dtype=object)
+            start += len(chunk)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk, columns=header, index=range(start, start + len(chunk)), dtype=object)
+    workbook.close()
+
+def read_chunks(source, chunk_size=IMPORT_CHUNK_SIZE):
+    # source: مسار ملف أو ملف مرفوع من Streamlit (له خاصية name)
+    name = str(getattr(source, 'name', source)).lower()
+    if name.endswith(('.xlsx', '.xlsm')):
+        yield from _excel_chunks(source, chunk_size)
+    else:
+        # كل القيم تُقرأ كنصوص ثم تُحوَّل حسب نوع العمود في _coerce
+        yield from pd.read_csv(source, chunksize=chunk_size, dtype=str, encoding='utf-8-sig',
+                               keep_default_na=False, na_values=[''], skipinitialspace=True)
+
+def _coerce(df, columns):
+    # تحويل الأعمدة للأنواع الصحيحة؛ يُرجع (الأعمدة المحولة، رسائل الخطأ لكل صف)
+    errors = pd.Series('', index=df.index, dtype=object)
+    values = {}
+    for name, kind in columns.items():
+        if name not in df:
+            continue
+        raw = df[name].where(df[name].notna(), None)
+        if kind == 'str':
+            text = raw.astype(str).str.strip()
+            values[name] = text.where(raw.notna() & (text != ''), None)
+            continue
+        if kind == 'datetime':
+            col = pd.to_datetime(raw, errors='coerce', format='mixed')
+            bad = raw.notna() & col.isna()
+        else:
+            col = pd.to_numeric(raw, errors='coerce')
+            bad = raw.notna() & col.isna()
+            if kind == 'int':
+                bad |= col.notna() & (col % 1 != 0)
+                col = col.where(~bad).astype('Int64')
+            if name in NON_NEGATIVE:
+                negative = col.notna() & (col < 0)
+                errors = errors.where(~negative, errors + f"{name}: قيمة سالبة; ")
+        errors = errors.where(~bad, errors + f"{name}: قيمة غير صالحة; ")
+        values[name] = col
+    return pd.DataFrame(values, index=df.index), errors
+
+def _existing_ids(session, model, ids):
+    # المعرفات الموجودة فعلاً (على دفعات بسبب حد عدد المتغيرات في SQLite)
+    ids = [int(i) for i in ids]
+    found = set()
+    for i in range(0, len(ids), IN_LIST_SIZE):
+        found.update(row[0] for row in session.query(model.id).filter(model.id.in_(ids[i:i + IN_LIST_SIZE])))
+    return found
+
+def validate(session, entity, df):
+    model, columns, required, _ = ENTITIES[entity]
+    frame, errors = _coerce(df, columns)
+    for name in required:
+        missing = frame[name].isna()
+        errors = errors.where(~missing, errors + f"{name}: مطلوب; ")
+    for name, target in FOREIGN_KEYS.get(entity, {}).items():
+        if name not in frame:
+            continue
+        col = frame[name]
+        known = _existing_ids(session, target, col.dropna().unique())
+        unknown = col.notna() & ~col.isin(known)
+        errors = errors.where(~unknown, errors + f"{name}: غير موجود; ")
+    if 'id' in frame:
+        col = frame['id']
+        duplicate = col.notna() & (col.duplicated(keep='first') | col.isin(_existing_ids(session, model, col.dropna().unique())))
+        errors = errors.where(~duplicate, errors + "id: موجود مسبقاً; ")
+    if entity == 'payments' and 'date_paid' in frame:
+        # دفعات في شهر مقفل (settlement.close_period) تُرفض هنا صفاً صفاً بدلاً من إيقاف الدفعة كلها عند الترحيل
+        start = open_from(session)
+        if start is not None:
+            closed = frame['date_paid'].notna() & (frame['date_paid'] < pd.Timestamp(start))
+            errors = errors.where(~closed, errors + "date_paid: في فترة مقفلة; ")
+    return frame, errors.str.rstrip('; ')
+
+def _records(frame):
+    # صفوف DataFrame كقواميس مع None بدلاً من NaN / NaT / NA
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+def _insert(session, table, rows, records):
+    # إدخال الدفعة بعبارة واحدة؛ إذا فشلت (قيد قاعدة البيانات) يُعاد إدخالها صفاً صفاً لعزل الصفوف الخاطئة
+    statement = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+    try:
+        with session.begin_nested():
+            return list(session.execute(statement, records).scalars()), rows, []
+    except IntegrityError:
+        pass
+    ids, inserted_rows, errors = [], [], []
+    for row, record in zip(rows, records):
+        try:
+            with session.begin_nested():
+                ids.append(session.execute(statement, [record]).scalar_one())
+                inserted_rows.append(row)
+        except IntegrityError as e:
+            errors.append(RowError(row, str(e.orig)))
+    return ids, inserted_rows, errors
+
+def _fill_payment_defaults(session, frame):
+    # نصيب العيادة/الطبيب يُحسب دفعة واحدة (مصفوفة النسب) للصفوف التي لم تحدده
+    for name in ('clinic_share', 'doctor_share', 'date_paid'):
+        if name not in frame:
+            frame[name] = None
+    if len(frame):
+        missing = frame['clinic_share'].isna() | frame['doctor_share'].isna()
+        if missing.any():
+            subset = frame[missing]
+            clinic_shares, doctor_shares = calculate_shares_batch(
+                session, [int(i) for i in subset['appointment_id']], subset['total_amount'].tolist(),
+                subset['discounts'].tolist() if 'discounts' in subset else 0,
+                subset['taxes'].tolist() if 'taxes' in subset else 0)
+            frame.loc[missing, 'clinic_share'] = clinic_shares
+            frame.loc[missing, 'doctor_share'] = doctor_shares
+    frame['date_paid'] = frame['date_paid'].astype(object).where(frame['date_paid'].notna(), datetime.datetime.now())
+    return frame
+
+def import_chunk(session, entity, df):
+    # يُرجع (عدد الصفوف المضافة، قائمة الأخطاء)؛ لا يقوم بـ commit
+    model, _, _, fts_table = ENTITIES[entity]
+    frame, messages = validate(session, entity, df)
+    errors = [RowError(index + 2, message) for index, message in messages[messages != ''].items()]
+    frame = frame[messages == '']
+    if entity == 'payments':
+        frame = _fill_payment_defaults(session, frame.copy())
+    if not len(frame):
+        return 0, errors
+    rows = [index + 2 for index in frame.index]  # رقم السطر في الملف (السطر 1 = العناوين)
+    records = _records(frame)
+    ids, inserted_rows, insert_errors = _insert(session, model.__table__, rows, records)
+    errors.extend(insert_errors)
+    if fts_table and fts_available(session.get_bind()):
+        columns = FTS_TABLES[fts_table][1]
+        by_row = dict(zip(rows, records))
+        index_rows(session, fts_table,
+                   [(new_id,) + tuple(by_row[row].get(c) for c in columns) for new_id, row in zip(ids, inserted_rows)])
+    if entity == 'payments':
+        for i in range(0, len(ids), IN_LIST_SIZE):
+            apply_payments(session, [Payment.id.in_(ids[i:i + IN_LIST_SIZE])])
+    return len(ids), errors
+
+def import_file(entity, source, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    if entity not in ENTITIES:
+        raise ValueError(f"نوع بيانات غير معروف: {entity}")
+    _, columns, required, _ = ENTITIES[entity]
+    inserted = 0
+    errors = []
+    rows_done = 0
+    session = Session()
+    try:
+        for df in read_chunks(source, chunk_size):
+            df.columns = [str(c).strip() for c in df.columns]
+            missing = [name for name in required if name not in df.columns]
+            if missing:
+                raise ValueError(f"أعمدة مطلوبة غير موجودة في الملف: {', '.join(missing)}")
+            count, chunk_errors = import_chunk(session, entity, df)
+            session.commit()
+            inserted += count
+            errors.extend(chunk_errors)
+            rows_done += len(df)
+            if progress is not None:
+                progress(rows_done)
+        if session.get_bind().dialect.name == 'postgresql':
+            # الدفعات المحفوظة قد تحتوي معرفات صريحة (عمود id في الملف)
+            reset_sequences(session.connection(), [ENTITIES[entity][0].__tablename__])
+            session.commit()
+    finally:
+        session.close()
+        if entity in ('doctors', 'treatments'):
+            reference_cache.invalidate(entity)
+        if entity in ('treatments', 'appointments'):
+            scheduler.invalidate()  # المواعيد المستوردة (السابقة) لا تُفحص للتعارض لكنها تدخل الفهرس
+    return ImportResult(entity, inserted, errors)
+
+def errors_frame(errors):
+    return pd.DataFrame(errors, columns=['السطر', 'الخطأ'])
+
+if __name__ == '__main__':
+    from migrations import upgrade
+    if len(sys.argv) < 3:
+        print("الاستخدام: python importer.py <patients|doctors|treatments|appointments|payments> ملف [ملف_الأخطاء.csv]")
+        sys.exit(1)
+    upgrade()
+    result = import_file(sys.argv[1], sys.argv[2], progress=lambda n: print(f"{n} صف...", end='\r'))
+    print(f"تمت إضافة {result.inserted} صف، وعدد الأخطاء {len(result.errors)}")
+    if len(sys.argv) > 3:
+        errors_frame(result.errors).to_csv(sys.argv[3], index=False, encoding='utf-8-sig')
+    else:
+        for error in result.errors[:20]:
+            print(f"السطر {error.row}: {error.message}")
+    sys.exit(1 if result.errors else 0)
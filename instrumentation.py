@@ -0,0 +1,342 @@
+# قياس أداء الاستعلامات والعمليات في التشغيل الفعلي (بدون echo):
+# - زمن كل استعلام وعدد صفوفه مجمّعاً حسب "بصمة" الاستعلام (نص SQL بعد إزالة القيم)؛
+#   صفوف SELECT تُعدّ داخل diagnostics.watch فقط (بدون تحميل النتائج كاملة في التشغيل العادي)
+# - عدد الاستعلامات لكل تشغيل لصفحة Streamlit، مع تنبيه عند تكرار نفس الاستعلام كثيراً (N+1)
+# - زمن عمليات التقارير والتصدير (timed)
+# - خطة التنفيذ (EXPLAIN QUERY PLAN) للاستعلامات البطيئة، مع تنبيه عند المرور الكامل على الجداول الكبيرة
+# النتائج متاحة في صفحة التشخيص المخفية (CuraApp.py?diagnostics=1) وفي سجل JSON دوّار (CURA_DIAGNOSTICS_LOG)
+# assert_queries تستخدم نفس القياسات للتأكد من عدم وجود N+1 أو مرور كامل قبل النشر (benchmark.py)
+import functools
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+ENABLED = os.environ.get('CURA_INSTRUMENT', '1').lower() not in ('0', 'false', 'no')
+SLOW_QUERY_SECONDS = float(os.environ.get('CURA_SLOW_QUERY_MS', '200')) / 1000
+N_PLUS_ONE_THRESHOLD = 10  # نفس الاستعلام أكثر من هذا العدد في تشغيل واحد = غالباً N+1
+RECENT_RUNS = 50
+WATCHED_TABLES = {'appointments', 'payments'}  # المرور الكامل على هذه الجداول يُسجَّل كتنبيه
+LOG_MAX_BYTES = int(float(os.environ.get('CURA_DIAGNOSTICS_LOG_MB', '10')) * 1024 * 1024)
+LOG_BACKUPS = 5
+
+logger = logging.getLogger('cura.diagnostics')
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'), 'event': record.getMessage()}
+        entry.update(getattr(record, 'data', {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+if os.environ.get('CURA_DIAGNOSTICS_LOG'):
+    _handler = logging.handlers.RotatingFileHandler(os.environ['CURA_DIAGNOSTICS_LOG'], maxBytes=LOG_MAX_BYTES,
+                                                    backupCount=LOG_BACKUPS, encoding='utf-8')
+    _handler.setFormatter(_JsonFormatter())
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+def _log(event_name, **data):
+    logger.info(event_name, extra={'data': data})
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+_SPACES = re.compile(r'\s+')
+
+@functools.lru_cache(maxsize=4096)
+def normalize_sql(statement):
+    # القيم الثابتة وقوائم IN الطويلة تُستبدل بـ ? حتى تتجمع الاستعلامات المتشابهة معاً
+    sql = _LITERALS.sub('?', statement)
+    sql = _IN_LISTS.sub('(?)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint(statement):
+    return hashlib.sha1(normalize_sql(statement).encode()).hexdigest()[:12]
+
+_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?([A-Za-z_]+?)(?:_\d+)?(?: AS \w+)?$')
+_SEQ_SCAN = re.compile(r'Seq Scan on ([A-Za-z_]+)')  # PostgreSQL
+EXPLAIN_PREFIX = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN '}
+
+def full_scans(plan):
+    # الجداول المقروءة بالكامل بدون فهرس ("SCAN appointments" / "Seq Scan on appointments")؛
+    # الأسماء المستعارة appointments_1 تُعاد لاسم الجدول
+    tables = []
+    for detail in plan:
+        match = _FULL_SCAN.match(detail) or _SEQ_SCAN.search(detail)
+        if match:
+            tables.append(match.group(1))
+    return tables
+
+def explain(cursor, statement, parameters, dialect='sqlite'):
+    # خطة التنفيذ على نفس الاتصال (مؤشر DBAPI منفصل حتى لا تُسجَّل كاستعلام آخر)؛
+    # على PostgreSQL داخل SAVEPOINT: فشل EXPLAIN وحده يعطّل المعاملة الجارية للمستدعي حتى ROLLBACK
+    savepoint = dialect == 'postgresql'
+    try:
+        plan_cursor = cursor.connection.cursor()
+    except Exception:
+        return None
+    try:
+        if savepoint:
+            plan_cursor.execute('SAVEPOINT cura_explain')
+        try:
+            plan_cursor.execute(EXPLAIN_PREFIX[dialect] + statement, parameters or ())
+            rows = plan_cursor.fetchall()
+        except Exception:
+            rows = None
+            if savepoint:
+                plan_cursor.execute('ROLLBACK TO SAVEPOINT cura_explain')
+        if savepoint:
+            plan_cursor.execute('RELEASE SAVEPOINT cura_explain')
+    except Exception:  # خارج معاملة (autocommit) لا يوجد SAVEPOINT ولا ما يتعطل
+        return None
+    finally:
+        plan_cursor.close()
+    if rows is None:
+        return None
+    return [row[-1] if dialect == 'sqlite' else row[0] for row in rows]
+
+class _QueryStat:
+    __slots__ = ('sql', 'count', 'total', 'max', 'rows')
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+
+class RunStats:
+    # استعلامات تشغيل واحد لصفحة Streamlit
+    # explain=True (وضع الاختبار): خطة التنفيذ لكل استعلام SELECT جديد وليس للبطيئة فقط، وعدّ صفوف SELECT
+    def __init__(self, page, explain=False):
+        self.page = page
+        self.explain = explain
+        self.started = time.time()
+        self.queries = 0
+        self.db_time = 0.0
+        self.fingerprints = Counter()
+        self.scans = {}
+
+    def suspects(self):
+        return {fp: n for fp, n in self.fingerprints.items() if n >= N_PLUS_ONE_THRESHOLD}
+
+    def scanned_tables(self):
+        return sorted({table for tables in self.scans.values() for table in tables})
+
+    def summary(self):
+        return {'page': self.page, 'started': self.started, 'queries': self.queries,
+                'db_ms': round(self.db_time * 1000, 2), 'n_plus_one': self.suspects(),
+                'full_scans': self.scanned_tables()}
+
+class Diagnostics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queries = {}
+        self._operations = {}
+        self._plans = {}
+        self.runs = deque(maxlen=RECENT_RUNS)
+        self._current = ContextVar('cura_diagnostics_run', default=None)
+        self._last = threading.local()
+
+    def record_query(self, statement, elapsed, rows=None):
+        fp = fingerprint(statement)
+        with self._lock:
+            stat = self._queries.get(fp)
+            if stat is None:
+                stat = self._queries[fp] = _QueryStat(normalize_sql(statement))
+            stat.count += 1
+            stat.total += elapsed
+            stat.max = max(stat.max, elapsed)
+            if rows is not None and rows >= 0:
+                stat.rows += rows
+        self._last.fingerprint = fp
+        run = self._current.get()
+        if run is not None:
+            run.queries += 1
+            run.db_time += elapsed
+            run.fingerprints[fp] += 1
+            if run.fingerprints[fp] == N_PLUS_ONE_THRESHOLD:
+                _log('n_plus_one', fingerprint=fp, page=run.page, sql=stat.sql[:2000])
+        if elapsed >= SLOW_QUERY_SECONDS:
+            _log('slow_query', fingerprint=fp, ms=round(elapsed * 1000, 2), sql=stat.sql[:2000],
+                 page=run.page if run is not None else None)
+        return fp
+
+    def needs_plan(self, fp, elapsed):
+        if fp in self._plans:
+            return False
+        run = self._current.get()
+        return elapsed >= SLOW_QUERY_SECONDS or (run is not None and run.explain)
+
+    def record_plan(self, fp, plan):
+        scans = [table for table in full_scans(plan) if table in WATCHED_TABLES]
+        with self._lock:
+            sql = self._queries[fp].sql
+            self._plans[fp] = {'plan': plan, 'scans': scans}
+        _log('query_plan', fingerprint=fp, plan=plan, full_scans=scans, sql=sql[:2000])
+        return scans
+
+    def record_scans(self, fp):
+        # الجداول الممرورة بالكامل في الاستعلام (من الخطة المحفوظة) تُضاف للتشغيل الحالي
+        run = self._current.get()
+        plan = self._plans.get(fp)
+        if run is not None and plan and plan['scans']:
+            run.scans[fp] = plan['scans']
+
+    def counting_rows(self):
+        run = self._current.get()
+        return run is not None and run.explain
+
+    def record_rows(self, rows):
+        # عدد الصفوف المُرجعة لآخر استعلام SELECT في هذا الخيط (يُحسب بعد قراءة النتيجة)
+        fp = getattr(self._last, 'fingerprint', None)
+        if fp is not None:
+            with self._lock:
+                self._queries[fp].rows += rows
+
+    def record_operation(self, name, elapsed, error=None):
+        with self._lock:
+            stat = self._operations.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0, 'errors': 0})
+            stat['count'] += 1
+            stat['total'] += elapsed
+            stat['max'] = max(stat['max'], elapsed)
+            stat['errors'] += error is not None
+        _log('operation', name=name, ms=round(elapsed * 1000, 2), error=error)
+
+    def begin_run(self, state, page):
+        # يُستدعى في بداية كل تشغيل للصفحة؛ ملخص التشغيل السابق لنفس المستخدم يُكتب في السجل
+        previous = state.get('_diagnostics_run')
+        if previous is not None:
+            _log('run', **previous.summary())
+        run = RunStats(page)
+        state['_diagnostics_run'] = run
+        self._current.set(run)
+        with self._lock:
+            self.runs.append(run)
+        return run
+
+    @contextmanager
+    def watch(self, name, explain=True):
+        # قياس مجموعة استعلامات خارج Streamlit (اختبارات / benchmark.py) كتشغيل مستقل
+        run = RunStats(name, explain)
+        token = self._current.set(run)
+        try:
+            yield run
+        finally:
+            self._current.reset(token)
+
+    def query_stats(self):
+        with self._lock:
+            return [{'fingerprint': fp, 'count': s.count, 'total_ms': round(s.total * 1000, 2),
+                     'avg_ms': round(s.total / s.count * 1000, 3), 'max_ms': round(s.max * 1000, 2),
+                     'rows': s.rows, 'sql': s.sql}
+                    for fp, s in sorted(self._queries.items(), key=lambda item: -item[1].total)]
+
+    def operation_stats(self):
+        with self._lock:
+            return [dict(name=name, count=s['count'], total_ms=round(s['total'] * 1000, 2),
+                         avg_ms=round(s['total'] / s['count'] * 1000, 2), max_ms=round(s['max'] * 1000, 2),
+                         errors=s['errors'])
+                    for name, s in sorted(self._operations.items(), key=lambda item: -item[1]['total'])]
+
+    def plan_stats(self):
+        with self._lock:
+            return [{'fingerprint': fp, 'full_scans': ', '.join(p['scans']), 'plan': ' | '.join(p['plan']),
+                     'sql': self._queries[fp].sql}
+                    for fp, p in sorted(self._plans.items(), key=lambda item: not item[1]['scans'])]
+
+    def run_stats(self):
+        with self._lock:
+            return [run.summary() for run in reversed(self.runs)]
+
+    def reset(self):
+        with self._lock:
+            self._queries.clear()
+            self._operations.clear()
+            self._plans.clear()
+            self.runs.clear()
+
+diagnostics = Diagnostics()
+
+def timed(name):
+    # زمن عمليات التقارير والتصدير
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            error = None
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                error = repr(e)
+                raise
+            finally:
+                diagnostics.record_operation(name, time.perf_counter() - started, error)
+        return wrapper
+    return decorator
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['_query_started'].pop()
+    # rowcount متاح للتعديلات فقط؛ صفوف SELECT تُحسب في _count_orm_rows
+    modifies = context is not None and (context.isinsert or context.isupdate or context.isdelete)
+    fp = diagnostics.record_query(statement, elapsed, cursor.rowcount if modifies else None)
+    if (not executemany and not modifies and conn.dialect.name in EXPLAIN_PREFIX
+            and statement.lstrip()[:6].upper().startswith(('SELECT', 'WITH')) and diagnostics.needs_plan(fp, elapsed)):
+        plan = explain(cursor, statement, parameters, conn.dialect.name)
+        if plan is not None:
+            diagnostics.record_plan(fp, plan)
+    diagnostics.record_scans(fp)
+
+def _count_orm_rows(orm_execute_state):
+    # عدد صفوف استعلامات ORM داخل diagnostics.watch فقط (الاختبارات و benchmark.py): العدّ يتطلب تحميل النتيجة
+    # كاملة (freeze)، فلا يتم في تشغيل الصفحات العادي ولا للقراءة على دفعات (yield_per / stream_results)
+    options = orm_execute_state.execution_options
+    if (not diagnostics.counting_rows() or not orm_execute_state.is_select or options.get('yield_per')
+            or options.get('stream_results')):
+        return None
+    frozen = orm_execute_state.invoke_statement().freeze()
+    diagnostics.record_rows(len(frozen.data))
+    return frozen()
+
+@contextmanager
+def assert_queries(max_queries=None, allow_scans=(), name='assert_queries'):
+    # للاختبارات: يرفع AssertionError إذا تكرر استعلام (N+1)، أو تجاوز العدد max_queries،
+    # أو مرّ استعلام على appointments/payments بالكامل (إلا الجداول في allow_scans)
+    if not ENABLED:
+        raise RuntimeError("القياس معطل (CURA_INSTRUMENT=0)")
+    with diagnostics.watch(name) as run:
+        yield run
+    problems = []
+    for fp, count in run.suspects().items():
+        problems.append(f"N+1: استعلام مكرر {count} مرة: {diagnostics._queries[fp].sql[:300]}")
+    if max_queries is not None and run.queries > max_queries:
+        problems.append(f"عدد الاستعلامات {run.queries} أكبر من {max_queries}")
+    for fp, tables in run.scans.items():
+        for table in set(tables) - set(allow_scans):
+            problems.append(f"مرور كامل على {table}: {diagnostics._queries[fp].sql[:300]}")
+    if problems:
+        raise AssertionError(f"{name}:\n" + '\n'.join(problems))
+
+def install(session_factory=None):
+    # التسجيل على مستوى كل المحركات (Engine)، وعلى جلسات ORM لعدّ الصفوف
+    if not ENABLED or event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    if session_factory is not None:
+        event.listen(session_factory, 'do_orm_execute', _count_orm_rows)
@@ -0,0 +1,98 @@
+# تنفيذ التصدير في الخلفية (مجمّع خيوط) حتى لا تتوقف واجهة Streamlit أثناء بناء الملفات
+# النتائج مخزنة حسب (نوع التصدير، الفترة، بصمة البيانات): نفس الطلب على نفس البيانات لا يُعاد بناؤه
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from reports import (export_report_excel, export_report_pdf, export_report_csv, export_report_parquet,
+                     report_fingerprint)
+
+EXPORTERS = {
+    'excel': export_report_excel,
+    'pdf': export_report_pdf,
+    'csv': export_report_csv,
+    'parquet': export_report_parquet,
+}
+
+# ملف النتيجة المحذوفة من الذاكرة المؤقتة قد تكون جلسة أخرى ما زالت تنزّله: يُحذف من القرص بعد هذه المهلة (ثوانٍ)
+EVICTED_FILE_GRACE = 600
+
+class ExportJob:
+    def __init__(self, key, total_rows):
+        self.key = key
+        self.total_rows = total_rows
+        self.rows_done = 0
+        self.future = None
+
+    def _on_progress(self, rows_done):
+        self.rows_done = rows_done
+
+    @property
+    def progress(self):
+        if self.done():
+            return 1.0
+        if not self.total_rows:
+            return 0.0
+        return min(self.rows_done / self.total_rows, 0.99)
+
+    def done(self):
+        return self.future.done()
+
+    @property
+    def error(self):
+        return self.future.exception() if self.done() else None
+
+    @property
+    def path(self):
+        # مسار الملف الناتج (بعد انتهاء المهمة بنجاح)
+        return self.future.result() if self.done() and self.error is None else None
+
+class ExportJobManager:
+    def __init__(self, max_workers=2, max_cached=16):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cura-export')
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._expired = []  # (موعد الحذف، مسار الملف) للنتائج المحذوفة
+        self.max_cached = max_cached
+        self.hits = 0
+        self.misses = 0
+
+    def submit(self, kind, start_date, end_date):
+        fingerprint, total_rows = report_fingerprint(start_date, end_date)
+        key = (kind, start_date, end_date, fingerprint)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job.error is None:
+                self._jobs.move_to_end(key)
+                self.hits += 1
+                return job
+            self.misses += 1
+            job = ExportJob(key, total_rows)
+            job.future = self._executor.submit(EXPORTERS[kind], start_date, end_date, progress=job._on_progress)
+            self._jobs[key] = job
+            self._evict()
+        return job
+
+    def get(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    def _evict(self):
+        # حذف أقدم النتائج المنتهية عند تجاوز الحد؛ ملفاتها تُحذف بعد EVICTED_FILE_GRACE
+        now = time.monotonic()
+        for key in list(self._jobs):
+            if len(self._jobs) <= self.max_cached:
+                break
+            job = self._jobs[key]
+            if not job.done():
+                continue
+            del self._jobs[key]
+            if job.path:
+                self._expired.append((now + EVICTED_FILE_GRACE, job.path))
+        for deadline, path in [item for item in self._expired if item[0] <= now]:
+            self._expired.remove((deadline, path))
+            if os.path.exists(path):
+                os.remove(path)
+
+export_jobs = ExportJobManager()
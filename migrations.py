@@ -0,0 +1,80 @@
+# ترقية مخطط قاعدة البيانات الموجودة (dental_clinic.db) بدون فقدان البيانات
+# التشغيل اليدوي: python migrations.py [--rebuild-search]
+import sys
+from sqlalchemy import inspect, text
+from database import engine as default_engine, Base
+# استيراد من أجل أثره فقط: تعريف الجداول في models.py يسجلها في Base.metadata،
+# وبدونه لا يعرف create_all و Base.metadata.sorted_tables أدناه أي جدول
+import models  # noqa: F401
+from search import fts_available, create_search_tables, rebuild_search_index, create_trigram_indexes
+from rollup import rebuild_daily_revenue
+from settlement import rebuild_doctor_ledger
+
+_upgraded = set()
+
+def _dedupe_treatment_percentages(conn):
+    # قبل إنشاء الفهرس الفريد: الإبقاء على آخر نسبة مُدخلة لكل (علاج، طبيب)
+    conn.execute(text(
+        "DELETE FROM treatment_percentages WHERE id NOT IN "
+        "(SELECT MAX(id) FROM treatment_percentages GROUP BY treatment_id, doctor_id)"
+    ))
+
+def _add_missing_columns(conn, inspector, table):
+    # أعمدة جديدة في models.py لجداول موجودة (create_all لا يعدّل الجداول الموجودة)
+    existing = {column['name'] for column in inspector.get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+def reset_sequences(conn, tables=None):
+    # PostgreSQL: بعد إدخال معرفات صريحة (الاستيراد / البيانات التجريبية) يُضبط العداد بعد أكبر معرف،
+    # وإلا فشلت الإضافات التالية بتكرار المفتاح. SQLite لا يحتاج ذلك
+    if conn.dialect.name != 'postgresql':
+        return
+    names = set(tables) if tables is not None else None
+    for table in Base.metadata.sorted_tables:
+        if (names is not None and table.name not in names) or 'id' not in table.c or not table.c.id.primary_key:
+            continue
+        conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                          f"COALESCE(MAX(id), 0) + 1, false) FROM {table.name}"))
+
+def upgrade(engine=None, force=False):
+    engine = engine or default_engine
+    key = str(engine.url)
+    if key in _upgraded and not force:
+        return
+    existing_tables = set(inspect(engine).get_table_names())
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        created = False
+        for table in Base.metadata.sorted_tables:
+            if table.name in existing_tables:
+                _add_missing_columns(conn, inspector, table)
+            existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                if index.name == 'ux_treatment_percentages_treatment_doctor':
+                    _dedupe_treatment_percentages(conn)
+                index.create(conn)
+                created = True
+        if fts_available(conn) and create_search_tables(conn):
+            rebuild_search_index(conn)  # تعبئة فهرس البحث من البيانات الموجودة
+        if engine.dialect.name == 'postgresql':
+            create_trigram_indexes(conn)
+        if created:
+            conn.execute(text('ANALYZE'))  # تحديث إحصائيات المخطِّط لاستخدام الفهارس الجديدة
+    if 'daily_revenue' not in existing_tables:
+        rebuild_daily_revenue(engine=engine)  # تعبئة جدول التجميع من الدفعات الموجودة
+    if 'doctor_ledger' not in existing_tables:
+        rebuild_doctor_ledger(engine=engine)  # أرصدة الأطباء من الدفعات الموجودة
+    _upgraded.add(key)
+
+if __name__ == '__main__':
+    upgrade(force=True)
+    if '--rebuild-search' in sys.argv and fts_available(default_engine):
+        with default_engine.begin() as conn:
+            rebuild_search_index(conn)
+    print("تمت ترقية قاعدة البيانات")
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text
+import datetime
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Text, Index, func, literal_column
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -20,18 +21,25 @@ class Doctor(Base):
     specialty = Column(String)
     phone = Column(String)
     email = Column(String)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
 
 class Treatment(Base):
     __tablename__ = 'treatments'
     id = Column(Integer, primary_key=True)
     name = Column(String)
     base_cost = Column(Float)
+    duration = Column(Integer)  # المدة الافتراضية للموعد بالدقائق
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
 
 class TreatmentPercentage(Base):
     __tablename__ = 'treatment_percentages'
+    # نسبة واحدة فقط لكل (علاج، طبيب)
+    __table_args__ = (
+        Index('ux_treatment_percentages_treatment_doctor', 'treatment_id', 'doctor_id', unique=True),
+    )
     id = Column(Integer, primary_key=True)
     treatment_id = Column(Integer, ForeignKey('treatments.id'))
-    doctor_id = Column(Integer, ForeignKey('doctors.id'))
+    doctor_id = Column(Integer, ForeignKey('doctors.id'), index=True)
     clinic_percentage = Column(Float)  # نسبة العيادة
     doctor_percentage = Column(Float)  # نسبة الطبيب
     treatment = relationship("Treatment")
@@ -39,11 +47,16 @@ class TreatmentPercentage(Base):
 
 class Appointment(Base):
     __tablename__ = 'appointments'
+    # جدول الطبيب اليومي: (الطبيب، التاريخ)
+    __table_args__ = (
+        Index('ix_appointments_doctor_date', 'doctor_id', 'date'),
+    )
     id = Column(Integer, primary_key=True)
-    patient_id = Column(Integer, ForeignKey('patients.id'))
-    doctor_id = Column(Integer, ForeignKey('doctors.id'))
-    treatment_id = Column(Integer, ForeignKey('treatments.id'))
-    date = Column(DateTime)
+    patient_id = Column(Integer, ForeignKey('patients.id'), index=True)
+    doctor_id = Column(Integer, ForeignKey('doctors.id'))  # مغطى بفهرس (الطبيب، التاريخ)
+    treatment_id = Column(Integer, ForeignKey('treatments.id'), index=True)
+    date = Column(DateTime, index=True)
+    duration = Column(Integer)  # بالدقائق - انظر scheduling.py
     status = Column(String)
     notes = Column(Text)
     patient = relationship("Patient")
@@ -53,7 +66,7 @@ class Appointment(Base):
 class Payment(Base):
     __tablename__ = 'payments'
     id = Column(Integer, primary_key=True)
-    appointment_id = Column(Integer, ForeignKey('appointments.id'))
+    appointment_id = Column(Integer, ForeignKey('appointments.id'), index=True)
     total_amount = Column(Float)
     paid_amount = Column(Float)
     clinic_share = Column(Float)
@@ -61,5 +74,91 @@ class Payment(Base):
     payment_method = Column(String)
     discounts = Column(Float)
     taxes = Column(Float)
-    date_paid = Column(DateTime)
-    appointment = relationship("Appointment")
\ No newline at end of file
+    date_paid = Column(DateTime, index=True)
+    # وقت آخر إضافة/تعديل (لبصمة التقارير في reports.report_fingerprint)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+    appointment = relationship("Appointment")
+
+# المستحق على المريض لكل دفعة، والدفعات غير المسددة بالكامل (paid_amount الفارغ = لم يُدفع شيء):
+# فهرس جزئي يحتوي هذه الدفعات فقط (تقرير الذمم في receivables.py يقرأ منه ولا يمر على كل الدفعات).
+# القيم الثابتة مكتوبة نصاً حتى يطابق شرط الاستعلام شرط الفهرس
+PAYMENT_DUE = (Payment.total_amount - func.coalesce(Payment.discounts, literal_column('0'))
+               + func.coalesce(Payment.taxes, literal_column('0')))
+PAYMENT_PAID = func.coalesce(Payment.paid_amount, literal_column('0'))
+PAYMENT_OUTSTANDING = PAYMENT_PAID < PAYMENT_DUE
+Index('ix_payments_outstanding', Payment.date_paid, sqlite_where=PAYMENT_OUTSTANDING,
+      postgresql_where=PAYMENT_OUTSTANDING)
+
+class DailyRevenue(Base):
+    # تجميع يومي للإيرادات (التاريخ × الطبيب × العلاج × طريقة الدفع) يُحدَّث مع كل دفعة - انظر rollup.py
+    # بدون مفاتيح أجنبية لأنه جدول مشتق؛ القيمة 0 / '' تعني غير معروف
+    __tablename__ = 'daily_revenue'
+    __table_args__ = (
+        Index('ux_daily_revenue_key', 'date', 'doctor_id', 'treatment_id', 'payment_method', unique=True),
+    )
+    id = Column(Integer, primary_key=True)
+    date = Column(Date, nullable=False)
+    doctor_id = Column(Integer, nullable=False, default=0)
+    treatment_id = Column(Integer, nullable=False, default=0)
+    payment_method = Column(String, nullable=False, default='')
+    payments_count = Column(Integer, nullable=False, default=0)
+    total_amount = Column(Float, nullable=False, default=0)
+    paid_amount = Column(Float, nullable=False, default=0)
+    clinic_share = Column(Float, nullable=False, default=0)
+    doctor_share = Column(Float, nullable=False, default=0)
+    discounts = Column(Float, nullable=False, default=0)
+    taxes = Column(Float, nullable=False, default=0)
+
+class DoctorPayout(Base):
+    # مبالغ صُرفت للطبيب من مستحقاته - انظر settlement.py
+    __tablename__ = 'doctor_payouts'
+    __table_args__ = (
+        Index('ix_doctor_payouts_doctor_date', 'doctor_id', 'date_paid'),
+    )
+    id = Column(Integer, primary_key=True)
+    doctor_id = Column(Integer, ForeignKey('doctors.id'), nullable=False)
+    amount = Column(Float, nullable=False)
+    payment_method = Column(String)
+    notes = Column(Text)
+    date_paid = Column(DateTime, nullable=False)
+    doctor = relationship("Doctor")
+
+class DoctorLedger(Base):
+    # مستحقات كل طبيب شهرياً (الطبيب × الشهر) مع الرصيد الجاري في نهاية الشهر، يُحدَّث مع كل دفعة أو صرف
+    # بدون مفاتيح أجنبية لأنه جدول مشتق؛ month = أول يوم في الشهر
+    __tablename__ = 'doctor_ledger'
+    __table_args__ = (
+        Index('ux_doctor_ledger_key', 'doctor_id', 'month', unique=True),
+    )
+    id = Column(Integer, primary_key=True)
+    doctor_id = Column(Integer, nullable=False)
+    month = Column(Date, nullable=False)
+    payments_count = Column(Integer, nullable=False, default=0)
+    earned = Column(Float, nullable=False, default=0)  # مجموع doctor_share
+    payouts_count = Column(Integer, nullable=False, default=0)
+    paid_out = Column(Float, nullable=False, default=0)
+    balance = Column(Float, nullable=False, default=0)  # المستحق للطبيب حتى نهاية الشهر
+
+class SettlementPeriod(Base):
+    # إقفال الفترة: أرصدة كل طبيب مجمّدة حتى نهاية الشهر period_end (لا تعديل للدفعات قبلها)
+    __tablename__ = 'settlement_periods'
+    __table_args__ = (
+        Index('ux_settlement_periods_doctor_end', 'doctor_id', 'period_end', unique=True),
+    )
+    id = Column(Integer, primary_key=True)
+    doctor_id = Column(Integer, nullable=False)
+    period_start = Column(Date)
+    period_end = Column(Date, nullable=False, index=True)
+    opening_balance = Column(Float, nullable=False, default=0)
+    earned = Column(Float, nullable=False, default=0)
+    paid_out = Column(Float, nullable=False, default=0)
+    closing_balance = Column(Float, nullable=False, default=0)
+    closed_at = Column(DateTime)
+
+class ImageBlob(Base):
+    # صور الأشعة مخزنة حسب بصمة المحتوى (sha256) مع عدد المرضى المرتبطين بها - انظر images.py
+    __tablename__ = 'image_blobs'
+    sha256 = Column(String(64), primary_key=True)
+    path = Column(String, nullable=False, unique=True)
+    size = Column(Integer)
+    ref_count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,159 @@
+# القراءة العمودية للقوائم المعروضة: استعلامات select للأعمدة المعروضة فقط (بدون كائنات ORM)
+# تُملأ مباشرة في DataFrame بأنواع أعمدة محددة مسبقاً لكل شاشة (بدون استنتاج pandas للأنواع)،
+# على دفعات للقوائم الكبيرة، واختيارياً بأنواع Arrow (arrow=True أو CURA_ARROW_FRAMES=1).
+# نفس شروط البحث والتصفية والمؤشرات (keyset) المستخدمة في list_* في functions.py
+import datetime
+import itertools
+import os
+import pandas as pd
+from sqlalchemy import select
+from database import unit_of_work
+from models import Patient, Doctor, Treatment, Appointment, Payment
+from functions import (Page, DEFAULT_PAGE_SIZE, _keyset_queries, _keyset_rows, filter_patients, filter_doctors,
+                       filter_treatments, filter_appointments, filter_payments)
+
+READ_CHUNK_SIZE = 10000
+USE_ARROW = os.environ.get('CURA_ARROW_FRAMES', '0').lower() in ('1', 'true', 'yes')
+
+# نوع العمود -> نوع pandas (قابل لـ NULL)
+PANDAS_DTYPES = {'int': 'Int64', 'float': 'Float64', 'str': 'string', 'datetime': 'datetime64[us]'}
+
+# أعمدة كل شاشة: الاسم -> (العمود، النوع)
+PATIENT_COLUMNS = {
+    'id': (Patient.id, 'int'), 'name': (Patient.name, 'str'), 'age': (Patient.age, 'int'),
+    'gender': (Patient.gender, 'str'), 'phone': (Patient.phone, 'str'), 'address': (Patient.address, 'str'),
+}
+DOCTOR_COLUMNS = {
+    'id': (Doctor.id, 'int'), 'name': (Doctor.name, 'str'), 'specialty': (Doctor.specialty, 'str'),
+    'phone': (Doctor.phone, 'str'), 'email': (Doctor.email, 'str'),
+}
+TREATMENT_COLUMNS = {
+    'id': (Treatment.id, 'int'), 'name': (Treatment.name, 'str'), 'base_cost': (Treatment.base_cost, 'float'),
+    'duration': (Treatment.duration, 'int'),
+}
+APPOINTMENT_COLUMNS = {
+    'id': (Appointment.id, 'int'), 'patient': (Patient.name, 'str'), 'doctor': (Doctor.name, 'str'),
+    'treatment': (Treatment.name, 'str'), 'date': (Appointment.date, 'datetime'),
+    'duration': (Appointment.duration, 'int'), 'status': (Appointment.status, 'str'),
+}
+PAYMENT_COLUMNS = {
+    'id': (Payment.id, 'int'), 'appointment_id': (Payment.appointment_id, 'int'),
+    'total_amount': (Payment.total_amount, 'float'), 'paid_amount': (Payment.paid_amount, 'float'),
+    'clinic_share': (Payment.clinic_share, 'float'), 'doctor_share': (Payment.doctor_share, 'float'),
+    'date_paid': (Payment.date_paid, 'datetime'),
+}
+
+def _arrow_types():
+    import pyarrow as pa
+    return {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string(), 'datetime': pa.timestamp('us')}
+
+def _chunk(rows, schema, arrow):
+    # صفوف (tuples) -> أعمدة مكتوبة النوع مباشرة
+    names = list(schema)
+    columns = list(zip(*rows)) if rows else [()] * len(names)
+    if arrow:
+        import pyarrow as pa
+        types = _arrow_types()
+        return pa.Table.from_arrays([pa.array(values, type=types[schema[name]]) for name, values in zip(names, columns)],
+                                    names=names)
+    return pd.DataFrame({name: pd.array(values, dtype=PANDAS_DTYPES[schema[name]])
+                         for name, values in zip(names, columns)})
+
+def frame_from_rows(rows, schema, arrow=USE_ARROW):
+    # schema: الاسم -> النوع ('int' / 'float' / 'str' / 'datetime') بنفس ترتيب أعمدة الصفوف
+    return frame_from_chunks([rows], schema, arrow)
+
+def frame_from_chunks(chunks, schema, arrow=USE_ARROW):
+    parts = [_chunk(list(rows), schema, arrow) for rows in chunks]
+    if arrow:
+        import pyarrow as pa
+        table = pa.concat_tables(parts) if parts else _chunk([], schema, True)
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+    if not parts:
+        return _chunk([], schema, False)
+    return parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+
+def _partitions(session, statement, chunk_size=READ_CHUNK_SIZE):
+    return session.execute(statement.execution_options(yield_per=chunk_size)).partitions()
+
+def read_frame(session, statement, schema, chunk_size=READ_CHUNK_SIZE, arrow=USE_ARROW):
+    # قراءة استعلام select كاملاً على دفعات (yield_per) دون تحميل كل الصفوف كـ tuples مرة واحدة
+    return frame_from_chunks(_partitions(session, statement, chunk_size), schema, arrow)
+
+def _select(columns, names=None):
+    # select للأعمدة المطلوبة فقط (id دائماً للمؤشر)؛ يُرجع (select، schema)
+    names = list(columns) if names is None else ['id'] + [name for name in names if name != 'id']
+    return (select(*[columns[name][0].label(name) for name in names]),
+            {name: columns[name][1] for name in names})
+
+def _page_frame(session, statement, schema, model, cursor, page_size, sort_column=None, descending=False,
+                arrow=USE_ARROW):
+    # page_size=None: كل الصفوف على دفعات بدون مؤشر
+    if page_size is not None and sort_column is not None and sort_column.key not in schema:
+        statement = statement.add_columns(sort_column.label(sort_column.key))
+    statements = _keyset_queries(statement, model, cursor, sort_column, descending)
+    if page_size is None:
+        chunks = itertools.chain.from_iterable(_partitions(session, part) for part in statements)
+        return Page(frame_from_chunks(chunks, schema, arrow), None)
+    rows = []
+    for part in statements:
+        rows += session.execute(part.limit(page_size + 1 - len(rows))).all()
+        if len(rows) > page_size:
+            break
+    page = _keyset_rows(rows, page_size, sort_column)
+    rows = [tuple(row)[:len(schema)] for row in page.items]
+    return Page(frame_from_rows(rows, schema, arrow), page.next_cursor)
+
+def patients_frame(cursor=None, page_size=DEFAULT_PAGE_SIZE, search=None, gender=None, columns=None,
+                   arrow=USE_ARROW):
+    with unit_of_work() as session:
+        statement, schema = _select(PATIENT_COLUMNS, columns)
+        statement = filter_patients(statement, session, search, gender)
+        return _page_frame(session, statement, schema, Patient, cursor, page_size, arrow=arrow)
+
+def doctors_frame(cursor=None, page_size=DEFAULT_PAGE_SIZE, search=None, specialty=None, columns=None,
+                  arrow=USE_ARROW):
+    with unit_of_work() as session:
+        statement, schema = _select(DOCTOR_COLUMNS, columns)
+        statement = filter_doctors(statement, session, search, specialty)
+        return _page_frame(session, statement, schema, Doctor, cursor, page_size, arrow=arrow)
+
+def treatments_frame(cursor=None, page_size=DEFAULT_PAGE_SIZE, search=None, columns=None, arrow=USE_ARROW):
+    with unit_of_work() as session:
+        statement, schema = _select(TREATMENT_COLUMNS, columns)
+        statement = filter_treatments(statement, session, search)
+        return _page_frame(session, statement, schema, Treatment, cursor, page_size, arrow=arrow)
+
+def _appointment_select(columns=None):
+    statement, schema = _select(APPOINTMENT_COLUMNS, columns)
+    statement = statement.select_from(Appointment).outerjoin(Appointment.patient).outerjoin(
+        Appointment.doctor).outerjoin(Appointment.treatment)
+    return statement, schema
+
+def appointments_frame(cursor=None, page_size=DEFAULT_PAGE_SIZE, search=None, patient_id=None, doctor_id=None,
+                       status=None, date_from=None, date_to=None, descending=True, columns=None, arrow=USE_ARROW):
+    # مرتبة حسب التاريخ (الأحدث أولاً)، المؤشر = (التاريخ، المعرف) كما في list_appointments
+    with unit_of_work() as session:
+        statement, schema = _appointment_select(columns)
+        statement = filter_appointments(statement, session, search, patient_id, doctor_id, status, date_from,
+                                        date_to, joined=True)
+        return _page_frame(session, statement, schema, Appointment, cursor, page_size,
+                           sort_column=Appointment.date, descending=descending, arrow=arrow)
+
+def payments_frame(cursor=None, page_size=DEFAULT_PAGE_SIZE, appointment_id=None, date_from=None, date_to=None,
+                   descending=True, columns=None, arrow=USE_ARROW):
+    with unit_of_work() as session:
+        statement, schema = _select(PAYMENT_COLUMNS, columns)
+        statement = filter_payments(statement, session, appointment_id, date_from, date_to)
+        return _page_frame(session, statement, schema, Payment, cursor, page_size,
+                           sort_column=Payment.date_paid, descending=descending, arrow=arrow)
+
+def calendar_frame(start, days=1, doctor_id=None, arrow=USE_ARROW):
+    # مواعيد نافذة التقويم (مثل get_calendar) كأعمدة
+    window_start = datetime.datetime.combine(start, datetime.time.min)
+    window_end = window_start + datetime.timedelta(days=days)
+    with unit_of_work() as session:
+        statement, schema = _appointment_select(['id', 'patient', 'doctor', 'treatment', 'date', 'status'])
+        statement = filter_appointments(statement, session, doctor_id=doctor_id, date_from=window_start,
+                                        date_to=window_end, joined=True)
+        return read_frame(session, statement.order_by(Appointment.date, Appointment.id), schema, arrow=arrow)
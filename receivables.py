@@ -0,0 +1,86 @@
+# الذمم المدينة: رصيد كل مريض (المستحق - المدفوع) موزعاً على فترات التأخير 0-30 / 31-60 / 61-90 / 90+ يوماً
+# باستعلام مجمّع واحد على الدفعات غير المسددة فقط (الفهرس الجزئي ix_payments_outstanding في models.py).
+# عمر الدين = من تاريخ الدفعة (الفاتورة) حتى as_of؛ المدفوع هو المدفوع حتى الآن وليس حتى as_of
+import datetime
+from sqlalchemy import and_, case, func
+from database import unit_of_work
+from models import Patient, Appointment, Payment, PAYMENT_DUE, PAYMENT_PAID, PAYMENT_OUTSTANDING
+from readmodel import frame_from_rows
+from instrumentation import timed
+
+MIN_BALANCE = 0.005  # أرصدة أقل من ذلك = فروق تقريب
+AGING_BUCKETS = [('due_0_30', 30), ('due_31_60', 60), ('due_61_90', 90), ('due_90_plus', None)]
+
+RECEIVABLE_SCHEMA = {
+    'patient_id': 'int', 'name': 'str', 'phone': 'str', 'invoices': 'int', 'balance': 'float',
+    'due_0_30': 'float', 'due_31_60': 'float', 'due_61_90': 'float', 'due_90_plus': 'float', 'oldest': 'datetime',
+}
+RECEIVABLE_LABELS = {
+    'patient_id': 'رقم المريض', 'name': 'المريض', 'phone': 'الهاتف', 'invoices': 'عدد الفواتير',
+    'balance': 'الرصيد', 'due_0_30': '0-30 يوم', 'due_31_60': '31-60 يوم', 'due_61_90': '61-90 يوم',
+    'due_90_plus': 'أكثر من 90 يوم', 'oldest': 'أقدم فاتورة',
+}
+
+def _outstanding():
+    return PAYMENT_DUE - PAYMENT_PAID
+
+def _buckets(as_of):
+    # مبلغ كل فترة تأخير: حدود الفترات تواريخ محسوبة مسبقاً (بدون دوال تاريخ خاصة بكل قاعدة بيانات)
+    outstanding = _outstanding()
+    columns = []
+    newer = None
+    for name, days in AGING_BUCKETS:
+        older = None
+        if days is not None:
+            older = datetime.datetime.combine(as_of - datetime.timedelta(days=days), datetime.time.min)
+        conditions = []
+        if older is not None:
+            conditions.append(Payment.date_paid >= older)
+        if newer is not None:
+            conditions.append(Payment.date_paid < newer)
+        columns.append(func.coalesce(func.sum(case((and_(*conditions), outstanding), else_=0)), 0).label(name))
+        newer = older
+    return columns
+
+def _criteria(as_of):
+    # PAYMENT_OUTSTANDING بنفس صيغة شرط الفهرس الجزئي
+    return [PAYMENT_OUTSTANDING,
+            Payment.date_paid < datetime.datetime.combine(as_of + datetime.timedelta(days=1), datetime.time.min)]
+
+@timed('report.receivables')
+def receivables_report(as_of=None, min_balance=MIN_BALANCE, limit=None):
+    # صف لكل مريض عليه رصيد، الأكبر رصيداً أولاً
+    as_of = as_of or datetime.date.today()
+    balance = func.sum(_outstanding())
+    with unit_of_work() as session:
+        query = session.query(Appointment.patient_id, Patient.name, Patient.phone, func.count(Payment.id),
+                              balance, *_buckets(as_of), func.min(Payment.date_paid)).join(
+            Appointment, Payment.appointment_id == Appointment.id).outerjoin(
+            Patient, Appointment.patient_id == Patient.id)
+        query = query.filter(*_criteria(as_of)).group_by(Appointment.patient_id, Patient.name, Patient.phone)
+        query = query.having(balance > min_balance).order_by(balance.desc(), Appointment.patient_id)
+        if limit is not None:
+            query = query.limit(limit)
+        return frame_from_rows(query.all(), RECEIVABLE_SCHEMA)
+
+@timed('report.receivables_summary')
+def receivables_summary(as_of=None, min_balance=MIN_BALANCE):
+    # الإجماليات لكل فترة تأخير وعدد المرضى (من نفس التجميع لكل مريض، في قاعدة البيانات)
+    as_of = as_of or datetime.date.today()
+    balance = func.sum(_outstanding())
+    with unit_of_work() as session:
+        per_patient = session.query(balance.label('balance'), *_buckets(as_of)).join(
+            Appointment, Payment.appointment_id == Appointment.id).filter(*_criteria(as_of)).group_by(
+            Appointment.patient_id).having(balance > min_balance).subquery()
+        row = session.query(func.count(), *[func.coalesce(func.sum(per_patient.c[name]), 0)
+                                            for name in ['balance'] + [b for b, _ in AGING_BUCKETS]]).one()
+    return dict(zip(['patients', 'balance'] + [name for name, _ in AGING_BUCKETS], row))
+
+def patient_receivables(patient_id, as_of=None):
+    # الفواتير غير المسددة لمريض واحد (عبر فهرس المواعيد حسب المريض)
+    as_of = as_of or datetime.date.today()
+    with unit_of_work() as session:
+        return session.query(Payment.id, Payment.appointment_id, Payment.date_paid, PAYMENT_DUE.label('due'),
+                             Payment.paid_amount, _outstanding().label('outstanding')).join(
+            Appointment, Payment.appointment_id == Appointment.id).filter(
+            Appointment.patient_id == patient_id, *_criteria(as_of)).order_by(Payment.date_paid).all()
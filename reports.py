@@ -1,43 +1,320 @@
 import pandas as pd
+from openpyxl import Workbook
 from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
+import contextlib
+import hashlib
 import io
-from database import Session
-from models import Payment
+import logging
+import os
+import tempfile
+from sqlalchemy import Date, cast, func, literal
+from database import Session, read_snapshot
+from instrumentation import timed
+from models import Payment, Doctor, Treatment, DailyRevenue
+from rollup import MEASURE_COLUMNS
 
-def generate_report(start_date, end_date):
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except ImportError:  # بدون هذه المكتبات تُطبع النصوص العربية بدون تشكيل
+    arabic_reshaper = None
+
+# خط يدعم العربية يُضمَّن في ملفات PDF: CURA_PDF_FONT إن حُدد، وإلا أول خط موجود من خطوط النظام الشائعة
+# بدون أي منها يُستخدم Helvetica (لا يحتوي حروفاً عربية) مع تحذير في السجل وفي الواجهة
+PDF_FONT_PATH = os.environ.get('CURA_PDF_FONT')
+PDF_FONT_CANDIDATES = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts', 'Amiri-Regular.ttf'),
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/truetype/noto/NotoNaskhArabic-Regular.ttf',
+    '/usr/share/fonts/noto/NotoNaskhArabic-Regular.ttf',
+    'C:\\Windows\\Fonts\\arial.ttf',
+]
+REPORT_COLUMNS = ['موعد', 'إجمالي', 'نصيب العيادة', 'نصيب الطبيب', 'تاريخ']
+REPORT_CHUNK_SIZE = 5000
+
+PERIODS = {'day': 'يومي', 'week': 'أسبوعي', 'month': 'شهري'}
+GROUPINGS = {'doctor': 'الطبيب', 'treatment': 'العلاج', 'payment_method': 'طريقة الدفع'}
+
+def _date_range(query, start_date, end_date):
+    # ليشمل اليوم الأخير كاملاً
+    return query.filter(Payment.date_paid >= pd.Timestamp(start_date).to_pydatetime(),
+                        Payment.date_paid < (pd.Timestamp(end_date) + pd.Timedelta(days=1)).to_pydatetime())
+
+def _report_query(session, start_date, end_date):
+    query = session.query(Payment.appointment_id, Payment.total_amount, Payment.clinic_share,
+                          Payment.doctor_share, Payment.date_paid)
+    return _date_range(query, start_date, end_date).order_by(Payment.date_paid, Payment.id)
+
+# التقارير والتصدير تقرأ من لقطة ثابتة (database.read_snapshot): لا تتأثر بالدفعات المضافة أثناء القراءة
+# ولا تؤخر الحجز والفوترة. session=لقطة مفتوحة يشترك فيها أكثر من تقرير (مثل أوراق مصنف Excel)
+
+@timed('report.generate')
+def generate_report(start_date, end_date, session=None):
+    with read_snapshot(session) as session:
+        rows = _report_query(session, start_date, end_date).all()
+    return pd.DataFrame(rows, columns=REPORT_COLUMNS)
+
+def iter_report_chunks(start_date, end_date, chunk_size=REPORT_CHUNK_SIZE, progress=None, session=None):
+    # نفس بيانات generate_report لكن على دفعات (DataFrame لكل chunk_size صف) من مؤشر مفتوح
+    # progress(عدد الصفوف المقروءة حتى الآن) يُستدعى بعد كل دفعة
+    with read_snapshot(session) as session:
+        statement = _report_query(session, start_date, end_date).statement
+        result = session.execute(statement.execution_options(yield_per=chunk_size))
+        rows_done = 0
+        for rows in result.partitions():
+            yield pd.DataFrame(rows, columns=REPORT_COLUMNS)
+            rows_done += len(rows)
+            if progress is not None:
+                progress(rows_done)
+
+def report_fingerprint(start_date, end_date):
+    # (بصمة البيانات، عدد الدفعات) للفترة: صفوف جدول التجميع اليومي تتغير مع إضافة/حذف دفعة أو تعديل مبالغها،
+    # و(العدد، أكبر معرف، آخر تعديل) للدفعات في الفترة وللأطباء والعلاجات تلتقط باقي التعديلات
+    # (رقم الموعد في الدفعة، أسماء الأطباء والعلاجات في ملخصات Excel)
     session = Session()
-    payments = session.query(Payment).filter(Payment.date_paid.between(start_date, end_date + pd.Timedelta(days=1))).all()  # ليشمل اليوم كاملاً
-    data = [{'موعد': p.appointment_id, 'إجمالي': p.total_amount, 'نصيب العيادة': p.clinic_share, 'نصيب الطبيب': p.doctor_share} for p in payments]
-    df = pd.DataFrame(data)
-    session.close()
+    try:
+        rows = session.query(DailyRevenue.date, DailyRevenue.doctor_id, DailyRevenue.treatment_id,
+                             DailyRevenue.payment_method, *[getattr(DailyRevenue, name) for name in MEASURE_COLUMNS]
+                             ).filter(DailyRevenue.date >= pd.Timestamp(start_date).date(),
+                                      DailyRevenue.date <= pd.Timestamp(end_date).date()).order_by(DailyRevenue.id).all()
+        versions = [tuple(_date_range(session.query(func.count(Payment.id), func.max(Payment.id),
+                                                    func.max(Payment.updated_at)), start_date, end_date).one())]
+        for model in (Doctor, Treatment):
+            versions.append(tuple(session.query(func.count(model.id), func.max(model.id),
+                                                func.max(model.updated_at)).one()))
+    finally:
+        session.close()
+    fingerprint = hashlib.sha1(repr(([tuple(row) for row in rows], versions)).encode('utf-8')).hexdigest()
+    return fingerprint, sum(row.payments_count for row in rows)
+
+def _period_column(column, period, dialect):
+    # بداية الفترة (يوم / أسبوع يبدأ الاثنين / شهر) محسوبة داخل قاعدة البيانات
+    if dialect == 'sqlite':
+        if period == 'day':
+            return func.date(column)
+        if period == 'week':
+            return func.date(column, 'weekday 0', '-6 days')
+        return func.strftime('%Y-%m-01', column)
+    return cast(func.date_trunc(period, column), Date)
+
+@timed('report.aggregate')
+def aggregate_report(start_date, end_date, period='day', group_by=None, session=None):
+    # يُقرأ من جدول التجميع اليومي (daily_revenue) بدلاً من جدول الدفعات،
+    # والنتيجة صف واحد لكل فترة (ولكل طبيب/علاج/طريقة دفع)؛ period=None للملخص على كامل المدة
+    if period is not None and period not in PERIODS:
+        raise ValueError(f"فترة غير معروفة: {period}")
+    if group_by is not None and group_by not in GROUPINGS:
+        raise ValueError(f"تجميع غير معروف: {group_by}")
+    # استعلام واحد متسق بذاته: لقطة فقط إذا مُررت من تصدير يقرأ غيره أيضاً
+    owned = session is None
+    if owned:
+        session = Session()
+    try:
+        if period is not None:
+            period_col = _period_column(DailyRevenue.date, period, session.get_bind().dialect.name).label('period')
+        else:
+            period_col = None
+        if group_by == 'doctor':
+            group_col = func.coalesce(Doctor.name, literal('غير معروف')).label('group')
+        elif group_by == 'treatment':
+            group_col = func.coalesce(Treatment.name, literal('غير معروف')).label('group')
+        elif group_by == 'payment_method':
+            group_col = DailyRevenue.payment_method.label('group')
+        else:
+            group_col = None
+        keys = [col for col in (period_col, group_col) if col is not None]
+        query = session.query(*keys, *[func.sum(getattr(DailyRevenue, name)) for name in MEASURE_COLUMNS])
+        if group_by == 'doctor':
+            query = query.outerjoin(Doctor, DailyRevenue.doctor_id == Doctor.id)
+        elif group_by == 'treatment':
+            query = query.outerjoin(Treatment, DailyRevenue.treatment_id == Treatment.id)
+        query = query.filter(DailyRevenue.date >= pd.Timestamp(start_date).date(),
+                             DailyRevenue.date <= pd.Timestamp(end_date).date())
+        rows = query.group_by(*keys).order_by(*keys).all()
+    finally:
+        if owned:
+            session.close()
+    names = (['الفترة'] if period else []) + ([GROUPINGS[group_by]] if group_by else []) + [
+        'عدد الدفعات', 'إجمالي', 'مدفوع', 'نصيب العيادة', 'نصيب الطبيب', 'الخصومات', 'الضرائب']
+    df = pd.DataFrame(rows, columns=names)
+    if period:
+        df['الفترة'] = pd.to_datetime(df['الفترة'])
     return df
 
+logger = logging.getLogger('cura.reports')
+_font_warning_logged = False
+
+@contextlib.contextmanager
+def _temp_path(suffix):
+    # ملف مؤقت للتصدير: يُحذف إذا فشل التصدير في منتصفه، وإلا يُسلَّم مساره للمستدعي
+    handle, path = tempfile.mkstemp(suffix=suffix, prefix='cura_report_')
+    os.close(handle)
+    try:
+        yield path
+    except BaseException:
+        os.remove(path)
+        raise
+
+def pdf_font_path():
+    # مسار الخط العربي المستخدم في PDF (None إذا لم يوجد أي خط)
+    if PDF_FONT_PATH:
+        return PDF_FONT_PATH if os.path.exists(PDF_FONT_PATH) else None
+    return next((path for path in PDF_FONT_CANDIDATES if os.path.exists(path)), None)
+
+def _pdf_font():
+    global _font_warning_logged
+    path = pdf_font_path()
+    if path is None:
+        if not _font_warning_logged:
+            _font_warning_logged = True
+            logger.warning('no Arabic TTF font found (CURA_PDF_FONT=%r); PDF text will use Helvetica and Arabic '
+                           'characters will not render', PDF_FONT_PATH)
+        return 'Helvetica'
+    if 'CuraArabic' not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont('CuraArabic', path))
+    return 'CuraArabic'
+
+def _rtl(text):
+    # تشكيل الحروف العربية وترتيبها من اليمين لليسار للطباعة
+    if arabic_reshaper is None:
+        return text
+    return get_display(arabic_reshaper.reshape(text))
+
+def _format_column(series):
+    # التنسيق عمودياً (لكل عمود مرة واحدة) بدلاً من صف بصف
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.strftime('%Y-%m-%d %H:%M').fillna('').tolist()
+    if pd.api.types.is_float_dtype(series):
+        return series.round(2).astype(str).replace('nan', '').tolist()
+    values = series.fillna('').astype(str)
+    if arabic_reshaper is not None and series.dtype == object:
+        values = values.map(_rtl)
+    return values.tolist()
+
+class PdfReportWriter:
+    # يكتب الجدول صفحة بصفحة: الأعمدة من اليمين لليسار، والعناوين تتكرر في كل صفحة
+    row_height = 18
+    margin = 40
+
+    def __init__(self, target, columns, title="تقرير المحاسبة"):
+        self.canvas = canvas.Canvas(target, pagesize=letter, pageCompression=1)
+        self.font = _pdf_font()
+        self.width, self.height = letter
+        column_width = (self.width - 2 * self.margin) / max(len(columns), 1)
+        self.x_positions = [self.width - self.margin - i * column_width for i in range(len(columns))]
+        self.headers = [_rtl(str(col)) for col in columns]
+        self.canvas.setFont(self.font, 14)
+        self.canvas.drawRightString(self.width - self.margin, self.height - self.margin, _rtl(title))
+        self._start_table(self.height - self.margin - 40)
+
+    def _start_table(self, y):
+        self.canvas.setFont(self.font, 10)
+        for x, header in zip(self.x_positions, self.headers):
+            self.canvas.drawRightString(x, y, header)
+        self.y = y - self.row_height
+
+    def write(self, df):
+        for row in zip(*[_format_column(df[col]) for col in df.columns]):
+            if self.y < self.margin:
+                self.canvas.showPage()
+                self._start_table(self.height - self.margin)
+            for x, value in zip(self.x_positions, row):
+                self.canvas.drawRightString(x, self.y, value)
+            self.y -= self.row_height
+
+    def close(self):
+        self.canvas.save()
+
+@timed('export.pdf_df')
 def export_to_pdf(df):
     buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    c.drawString(100, 750, "تقرير المحاسبة")
-    y = 700
-    # رسم العناوين
-    x_positions = [100, 200, 300, 400]
-    for i, col in enumerate(df.columns):
-        c.drawString(x_positions[i], y, col)
-    y -= 20
-    # رسم البيانات (بسيط، يمكن تحسينه)
-    for index, row in df.iterrows():
-        for i, value in enumerate(row):
-            c.drawString(x_positions[i], y, str(value))
-        y -= 20
-        if y < 50:
-            c.showPage()
-            y = 750
-    c.save()
+    writer = PdfReportWriter(buffer, df.columns)
+    writer.write(df)
+    writer.close()
     buffer.seek(0)
     return buffer
 
+@timed('export.pdf')
+def export_report_pdf(start_date, end_date, chunk_size=REPORT_CHUNK_SIZE, progress=None):
+    # تقرير كبير: الصفوف تُقرأ على دفعات وتُكتب مباشرة إلى ملف مؤقت (يُرجع مسار الملف، وحذفه مسؤولية المستدعي)
+    with _temp_path('.pdf') as path:
+        writer = PdfReportWriter(path, REPORT_COLUMNS)
+        for chunk in iter_report_chunks(start_date, end_date, chunk_size, progress):
+            writer.write(chunk)
+        writer.close()
+    return path
+
+def _sheet_rows(df):
+    # قيم بايثون جاهزة للكتابة (NaN/NaT -> خلية فارغة)
+    values = df.astype(object).where(df.notna(), None)
+    return values.itertuples(index=False, name=None)
+
+def _write_sheet(workbook, title, chunks, columns):
+    sheet = workbook.create_sheet(title)
+    sheet.sheet_view.rightToLeft = True
+    sheet.append(list(columns))
+    for chunk in chunks:
+        for row in _sheet_rows(chunk):
+            sheet.append(row)
+
+def _discard_workbook(workbook):
+    # مصنف write-only لم يُحفظ (فشل التصدير): إغلاق كتابة كل ورقة وحذف ملفها المؤقت
+    for sheet in workbook.worksheets:
+        with contextlib.suppress(Exception):
+            sheet.close()
+            sheet._writer.cleanup()
+    workbook.close()
+
+@timed('export.excel_df')
 def export_to_excel(df):
     buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False)
+    workbook = Workbook(write_only=True)
+    _write_sheet(workbook, 'Sheet1', [df], df.columns)
+    workbook.save(buffer)
     buffer.seek(0)
-    return buffer
\ No newline at end of file
+    return buffer
+
+@timed('export.excel')
+def export_report_excel(start_date, end_date, chunk_size=REPORT_CHUNK_SIZE, progress=None):
+    # مصنف Excel بوضع الكتابة فقط (write-only): الصفوف تُكتب مباشرة ولا يُحتفظ بها في الذاكرة
+    # الأوراق: الدفعات، ملخص حسب الطبيب، ملخص حسب العلاج (يُرجع مسار ملف مؤقت)
+    with _temp_path('.xlsx') as path:
+        workbook = Workbook(write_only=True)
+        try:
+            with read_snapshot() as session:  # الملخصات من نفس لقطة الصفوف
+                _write_sheet(workbook, 'الدفعات',
+                             iter_report_chunks(start_date, end_date, chunk_size, progress, session), REPORT_COLUMNS)
+                for group_by in ('doctor', 'treatment'):
+                    summary = aggregate_report(start_date, end_date, period=None, group_by=group_by, session=session)
+                    _write_sheet(workbook, f"حسب {GROUPINGS[group_by]}", [summary], summary.columns)
+            workbook.save(path)
+        except BaseException:
+            _discard_workbook(workbook)
+            raise
+    return path
+
+@timed('export.csv')
+def export_report_csv(start_date, end_date, chunk_size=REPORT_CHUNK_SIZE, progress=None):
+    # أخف صيغة: تُكتب على دفعات (utf-8-sig ليفتحها Excel بالعربية بشكل صحيح)
+    with _temp_path('.csv') as path, open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        f.write(','.join(REPORT_COLUMNS) + '\n')
+        for chunk in iter_report_chunks(start_date, end_date, chunk_size, progress):
+            chunk.to_csv(f, header=False, index=False)
+    return path
+
+@timed('export.parquet')
+def export_report_parquet(start_date, end_date, chunk_size=REPORT_CHUNK_SIZE, progress=None):
+    # صيغة عمودية مضغوطة للتحليل (تتطلب pyarrow)
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([(REPORT_COLUMNS[0], pa.int64()), (REPORT_COLUMNS[1], pa.float64()),
+                        (REPORT_COLUMNS[2], pa.float64()), (REPORT_COLUMNS[3], pa.float64()),
+                        (REPORT_COLUMNS[4], pa.timestamp('us'))])
+    with _temp_path('.parquet') as path, pq.ParquetWriter(path, schema) as writer:
+        for chunk in iter_report_chunks(start_date, end_date, chunk_size, progress):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    return path
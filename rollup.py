@@ -0,0 +1,85 @@
+# جدول التجميع اليومي للإيرادات (daily_revenue)
+# يُحدَّث داخل نفس المعاملة مع إضافة/تعديل/حذف الدفعات (ومعه دفتر مستحقات الأطباء - settlement.py)،
+# ويمكن إعادة بنائه بالكامل أو لفترة محددة:
+#   python rollup.py [من_تاريخ إلى_تاريخ]
+import datetime
+import sys
+from sqlalchemy import Date, cast, func, insert, literal
+from database import engine as default_engine, Session
+from models import Payment, Appointment, DailyRevenue
+import settlement
+
+KEY_COLUMNS = ['date', 'doctor_id', 'treatment_id', 'payment_method']
+MEASURE_COLUMNS = ['payments_count', 'total_amount', 'paid_amount', 'clinic_share', 'doctor_share', 'discounts', 'taxes']
+
+def day_of(column, dialect):
+    if dialect == 'sqlite':
+        return func.date(column)
+    return cast(column, Date)
+
+def _grouped_payments(session, criteria):
+    # الدفعات المطابقة مجمّعة حسب مفتاح الجدول (استعلام واحد)
+    day = day_of(Payment.date_paid, session.get_bind().dialect.name)
+    keys = [day,
+            func.coalesce(Appointment.doctor_id, 0),
+            func.coalesce(Appointment.treatment_id, 0),
+            func.coalesce(Payment.payment_method, literal(''))]
+    measures = [func.count(Payment.id)] + [
+        func.coalesce(func.sum(getattr(Payment, name)), 0) for name in MEASURE_COLUMNS[1:]]
+    query = session.query(*keys, *measures).outerjoin(Appointment, Payment.appointment_id == Appointment.id)
+    query = query.filter(Payment.date_paid.isnot(None), *criteria)
+    return query.group_by(*keys)
+
+def _upsert_statement(dialect):
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    table = DailyRevenue.__table__
+    stmt = dialect_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=KEY_COLUMNS,
+        set_={name: table.c[name] + stmt.excluded[name] for name in MEASURE_COLUMNS}
+    )
+
+def apply_payments(session, criteria, sign=1):
+    # يضيف (sign=1) أو يطرح (sign=-1) مساهمة الدفعات المطابقة لـ criteria في جدول التجميع.
+    # يُستدعى بـ -1 قبل التعديل/الحذف و بـ 1 بعد الإضافة/التعديل (بعد session.flush())
+    # يرفع settlement.PeriodClosed إذا كانت إحدى الدفعات في فترة مقفلة
+    settlement.apply_payments(session, criteria, sign)
+    query = _grouped_payments(session, criteria)
+    params = []
+    for row in query:
+        day = row[0] if isinstance(row[0], datetime.date) else datetime.date.fromisoformat(row[0])
+        values = dict(zip(KEY_COLUMNS, (day,) + tuple(row[1:4])))
+        values.update({name: sign * value for name, value in zip(MEASURE_COLUMNS, row[4:])})
+        params.append(values)
+    if not params:
+        return
+    session.execute(_upsert_statement(session.get_bind().dialect.name), params)
+    if sign < 0:
+        session.query(DailyRevenue).filter(DailyRevenue.payments_count <= 0).delete(synchronize_session=False)
+
+def rebuild_daily_revenue(start_date=None, end_date=None, engine=None):
+    # إعادة بناء الجدول (أو فترة منه) من جدول الدفعات - للبيانات المستوردة أو بعد أي تعديل خارجي
+    session = Session(bind=engine or default_engine)
+    payment_criteria = []
+    rollup_criteria = []
+    if start_date is not None:
+        payment_criteria.append(Payment.date_paid >= datetime.datetime.combine(start_date, datetime.time.min))
+        rollup_criteria.append(DailyRevenue.date >= start_date)
+    if end_date is not None:
+        payment_criteria.append(Payment.date_paid < datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min))
+        rollup_criteria.append(DailyRevenue.date <= end_date)
+    session.query(DailyRevenue).filter(*rollup_criteria).delete(synchronize_session=False)
+    query = _grouped_payments(session, payment_criteria)
+    session.execute(insert(DailyRevenue.__table__).from_select(KEY_COLUMNS + MEASURE_COLUMNS, query.statement))
+    session.commit()
+    session.close()
+
+if __name__ == '__main__':
+    from migrations import upgrade
+    upgrade()
+    dates = [datetime.date.fromisoformat(arg) for arg in sys.argv[1:3]]
+    rebuild_daily_revenue(*dates)
+    print("تمت إعادة بناء جدول الإيرادات اليومية")
@@ -0,0 +1,185 @@
+# جدولة المواعيد: مدة لكل موعد (افتراضياً حسب العلاج)، فحص التعارض عند الإضافة/التعديل،
+# والبحث عن أقرب الأوقات المتاحة لطبيب أو لكل الأطباء ضمن ساعات العمل.
+# مواعيد كل طبيب محفوظة في الذاكرة كمصفوفات مرتبة حسب وقت البداية (bisect):
+# فحص التعارض = بحث ثنائي + فحص المواعيد القليلة التي تبدأ قبل نهاية الفترة بأقل من أطول مدة.
+# الفهرس يُحمَّل لكل طبيب عند أول استخدام ويُحدَّث بعد commit في functions.py، وهو لاقتراح الأوقات المتاحة فقط:
+# فحص التعارض عند الحفظ (check_conflicts) استعلام على قاعدة البيانات داخل معاملة الكتابة نفسها،
+# لأن الفهرس لا يرى حجوزات العمليات الأخرى (أجهزة أخرى / خيوط Streamlit متزامنة)
+import bisect
+import datetime
+import heapq
+import threading
+from collections import namedtuple
+from itertools import islice
+from sqlalchemy import func, or_
+from database import Session
+from models import Appointment, Doctor, Treatment
+from cache import reference_cache
+
+DEFAULT_DURATION = 30  # دقيقة، إذا لم تُحدد مدة للعلاج
+WORKING_HOURS = (datetime.time(9, 0), datetime.time(17, 0))
+WORKING_DAYS = {5, 6, 0, 1, 2, 3}  # السبت - الخميس (datetime.weekday: الجمعة = 4)
+SLOT_STEP = 15  # دقيقة
+SEARCH_DAYS = 60  # أقصى عدد أيام للبحث عن وقت متاح
+CANCELLED_STATUSES = {'ملغى'}  # المواعيد الملغاة لا تحجز وقت الطبيب
+MAX_DURATION = datetime.timedelta(days=1)  # أطول موعد: حد البحث عن المواعيد المتقاطعة التي تبدأ قبل الموعد
+
+Slot = namedtuple('Slot', ['start', 'end', 'doctor_id'])
+
+class AppointmentConflict(ValueError):
+    def __init__(self, appointment_id, start, end):
+        super().__init__(f"الطبيب لديه موعد آخر (رقم {appointment_id}) من {start:%Y-%m-%d %H:%M} إلى {end:%H:%M}")
+        self.appointment_id = appointment_id
+        self.start = start
+        self.end = end
+
+def default_duration(treatment_id):
+    for treatment in reference_cache.get('treatments'):
+        if treatment.id == treatment_id:
+            return treatment.duration or DEFAULT_DURATION
+    return DEFAULT_DURATION
+
+def _blocks(status):
+    return status not in CANCELLED_STATUSES
+
+def check_conflicts(session, doctor_id, start, duration, ignore_id=None):
+    # يرفع AppointmentConflict إذا تقاطع [start, start + duration) مع موعد آخر للطبيب.
+    # يُستدعى بعد flush للموعد في نفس المعاملة (ignore_id = الموعد نفسه):
+    # SQLite: الـ flush يحجز قفل الكتابة، فلا يُحفظ موعد آخر بين الفحص و commit
+    # PostgreSQL: قفل صف الطبيب (FOR NO KEY UPDATE) يجعل حجوزات نفس الطبيب المتزامنة تنتظر commit ما قبلها
+    end = start + datetime.timedelta(minutes=duration)
+    session.query(Doctor.id).filter(Doctor.id == doctor_id).with_for_update(key_share=True).first()
+    minutes = func.coalesce(Appointment.duration, Treatment.duration, DEFAULT_DURATION)
+    query = session.query(Appointment.id, Appointment.date, minutes).outerjoin(
+        Treatment, Appointment.treatment_id == Treatment.id).filter(
+        Appointment.doctor_id == doctor_id, Appointment.date > start - MAX_DURATION, Appointment.date < end,
+        or_(Appointment.status.is_(None), Appointment.status.notin_(CANCELLED_STATUSES)))
+    if ignore_id is not None:
+        query = query.filter(Appointment.id != ignore_id)
+    for other_id, other_start, other_minutes in query.order_by(Appointment.date):
+        other_end = other_start + datetime.timedelta(minutes=other_minutes)
+        if other_end > start:
+            raise AppointmentConflict(other_id, other_start, other_end)
+
+class DoctorSchedule:
+    # مواعيد طبيب واحد: starts / ends / ids مرتبة حسب البداية
+    def __init__(self, rows=()):
+        rows = sorted(rows)
+        self.starts = [start for start, _, _ in rows]
+        self.ends = [end for _, end, _ in rows]
+        self.ids = [appointment_id for _, _, appointment_id in rows]
+        self.by_id = {appointment_id: start for start, _, appointment_id in rows}
+        self.max_duration = max((end - start for start, end, _ in rows), default=datetime.timedelta(0))
+
+    def add(self, appointment_id, start, end):
+        i = bisect.bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.ids.insert(i, appointment_id)
+        self.by_id[appointment_id] = start
+        self.max_duration = max(self.max_duration, end - start)
+
+    def remove(self, appointment_id):
+        start = self.by_id.pop(appointment_id, None)
+        if start is None:
+            return
+        i = bisect.bisect_left(self.starts, start)
+        while self.ids[i] != appointment_id:
+            i += 1
+        del self.starts[i], self.ends[i], self.ids[i]
+
+    def overlapping(self, start, end, ignore_id=None):
+        # المواعيد التي تتقاطع مع [start, end) مرتبة حسب البداية
+        # (أي موعد متقاطع يبدأ بعد start - أطول مدة وقبل end)
+        lo = bisect.bisect_right(self.starts, start - self.max_duration)
+        hi = bisect.bisect_left(self.starts, end)
+        return [(self.starts[i], self.ends[i], self.ids[i]) for i in range(lo, hi)
+                if self.ends[i] > start and self.ids[i] != ignore_id]
+
+class Scheduler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._schedules = {}
+        self._generation = 0
+
+    def _load(self, doctor_id):
+        session = Session()
+        try:
+            minutes = func.coalesce(Appointment.duration, Treatment.duration, DEFAULT_DURATION)
+            rows = session.query(Appointment.id, Appointment.date, minutes, Appointment.status).outerjoin(
+                Treatment, Appointment.treatment_id == Treatment.id).filter(
+                Appointment.doctor_id == doctor_id, Appointment.date.isnot(None))
+            return DoctorSchedule((start, start + datetime.timedelta(minutes=duration), appointment_id)
+                                  for appointment_id, start, duration, status in rows if _blocks(status))
+        finally:
+            session.close()
+
+    def _schedule(self, doctor_id):
+        with self._lock:
+            schedule = self._schedules.get(doctor_id)
+            generation = self._generation
+        if schedule is not None:
+            return schedule
+        schedule = self._load(doctor_id)
+        with self._lock:
+            # لا نخزّن الفهرس إذا حدث invalidate أثناء التحميل
+            if self._generation == generation:
+                schedule = self._schedules.setdefault(doctor_id, schedule)
+        return schedule
+
+    def add(self, doctor_id, appointment_id, start, duration, status=None):
+        with self._lock:
+            schedule = self._schedules.get(doctor_id)
+            if schedule is not None and start is not None and _blocks(status):
+                schedule.add(appointment_id, start, start + datetime.timedelta(minutes=duration))
+
+    def remove(self, doctor_id, appointment_id):
+        with self._lock:
+            schedule = self._schedules.get(doctor_id)
+            if schedule is not None:
+                schedule.remove(appointment_id)
+
+    def invalidate(self, doctor_id=None):
+        with self._lock:
+            if doctor_id is None:
+                self._schedules.clear()
+            else:
+                self._schedules.pop(doctor_id, None)
+            self._generation += 1
+
+    def _doctor_slots(self, doctor_id, duration, after, days):
+        # الأوقات المتاحة لطبيب واحد بالترتيب (مولِّد كسول)
+        schedule = self._schedule(doctor_id)
+        length = datetime.timedelta(minutes=duration)
+        step = datetime.timedelta(minutes=SLOT_STEP)
+        for day in range(days):
+            date = after.date() + datetime.timedelta(days=day)
+            if date.weekday() not in WORKING_DAYS:
+                continue
+            opening = datetime.datetime.combine(date, WORKING_HOURS[0])
+            closing = datetime.datetime.combine(date, WORKING_HOURS[1])
+            cursor = opening
+            if after > opening:
+                cursor = opening + -((opening - after) // step) * step  # أول بداية بعد after على حدود SLOT_STEP
+            with self._lock:
+                busy = schedule.overlapping(cursor, closing)
+            for busy_start, busy_end, _ in busy + [(closing, closing, None)]:
+                while cursor + length <= busy_start:
+                    yield Slot(cursor, cursor + length, doctor_id)
+                    cursor += step
+                if busy_end > cursor:
+                    cursor = opening + -((opening - busy_end) // step) * step
+
+    def find_free_slots(self, duration, after=None, doctor_ids=None, limit=10, days=SEARCH_DAYS):
+        # أقرب `limit` أوقات متاحة لكل الأطباء (أو doctor_ids) مرتبة حسب الوقت
+        after = after or datetime.datetime.now()
+        if doctor_ids is None:
+            doctor_ids = [doctor.id for doctor in reference_cache.get('doctors')]
+        slots = heapq.merge(*[self._doctor_slots(doctor_id, duration, after, days) for doctor_id in doctor_ids])
+        return list(islice(slots, limit))
+
+    def next_free_slot(self, doctor_id, duration, after=None):
+        slots = self.find_free_slots(duration, after, [doctor_id], limit=1)
+        return slots[0] if slots else None
+
+scheduler = Scheduler()
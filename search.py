@@ -0,0 +1,122 @@
+# فهرس البحث النصي (SQLite FTS5) للمرضى والأطباء وملاحظات المواعيد
+# النصوص تُخزَّن في الفهرس بعد توحيد الحروف العربية، ونفس التوحيد يُطبَّق على نص البحث
+import re
+from sqlalchemy import column, text
+from sqlalchemy.exc import DBAPIError
+
+FTS_TABLES = {
+    'patients_fts': ('patients', ['name', 'phone', 'address', 'medical_history']),
+    'doctors_fts': ('doctors', ['name', 'specialty', 'email']),
+    'appointments_fts': ('appointments', ['notes']),
+}
+
+_TASHKEEL = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')  # التشكيل والتطويل
+_ARABIC_FOLD = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي',
+    'ة': 'ه',
+})
+_TOKEN = re.compile(r'\w+')
+
+def normalize(value):
+    if value is None:
+        return ''
+    return _TASHKEEL.sub('', str(value)).translate(_ARABIC_FOLD).lower()
+
+def fts_available(bind):
+    return bind.dialect.name == 'sqlite'
+
+# على PostgreSQL لا يوجد FTS5: البحث بـ ILIKE (functions._search_filter) تسرّعه فهارس trigram (pg_trgm)
+TRIGRAM_COLUMNS = {
+    'patients': ['name', 'phone', 'address', 'medical_history'],
+    'doctors': ['name', 'specialty', 'email'],
+    'treatments': ['name'],
+    'appointments': ['notes'],
+}
+
+def create_trigram_indexes(conn):
+    # يُرجع False إذا تعذر تفعيل pg_trgm (صلاحيات المستخدم)؛ البحث يعمل بدونها لكن بمرور كامل على الجدول
+    try:
+        with conn.begin_nested():
+            conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    except DBAPIError:
+        return False
+    for table, columns in TRIGRAM_COLUMNS.items():
+        for name in columns:
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{table}_{name}_trgm ON {table} '
+                              f'USING gin ({name} gin_trgm_ops)'))
+    return True
+
+def create_search_tables(conn):
+    # يُرجع True إذا أُنشئت جداول جديدة (تحتاج إلى تعبئة أولية)
+    existing = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type='table'"))}
+    created = False
+    for fts_table, (_, columns) in FTS_TABLES.items():
+        if fts_table in existing:
+            continue
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE {fts_table} USING fts5({', '.join(columns)}, "
+            f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        ))
+        created = True
+    return created
+
+def rebuild_search_index(conn):
+    for fts_table, (table, columns) in FTS_TABLES.items():
+        conn.execute(text(f"DELETE FROM {fts_table}"))
+        rows = conn.execute(text(f"SELECT id, {', '.join(columns)} FROM {table}"))
+        while True:
+            chunk = rows.fetchmany(1000)
+            if not chunk:
+                break
+            index_rows(conn, fts_table, chunk)
+
+def index_rows(conn, fts_table, rows):
+    # إضافة صفوف جديدة للفهرس دفعة واحدة؛ كل صف = (id, قيم الأعمدة بترتيب FTS_TABLES)
+    columns = FTS_TABLES[fts_table][1]
+    if not rows:
+        return
+    conn.execute(
+        text(f"INSERT INTO {fts_table} (rowid, {', '.join(columns)}) "
+             f"VALUES (:id, {', '.join(':' + c for c in columns)})"),
+        [dict({'id': row[0]}, **{c: normalize(v) for c, v in zip(columns, row[1:])}) for row in rows]
+    )
+
+def _index_row(session, fts_table, row_id, values):
+    if not fts_available(session.get_bind()):
+        return
+    columns = FTS_TABLES[fts_table][1]
+    session.execute(text(f"DELETE FROM {fts_table} WHERE rowid = :id"), {'id': row_id})
+    if values is not None:
+        params = {c: normalize(values.get(c)) for c in columns}
+        params['id'] = row_id
+        session.execute(
+            text(f"INSERT INTO {fts_table} (rowid, {', '.join(columns)}) "
+                 f"VALUES (:id, {', '.join(':' + c for c in columns)})"),
+            params
+        )
+
+# تُستدعى داخل نفس الجلسة (session) قبل commit حتى يبقى الفهرس متزامناً مع البيانات
+def index_patient(session, patient):
+    _index_row(session, 'patients_fts', patient.id, vars(patient))
+
+def index_doctor(session, doctor):
+    _index_row(session, 'doctors_fts', doctor.id, vars(doctor))
+
+def index_appointment(session, appointment):
+    _index_row(session, 'appointments_fts', appointment.id, vars(appointment))
+
+def unindex(session, fts_table, row_id):
+    _index_row(session, fts_table, row_id, None)
+
+def match_query(search):
+    # كل كلمة تُطابق كبادئة: "محم"* يطابق "محمد"
+    tokens = _TOKEN.findall(normalize(search))
+    if not tokens:
+        return None
+    return ' '.join(f'"{t}"*' for t in tokens)
+
+def match_ids(fts_table, search):
+    # استعلام فرعي يُرجع معرفات الصفوف المطابقة (يُستخدم مع column.in_(...))
+    return text(f"SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH :q").bindparams(
+        q=match_query(search)).columns(column('rowid'))
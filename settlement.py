@@ -0,0 +1,206 @@
+# مستحقات الأطباء: دفتر شهري لكل طبيب (doctor_ledger) بالمستحق (doctor_share) والمصروف (doctor_payouts)
+# والرصيد الجاري في نهاية كل شهر. يُحدَّث داخل نفس المعاملة مع الدفعات (rollup.apply_payments) والصرف،
+# لذلك كشف حساب أي طبيب عن أي شهر = قراءة صف واحد عبر الفهرس (الطبيب، الشهر).
+# إقفال الفترة (close_period) يجمّد أرصدة كل الأطباء حتى نهاية شهر في settlement_periods،
+# وبعده لا يمكن تعديل الدفعات أو الصرف في الأشهر المقفلة (PeriodClosed)
+#   python settlement.py rebuild        إعادة بناء الدفتر من الدفعات والصرف
+#   python settlement.py close 2025-11  إقفال حتى نهاية الشهر
+import datetime
+import sys
+from collections import defaultdict
+from sqlalchemy import Date, cast, func, insert, select, update
+from database import engine as default_engine, Session, unit_of_work
+from models import Payment, Appointment, DoctorPayout, DoctorLedger, SettlementPeriod
+
+MEASURE_COLUMNS = ['payments_count', 'earned', 'payouts_count', 'paid_out']
+
+class PeriodClosed(ValueError):
+    def __init__(self, month, closed_until):
+        super().__init__(f"الفترة مقفلة: لا يمكن تعديل بيانات {month:%Y-%m} (الإقفال حتى {closed_until:%Y-%m})")
+        self.month = month
+        self.closed_until = closed_until
+
+def month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+def next_month(month):
+    return datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def month_of(column, dialect):
+    if dialect == 'sqlite':
+        return func.date(column, 'start of month')
+    return cast(func.date_trunc('month', column), Date)
+
+def _as_date(value):
+    return value if isinstance(value, datetime.date) else datetime.date.fromisoformat(value)
+
+def closed_until(session):
+    # آخر شهر مقفل (أول يوم فيه) أو None
+    return session.query(func.max(SettlementPeriod.period_end)).scalar()
+
+def _payment_deltas(session, criteria, sign=1):
+    # مساهمة الدفعات المطابقة لكل (طبيب، شهر) باستعلام واحد
+    month = month_of(Payment.date_paid, session.get_bind().dialect.name)
+    query = session.query(Appointment.doctor_id, month, func.count(Payment.id),
+                          func.coalesce(func.sum(Payment.doctor_share), 0)).join(
+        Appointment, Payment.appointment_id == Appointment.id)
+    query = query.filter(Payment.date_paid.isnot(None), Appointment.doctor_id.isnot(None), *criteria)
+    return {(doctor_id, _as_date(m)): {'payments_count': sign * count, 'earned': sign * earned}
+            for doctor_id, m, count, earned in query.group_by(Appointment.doctor_id, month)}
+
+def _payout_deltas(session, criteria, sign=1):
+    month = month_of(DoctorPayout.date_paid, session.get_bind().dialect.name)
+    query = session.query(DoctorPayout.doctor_id, month, func.count(DoctorPayout.id),
+                          func.coalesce(func.sum(DoctorPayout.amount), 0)).filter(*criteria)
+    return {(doctor_id, _as_date(m)): {'payouts_count': sign * count, 'paid_out': sign * amount}
+            for doctor_id, m, count, amount in query.group_by(DoctorPayout.doctor_id, month)}
+
+def _insert_missing(dialect):
+    # صف (الطبيب، الشهر) إن لم يكن موجوداً: أول دفعتين متزامنتين لنفس الشهر لا تتعارضان على الفهرس الفريد
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    return dialect_insert(DoctorLedger.__table__).on_conflict_do_nothing(index_elements=['doctor_id', 'month'])
+
+def apply_deltas(session, deltas):
+    # deltas: (الطبيب، الشهر) -> تغير المقاييس. الرصيد يتغير لهذا الشهر ولكل الأشهر التالية للطبيب
+    # (عادة لا يوجد أشهر تالية إلا عند تعديل دفعة قديمة)
+    if not deltas:
+        return
+    closed = closed_until(session)
+    table = DoctorLedger.__table__
+    for (doctor_id, month), delta in sorted(deltas.items()):
+        if closed is not None and month <= closed:
+            raise PeriodClosed(month, closed)
+        key = (table.c.doctor_id == doctor_id)
+        exists = session.execute(select(table.c.id).where(key, table.c.month == month)).scalar()
+        if exists is None:
+            previous = session.execute(select(table.c.balance).where(key, table.c.month < month).order_by(
+                table.c.month.desc()).limit(1)).scalar()
+            session.execute(_insert_missing(session.get_bind().dialect.name).values(
+                doctor_id=doctor_id, month=month, balance=previous or 0, **{name: 0 for name in MEASURE_COLUMNS}))
+        session.execute(update(table).where(key, table.c.month == month).values(
+            {name: table.c[name] + value for name, value in delta.items()}))
+        change = delta.get('earned', 0) - delta.get('paid_out', 0)
+        if change:
+            session.execute(update(table).where(key, table.c.month >= month).values(balance=table.c.balance + change))
+
+def apply_payments(session, criteria, sign=1):
+    # يُستدعى من rollup.apply_payments بنفس المعايير والإشارة
+    apply_deltas(session, _payment_deltas(session, criteria, sign))
+
+def apply_payouts(session, criteria, sign=1):
+    apply_deltas(session, _payout_deltas(session, criteria, sign))
+
+def open_from(session):
+    # أول لحظة يمكن تعديلها (بداية الشهر التالي لآخر إقفال) أو None
+    closed = closed_until(session)
+    return None if closed is None else datetime.datetime.combine(next_month(closed), datetime.time.min)
+
+def check_open(session, criteria):
+    # رفض مبكر قبل أي تعديل (مثل نقل موعد إلى طبيب آخر) إذا كانت إحدى الدفعات المطابقة في شهر مقفل
+    start = open_from(session)
+    if start is None:
+        return
+    earliest = session.query(func.min(Payment.date_paid)).filter(Payment.date_paid < start, *criteria).scalar()
+    if earliest is not None:
+        raise PeriodClosed(month_start(earliest), closed_until(session))
+
+def rebuild_doctor_ledger(engine=None):
+    # إعادة بناء الدفتر بالكامل من جدولي الدفعات والصرف (للبيانات المستوردة أو بعد أي تعديل خارجي)
+    session = Session(bind=engine or default_engine)
+    try:
+        months = defaultdict(lambda: dict.fromkeys(MEASURE_COLUMNS, 0))
+        for deltas in (_payment_deltas(session, []), _payout_deltas(session, [])):
+            for key, delta in deltas.items():
+                months[key].update(delta)
+        rows = []
+        balances = defaultdict(float)
+        for (doctor_id, month), values in sorted(months.items()):
+            balances[doctor_id] += values['earned'] - values['paid_out']
+            rows.append(dict(values, doctor_id=doctor_id, month=month, balance=balances[doctor_id]))
+        session.query(DoctorLedger).delete(synchronize_session=False)
+        if rows:
+            session.execute(insert(DoctorLedger.__table__), rows)
+        session.commit()
+    finally:
+        session.close()
+
+def close_period(month, today=None):
+    # إقفال كل الأطباء حتى نهاية الشهر month؛ يُرجع عدد الأطباء.
+    # الشهر الحالي والأشهر التالية لا تُقفل (وإلا رُفضت كل دفعة أو صرف بتاريخ اليوم ولا يمكن التراجع)
+    month = month_start(month)
+    current = month_start(today or datetime.date.today())
+    if month >= current:
+        raise ValueError(f"لا يمكن إقفال {month:%Y-%m}: الإقفال فقط للأشهر المنتهية (قبل {current:%Y-%m})")
+    with unit_of_work() as session:
+        closed = closed_until(session)
+        if closed is not None and month <= closed:
+            raise PeriodClosed(month, closed)
+        start = next_month(closed) if closed is not None else None
+        criteria = [DoctorLedger.month <= month]
+        if start is not None:
+            criteria.append(DoctorLedger.month >= start)
+        totals = {doctor_id: (first, earned, paid_out) for doctor_id, first, earned, paid_out in session.query(
+            DoctorLedger.doctor_id, func.min(DoctorLedger.month), func.sum(DoctorLedger.earned),
+            func.sum(DoctorLedger.paid_out)).filter(*criteria).group_by(DoctorLedger.doctor_id)}
+        # الرصيد في نهاية الشهر = رصيد آخر صف حتى month لكل طبيب (حتى بدون حركة في الفترة)
+        last = session.query(DoctorLedger.doctor_id, func.max(DoctorLedger.month).label('month')).filter(
+            DoctorLedger.month <= month).group_by(DoctorLedger.doctor_id).subquery()
+        balances = session.query(DoctorLedger.doctor_id, DoctorLedger.balance).join(
+            last, (DoctorLedger.doctor_id == last.c.doctor_id) & (DoctorLedger.month == last.c.month))
+        now = datetime.datetime.now()
+        rows = []
+        for doctor_id, balance in balances:
+            first, earned, paid_out = totals.get(doctor_id, (None, 0, 0))
+            rows.append({'doctor_id': doctor_id, 'period_start': start or (first and _as_date(first)),
+                         'period_end': month, 'opening_balance': balance - earned + paid_out, 'earned': earned,
+                         'paid_out': paid_out, 'closing_balance': balance, 'closed_at': now})
+        if rows:
+            session.execute(insert(SettlementPeriod.__table__), rows)
+        return len(rows)
+
+def doctor_statement(doctor_id, month):
+    # كشف حساب شهر واحد: صف الشهر (أو آخر صف قبله إذا لم تكن هناك حركة) عبر الفهرس (الطبيب، الشهر)
+    month = month_start(month)
+    with unit_of_work() as session:
+        row = session.query(DoctorLedger).filter(DoctorLedger.doctor_id == doctor_id,
+                                                 DoctorLedger.month <= month).order_by(
+            DoctorLedger.month.desc()).first()
+        closed = closed_until(session)
+        statement = {'doctor_id': doctor_id, 'month': month, 'payments_count': 0, 'earned': 0.0,
+                     'payouts_count': 0, 'paid_out': 0.0, 'opening_balance': 0.0, 'closing_balance': 0.0,
+                     'closed': closed is not None and month <= closed}
+        if row is None:
+            return statement
+        statement['opening_balance'] = statement['closing_balance'] = row.balance
+        if row.month == month:
+            statement.update({name: getattr(row, name) for name in MEASURE_COLUMNS})
+            statement['opening_balance'] = row.balance - row.earned + row.paid_out
+        return statement
+
+def doctor_balances():
+    # الرصيد الحالي لكل طبيب = رصيد آخر شهر في الدفتر
+    with unit_of_work() as session:
+        last = session.query(DoctorLedger.doctor_id, func.max(DoctorLedger.month).label('month')).group_by(
+            DoctorLedger.doctor_id).subquery()
+        return dict(session.query(DoctorLedger.doctor_id, DoctorLedger.balance).join(
+            last, (DoctorLedger.doctor_id == last.c.doctor_id) & (DoctorLedger.month == last.c.month)).all())
+
+def get_settlement_periods(doctor_id=None):
+    with unit_of_work() as session:
+        query = session.query(SettlementPeriod)
+        if doctor_id is not None:
+            query = query.filter(SettlementPeriod.doctor_id == doctor_id)
+        return query.order_by(SettlementPeriod.period_end.desc(), SettlementPeriod.doctor_id).all()
+
+if __name__ == '__main__':
+    from migrations import upgrade
+    upgrade()
+    if len(sys.argv) > 2 and sys.argv[1] == 'close':
+        count = close_period(datetime.date.fromisoformat(sys.argv[2] + '-01'))
+        print(f"تم إقفال الفترة حتى {sys.argv[2]} لعدد {count} طبيب")
+    else:
+        rebuild_doctor_ledger()
+        print("تمت إعادة بناء دفتر مستحقات الأطباء")
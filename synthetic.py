@@ -0,0 +1,147 @@
+# توليد بيانات تجريبية (بذرة ثابتة = نفس البيانات في كل مرة) لقياس الأداء على أحجام مختلفة
+#   python synthetic.py ملف.db [small|medium|large] [البذرة]
+# التوزيعات: مرضى متكررون أكثر من غيرهم، مواعيد في أيام وساعات العمل فقط، أغلبها مؤكد،
+# دفعات لمعظم المواعيد المؤكدة مع خصومات أحياناً ودفع جزئي أحياناً
+import datetime
+import sys
+import numpy as np
+from sqlalchemy import insert
+from database import make_engine
+from models import Patient, Doctor, Treatment, TreatmentPercentage, Appointment, Payment
+from migrations import upgrade, reset_sequences
+from commission import CommissionMatrix
+from rollup import rebuild_daily_revenue
+from settlement import rebuild_doctor_ledger
+from search import fts_available, rebuild_search_index
+from scheduling import WORKING_DAYS, WORKING_HOURS
+
+SIZES = {
+    'small': {'patients': 2000, 'doctors': 5, 'years': 1, 'per_doctor_daily': 6},
+    'medium': {'patients': 20000, 'doctors': 15, 'years': 3, 'per_doctor_daily': 6},
+    'large': {'patients': 100000, 'doctors': 40, 'years': 5, 'per_doctor_daily': 6},
+}
+
+FIRST_NAMES = ['محمد', 'أحمد', 'محمود', 'علي', 'عمر', 'خالد', 'يوسف', 'مصطفى', 'حسن', 'إبراهيم',
+               'فاطمة', 'مريم', 'نور', 'سارة', 'هدى', 'منى', 'آية', 'ياسمين', 'رنا', 'دينا']
+LAST_NAMES = ['عبد الله', 'السيد', 'حسين', 'إبراهيم', 'الشريف', 'المصري', 'النجار', 'سالم', 'فؤاد', 'رمضان',
+              'عثمان', 'الخطيب', 'منصور', 'حمدي', 'زكي']
+SPECIALTIES = ['تقويم', 'جراحة', 'علاج جذور', 'تركيبات', 'أسنان أطفال', 'لثة']
+TREATMENTS = [  # (الاسم، التكلفة، المدة بالدقائق، الوزن النسبي)
+    ('كشف', 150, 30, 30), ('تنظيف', 300, 30, 20), ('حشو', 400, 30, 20), ('علاج عصب', 1500, 60, 8),
+    ('خلع', 350, 30, 10), ('خلع ضرس عقل', 1200, 60, 3), ('تاج', 2500, 60, 4), ('تبييض', 2000, 60, 2),
+    ('زراعة', 9000, 60, 1), ('تقويم (جلسة)', 800, 30, 2),
+]
+STATUSES = (['مؤكد', 'ملغى', 'قيد الانتظار'], [0.85, 0.10, 0.05])
+PAYMENT_METHODS = (['نقدي', 'بطاقة', 'تحويل'], [0.6, 0.3, 0.1])
+CHUNK = 20000
+
+def _insert(conn, table, rows):
+    for start in range(0, len(rows), CHUNK):
+        conn.execute(insert(table), rows[start:start + CHUNK])
+
+def _names(rng, count, genders=None):
+    # الأسماء العشرة الأولى للذكور والباقي للإناث
+    female = np.zeros(count, dtype=bool) if genders is None else genders == 'أنثى'
+    first = np.array(FIRST_NAMES)[rng.integers(0, 10, count) + 10 * female]
+    middle = rng.choice(FIRST_NAMES[:10], count)
+    last = rng.choice(LAST_NAMES, count)
+    return [f"{a} {b} {c}" for a, b, c in zip(first, middle, last)]
+
+def generate(url, size='small', seed=42, end_date=None):
+    # يملأ قاعدة بيانات فارغة ويُرجع ملخصاً بعدد الصفوف
+    config = SIZES[size]
+    rng = np.random.default_rng(seed)
+    end_date = end_date or datetime.date(2025, 12, 31)  # ثابت حتى تكون البيانات متطابقة بين التشغيلات
+    engine = make_engine(url)
+    upgrade(engine)
+
+    patients = config['patients']
+    doctors = config['doctors']
+    genders = rng.choice(['ذكر', 'أنثى'], patients)
+    patient_rows = [{'id': i + 1, 'name': name, 'age': int(age), 'gender': gender,
+                     'phone': f"01{rng.integers(0, 3)}{rng.integers(10000000, 99999999)}",
+                     'address': f"شارع {rng.integers(1, 200)}، {rng.choice(['القاهرة', 'الجيزة', 'الإسكندرية', 'طنطا'])}",
+                     'medical_history': rng.choice(['', '', '', 'سكري', 'ضغط', 'حساسية بنسلين'])}
+                    for i, (name, age, gender) in enumerate(zip(
+                        _names(rng, patients, genders), np.clip(rng.normal(38, 16, patients), 4, 90), genders))]
+    doctor_rows = [{'id': i + 1, 'name': 'د. ' + name, 'specialty': SPECIALTIES[i % len(SPECIALTIES)],
+                    'phone': f"010{rng.integers(10000000, 99999999)}", 'email': f"doctor{i + 1}@cura.example"}
+                   for i, name in enumerate(_names(rng, doctors))]
+    treatment_rows = [{'id': i + 1, 'name': name, 'base_cost': cost, 'duration': duration}
+                      for i, (name, cost, duration, _) in enumerate(TREATMENTS)]
+    # نسب مخصصة لنصف أزواج (العلاج، الطبيب) تقريباً، والباقي بالنسبة الافتراضية
+    percentages = {}
+    for t in range(1, len(TREATMENTS) + 1):
+        for d in range(1, doctors + 1):
+            if rng.random() < 0.5:
+                clinic = float(rng.choice([40, 50, 60, 70]))
+                percentages[(t, d)] = (clinic, 100 - clinic)
+    percentage_rows = [{'treatment_id': t, 'doctor_id': d, 'clinic_percentage': c, 'doctor_percentage': p}
+                       for (t, d), (c, p) in percentages.items()]
+
+    # المواعيد: عدد يومي لكل طبيب (Poisson) في أوقات مختلفة على فترات 30 دقيقة داخل ساعات العمل
+    opening = datetime.datetime.combine(end_date, WORKING_HOURS[0]) - datetime.datetime.combine(end_date, datetime.time.min)
+    slots = int((datetime.datetime.combine(end_date, WORKING_HOURS[1]) -
+                 datetime.datetime.combine(end_date, WORKING_HOURS[0])).total_seconds() // 1800)
+    treatment_weights = np.array([w for *_, w in TREATMENTS], dtype=float)
+    treatment_weights /= treatment_weights.sum()
+    patient_weights = rng.pareto(1.5, patients) + 1  # بعض المرضى يترددون أكثر بكثير من غيرهم
+    patient_weights /= patient_weights.sum()
+    starts = []
+    doctor_ids = []
+    day = end_date - datetime.timedelta(days=365 * config['years'])
+    while day <= end_date:
+        if day.weekday() in WORKING_DAYS:
+            midnight = datetime.datetime.combine(day, datetime.time.min)
+            for doctor_id in range(1, doctors + 1):
+                count = min(int(rng.poisson(config['per_doctor_daily'])), slots)
+                for slot in rng.choice(slots, count, replace=False):
+                    starts.append(midnight + opening + datetime.timedelta(minutes=30 * int(slot)))
+                    doctor_ids.append(doctor_id)
+        day += datetime.timedelta(days=1)
+    count = len(starts)
+    treatment_ids = rng.choice(len(TREATMENTS), count, p=treatment_weights) + 1
+    patient_ids = rng.choice(patients, count, p=patient_weights) + 1
+    statuses = rng.choice(STATUSES[0], count, p=STATUSES[1])
+    notes = rng.choice(['', '', '', 'متابعة', 'ألم شديد', 'أول زيارة', 'يحتاج أشعة'], count)
+    appointment_rows = [{'id': i + 1, 'patient_id': int(p), 'doctor_id': d, 'treatment_id': int(t), 'date': start,
+                         'duration': TREATMENTS[t - 1][2], 'status': str(s), 'notes': str(n)}
+                        for i, (p, d, t, start, s, n) in enumerate(zip(
+                            patient_ids, doctor_ids, treatment_ids, starts, statuses, notes))]
+
+    # الدفعات: 90% من المواعيد المؤكدة، المبلغ حول تكلفة العلاج، خصم لـ 20%، دفع جزئي لـ 10%
+    confirmed = np.flatnonzero((statuses == 'مؤكد') & (rng.random(count) < 0.9))
+    base = np.array([TREATMENTS[t - 1][1] for t in treatment_ids[confirmed]], dtype=float)
+    totals = np.round(base * rng.uniform(0.8, 1.5, len(confirmed)), -1)
+    discounts = np.where(rng.random(len(confirmed)) < 0.2, np.round(totals * rng.uniform(0.05, 0.15, len(confirmed))), 0.0)
+    paid = np.where(rng.random(len(confirmed)) < 0.1, np.round(totals * 0.5), totals - discounts)
+    clinic_shares, doctor_shares = CommissionMatrix(percentages).shares(
+        treatment_ids[confirmed], [doctor_ids[i] for i in confirmed], totals, discounts)
+    delays = rng.choice([0, 0, 0, 1, 7], len(confirmed))
+    methods = rng.choice(PAYMENT_METHODS[0], len(confirmed), p=PAYMENT_METHODS[1])
+    payment_rows = [{'appointment_id': int(i) + 1, 'total_amount': float(total), 'paid_amount': float(p),
+                     'clinic_share': float(c), 'doctor_share': float(ds), 'payment_method': str(m),
+                     'discounts': float(disc), 'taxes': 0.0,
+                     'date_paid': starts[i] + datetime.timedelta(days=int(delay), minutes=30)}
+                    for i, total, p, c, ds, m, disc, delay in zip(
+                        confirmed, totals, paid, clinic_shares, doctor_shares, methods, discounts, delays)]
+
+    with engine.begin() as conn:
+        for model, rows in ((Patient, patient_rows), (Doctor, doctor_rows), (Treatment, treatment_rows),
+                            (TreatmentPercentage, percentage_rows), (Appointment, appointment_rows),
+                            (Payment, payment_rows)):
+            _insert(conn, model.__table__, rows)
+        reset_sequences(conn)
+        if fts_available(conn):
+            rebuild_search_index(conn)
+    rebuild_daily_revenue(engine=engine)
+    rebuild_doctor_ledger(engine=engine)
+    engine.dispose()
+    return {'patients': patients, 'doctors': doctors, 'treatments': len(TREATMENTS),
+            'appointments': count, 'payments': len(payment_rows), 'end_date': end_date.isoformat()}
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'synthetic.db'
+    size = sys.argv[2] if len(sys.argv) > 2 else 'small'
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 42
+    print(generate(f"sqlite:///{path}", size, seed))
@@ -0,0 +1,73 @@
+# الاختبارات تعمل على SQLite (ملف مؤقت) وعلى PostgreSQL إذا حُدد CURA_TEST_PG_URL:
+#   CURA_TEST_PG_URL=postgresql://user@localhost/cura_test python -m pytest
+# قاعدة PostgreSQL مخصصة للاختبار: تُحذف جداولها وتُنشأ من جديد لكل اختبار
+import datetime
+import os
+import tempfile
+
+os.environ['CURA_DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='cura-test-'), 'unused.db')
+os.environ.setdefault('CURA_IMAGE_DIR', tempfile.mkdtemp(prefix='cura-test-images-'))
+
+import pytest
+from sqlalchemy import event
+import database
+import migrations
+from database import Base, Session, make_engine
+from cache import reference_cache
+from scheduling import scheduler
+from instrumentation import diagnostics
+
+PG_URL = os.environ.get('CURA_TEST_PG_URL')
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def db(request, tmp_path, monkeypatch):
+    # محرك قاعدة بيانات فارغة مرقّاة؛ كل الوحدات (Session و read_snapshot) تستخدمه أثناء الاختبار
+    if request.param == 'postgresql':
+        if not PG_URL:
+            pytest.skip("CURA_TEST_PG_URL غير محدد")
+        engine = make_engine(PG_URL)
+        Base.metadata.drop_all(engine)
+    else:
+        engine = make_engine(f"sqlite:///{tmp_path / 'cura.db'}")
+    monkeypatch.setattr(database, 'engine', engine)
+    previous = Session.kw['bind']
+    Session.configure(bind=engine)
+    migrations.upgrade(engine, force=True)
+    reference_cache.invalidate()
+    scheduler.invalidate()
+    diagnostics.reset()  # خطط التنفيذ المحفوظة تخص قاعدة بيانات الاختبار السابق
+    yield engine
+    reference_cache.invalidate()
+    scheduler.invalidate()
+    Session.configure(bind=previous)
+    engine.dispose()
+
+@pytest.fixture
+def clinic(db):
+    # طبيبان، علاجان، ثلاثة مرضى ومواعيدهم مع دفعة لكل موعد
+    from functions import add_doctor, add_treatment, add_patient, add_appointment, add_payment
+    add_doctor('د. سامي', 'تقويم', '0100', 'sami@cura.example')
+    add_doctor('د. منى', 'جراحة', '0101', 'mona@cura.example')
+    add_treatment('حشو', 300.0, 30)
+    add_treatment('خلع', 500.0, 45)
+    for name in ('أحمد علي', 'سارة محمود', 'خالد حسن'):
+        add_patient(name, 30, 'ذكر', '0111', 'القاهرة', '', None)
+    day = datetime.datetime(2025, 3, 3, 9, 0)
+    for i in range(6):
+        add_appointment(i % 3 + 1, i % 2 + 1, i % 2 + 1, day + datetime.timedelta(hours=i), 'مؤكد', f'زيارة {i}')
+    for appointment_id in range(1, 7):
+        add_payment(appointment_id, 100.0 * appointment_id, 100.0 * appointment_id, 'نقدي', 0, 0)
+    return db
+
+@pytest.fixture
+def strict_plans(db):
+    # PostgreSQL يختار المرور الكامل على الجداول الصغيرة حتى مع وجود فهرس مناسب؛ بتعطيله يُظهر EXPLAIN
+    # المرور الكامل فقط إذا لم يوجد فهرس يخدم الاستعلام (كما في SQLite)
+    if db.dialect.name == 'postgresql':
+        def _disable_seqscan(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('SET enable_seqscan = off')
+            cursor.close()
+        event.listen(db, 'connect', _disable_seqscan)
+        db.dispose()
+    return db
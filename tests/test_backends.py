@@ -0,0 +1,92 @@
+import datetime
+from sqlalchemy import func, insert
+from database import Session, read_snapshot
+from models import Patient, Payment, DailyRevenue, DoctorLedger
+from functions import (add_patient, edit_patient, delete_patient, get_patient, edit_payment, delete_payment,
+                       add_payment, add_payout, list_patients, list_doctors, list_appointments, search_patients,
+                       get_appointment)
+from migrations import reset_sequences
+from rollup import rebuild_daily_revenue
+from settlement import rebuild_doctor_ledger, doctor_balances
+
+def _rows(model, *columns):
+    session = Session()
+    try:
+        return sorted(tuple(row) for row in session.query(*[getattr(model, c) for c in columns]))
+    finally:
+        session.close()
+
+def test_patient_crud(db):
+    add_patient('منى سمير', 41, 'أنثى', '0122', 'الجيزة', 'سكري', None)
+    patient = list_patients().items[0]
+    assert get_patient(patient.id).name == 'منى سمير'
+    edit_patient(patient.id, 'منى سمير علي', 42, 'أنثى', '0122', 'الجيزة', 'سكري', None)
+    assert get_patient(patient.id).age == 42
+    delete_patient(patient.id)
+    assert get_patient(patient.id) is None
+
+def test_appointment_details(clinic):
+    appointment = get_appointment(1)
+    assert (appointment.patient.name, appointment.doctor.name) == ('أحمد علي', 'د. سامي')
+    page = list_appointments(page_size=4)
+    assert len(page.items) == 4
+    assert len(list_appointments(cursor=page.next_cursor, page_size=4).items) == 2
+
+def test_rollup_and_ledger_match_rebuild(clinic):
+    # الجداول المشتقة بعد تعديلات متتالية (upsert / طرح) = إعادة بنائها من الدفعات
+    add_payment(1, 250.0, 200.0, 'بطاقة', 10, 0)
+    edit_payment(2, 999.0, 999.0, 'نقدي', 0, 0)
+    delete_payment(3)
+    add_payout(1, 40.0, date_paid=datetime.datetime.now())
+    revenue_columns = ['date', 'doctor_id', 'treatment_id', 'payment_method', 'payments_count', 'total_amount',
+                       'doctor_share']
+    ledger_columns = ['doctor_id', 'month', 'payments_count', 'earned', 'payouts_count', 'paid_out', 'balance']
+    incremental = _rows(DailyRevenue, *revenue_columns), _rows(DoctorLedger, *ledger_columns)
+    balances = doctor_balances()
+    rebuild_daily_revenue(engine=clinic)
+    rebuild_doctor_ledger(engine=clinic)
+    assert incremental == (_rows(DailyRevenue, *revenue_columns), _rows(DoctorLedger, *ledger_columns))
+    assert balances == doctor_balances()
+    assert balances[1] > 0
+
+def test_search_fallback(clinic):
+    # FTS5 على SQLite و ILIKE (مع trigram إن توفر) على PostgreSQL: نفس النتائج
+    assert [row.name for row in search_patients('سارة')] == ['سارة محمود']
+    assert [doctor.name for doctor in list_doctors(search='جراحة').items] == ['د. منى']
+    assert {appointment.id for appointment in list_appointments(search='سامي').items} == {1, 3, 5}
+
+def test_reset_sequences_after_explicit_ids(db):
+    with db.begin() as conn:
+        conn.execute(insert(Patient.__table__), [{'id': 10, 'name': 'مستورد 1'}, {'id': 11, 'name': 'مستورد 2'}])
+        reset_sequences(conn, ['patients'])
+    add_patient('جديد', 20, 'ذكر', '', '', '', None)
+    assert [patient.id for patient in list_patients().items] == [10, 11, 12]
+
+def test_read_snapshot_ignores_later_writes(clinic):
+    with read_snapshot() as snapshot:
+        before = snapshot.query(func.count(Payment.id)).scalar()
+        add_payment(1, 50.0, 50.0, 'نقدي', 0, 0)  # لا تنتظر اللقطة المفتوحة
+        assert snapshot.query(func.count(Payment.id)).scalar() == before
+    with read_snapshot() as snapshot:
+        assert snapshot.query(func.count(Payment.id)).scalar() == before + 1
+
+def test_import_with_explicit_ids(db, tmp_path):
+    from importer import import_file
+    source = tmp_path / 'patients.csv'
+    source.write_text('id,name,phone\n7,مريض مستورد,0100\n', encoding='utf-8')
+    assert import_file('patients', str(source)).inserted == 1
+    add_patient('بعد الاستيراد', 20, 'ذكر', '', '', '', None)
+    assert [patient.id for patient in list_patients().items] == [7, 8]
+
+def test_import_payments_in_slices(clinic, tmp_path, monkeypatch):
+    # الترحيل إلى جداول التجميع على شرائح IN_LIST_SIZE معرف
+    import importer
+    monkeypatch.setattr(importer, 'IN_LIST_SIZE', 2)
+    source = tmp_path / 'payments.csv'
+    source.write_text('appointment_id,total_amount\n' + ''.join(f'{i},{i * 10}\n' for i in range(1, 6)),
+                      encoding='utf-8')
+    assert importer.import_file('payments', str(source)).inserted == 5
+    revenue = _rows(DailyRevenue, 'date', 'doctor_id', 'treatment_id', 'payments_count', 'total_amount')
+    rebuild_daily_revenue(engine=clinic)
+    assert revenue == _rows(DailyRevenue, 'date', 'doctor_id', 'treatment_id', 'payments_count', 'total_amount')
+    assert sum(row[3] for row in revenue) == 11
@@ -0,0 +1,18 @@
+import numpy as np
+from commission import CommissionMatrix, DEFAULT_CLINIC_PERCENTAGE, DEFAULT_DOCTOR_PERCENTAGE
+
+def test_lookup_with_sparse_large_ids():
+    # معرفات كبيرة ومتباعدة: الحجم حسب عدد النسب فقط
+    matrix = CommissionMatrix({(10**9, 7): (30.0, 70.0), (5, 10**9): (None, 60.0), (5, 7): (20.0, 80.0),
+                               (None, 7): (1.0, 99.0)})
+    assert len(matrix.codes) == 3
+    clinic, doctor = matrix.lookup([10**9, 5, 5, 5, 10**9, None, 6], [7, 10**9, 7, 8, 10**9, 7, None])
+    assert clinic.tolist() == [30.0, DEFAULT_CLINIC_PERCENTAGE, 20.0, DEFAULT_CLINIC_PERCENTAGE,
+                               DEFAULT_CLINIC_PERCENTAGE, DEFAULT_CLINIC_PERCENTAGE, DEFAULT_CLINIC_PERCENTAGE]
+    assert doctor.tolist() == [70.0, 60.0, 80.0, DEFAULT_DOCTOR_PERCENTAGE, DEFAULT_DOCTOR_PERCENTAGE,
+                               DEFAULT_DOCTOR_PERCENTAGE, DEFAULT_DOCTOR_PERCENTAGE]
+
+def test_shares_without_percentages():
+    clinic, doctor = CommissionMatrix({}).shares([1, 2], [1, 2], [100.0, None], discounts=[10.0, 0], taxes=0)
+    assert np.allclose(clinic, [45.0, 0.0])
+    assert np.allclose(doctor, [45.0, 0.0])
@@ -0,0 +1,110 @@
+import io
+import os
+import threading
+import pytest
+from database import Session, unit_of_work
+from models import ImageBlob
+from functions import add_patient, edit_patient, delete_patient, list_patients
+import images
+
+@pytest.fixture(autouse=True)
+def image_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(images, 'IMAGE_DIR', str(tmp_path))
+
+def _blobs():
+    session = Session()
+    try:
+        return {blob.sha256: (blob.path, blob.ref_count) for blob in session.query(ImageBlob)}
+    finally:
+        session.close()
+
+def _upload(content):
+    return io.BytesIO(content)
+
+def test_refcounts_and_garbage_collection(db):
+    add_patient('أ', 30, 'ذكر', '', '', '', _upload(b'xray-1'))
+    add_patient('ب', 31, 'ذكر', '', '', '', _upload(b'xray-1'))
+    [(path, ref_count)] = _blobs().values()
+    assert ref_count == 2 and os.path.exists(path)
+    first, second = list_patients().items
+    edit_patient(first.id, 'أ', 30, 'ذكر', '', '', '', _upload(b'xray-1'))  # نفس الصورة لا تُحذف
+    assert list(_blobs().values()) == [(path, 2)]
+    delete_patient(first.id)
+    delete_patient(second.id)
+    assert _blobs() == {} and not os.path.exists(path)
+
+def test_failed_transaction_leaves_no_file(db):
+    with pytest.raises(RuntimeError):
+        with unit_of_work() as session:
+            path = images.acquire_image(session, _upload(b'xray-rolled-back'))
+            assert os.path.exists(path)
+            raise RuntimeError('failed after upload')
+    assert _blobs() == {} and not os.path.exists(path)
+    add_patient('أ', 30, 'ذكر', '', '', '', _upload(b'xray-kept'))
+    [(kept, _)] = _blobs().values()
+    with pytest.raises(RuntimeError):
+        with unit_of_work() as session:
+            images.acquire_image(session, _upload(b'xray-kept'))
+            raise RuntimeError('failed after upload')
+    assert list(_blobs().values()) == [(kept, 1)] and os.path.exists(kept)  # الملف الموجود قبلها لا يُحذف
+
+def test_concurrent_uploads_of_new_content(db):
+    barrier = threading.Barrier(4)
+    errors = []
+
+    def upload(i):
+        barrier.wait()
+        try:
+            add_patient(f'مريض {i}', 30, 'ذكر', '', '', '', _upload(b'same-new-scan'))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=upload, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    [(path, ref_count)] = _blobs().values()
+    assert ref_count == 4 and os.path.exists(path)
+
+def test_collect_orphans(db):
+    add_patient('أ', 30, 'ذكر', '', '', '', _upload(b'xray-referenced'))
+    [(kept, _)] = _blobs().values()
+    sha256, temp_path, _ = images._stage_blob(_upload(b'orphan'))
+    orphan = images._blob_path(sha256)
+    os.makedirs(os.path.dirname(orphan), exist_ok=True)
+    os.replace(temp_path, orphan)
+    assert images.collect_orphans() == 0  # حديث: قد تكون معاملته جارية
+    assert images.collect_orphans(min_age=-1) == 1
+    assert os.path.exists(kept) and not os.path.exists(orphan)
+
+def _png():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), 'white').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+def test_discard_after_external_delete(tmp_path):
+    cache = images.DerivativeCache(str(tmp_path / 'cache'), 1 << 20)
+    source = tmp_path / 'scan.png'
+    source.write_bytes(_png())
+    thumb = cache.get(str(source))
+    os.remove(thumb)  # حُذفت من عملية أخرى
+    cache.discard(str(source))
+    assert cache.get(str(source)) == thumb and os.path.exists(thumb)
+
+def test_failed_render_leaves_no_temp_file(tmp_path, monkeypatch):
+    from PIL import Image
+
+    def failing_save(self, fp, *args, **kwargs):
+        fp.write(b'partial')
+        raise OSError('disk full')
+
+    source = tmp_path / 'scan.png'
+    source.write_bytes(_png())
+    monkeypatch.setattr(Image.Image, 'save', failing_save)
+    target = tmp_path / 'cache' / 'thumb' / 'sc' / 'scan.webp'
+    with pytest.raises(OSError):
+        images._render_derivative(str(source), str(target), 256, 'WEBP')
+    assert os.listdir(target.parent) == []
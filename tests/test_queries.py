@@ -0,0 +1,118 @@
+# فحص N+1 والمرور الكامل (instrumentation.assert_queries) على المسارات الأساسية ببيانات أكبر من حد N+1
+import datetime
+import pytest
+from sqlalchemy import insert, update
+from database import unit_of_work
+from models import Appointment, Payment
+from functions import (add_doctor, add_treatment, add_patient, add_appointment, add_payment, get_appointments,
+                       get_calendar, list_appointments, list_payments)
+from readmodel import appointments_frame, payments_frame
+from reports import generate_report, aggregate_report
+from instrumentation import assert_queries, N_PLUS_ONE_THRESHOLD
+
+APPOINTMENTS = N_PLUS_ONE_THRESHOLD * 3
+START = datetime.datetime(2025, 1, 4, 9)
+
+@pytest.fixture
+def seeded(strict_plans):
+    for i in range(3):
+        add_doctor(f'د. طبيب {i}', 'عام', '', '')
+        add_treatment(f'علاج {i}', 100.0 * (i + 1), 30)
+    for i in range(APPOINTMENTS):
+        add_patient(f'مريض {i}', 20 + i, 'ذكر', '', '', '', None)
+    for i in range(APPOINTMENTS):
+        add_appointment(i + 1, i % 3 + 1, i % 3 + 1, START + datetime.timedelta(days=i), 'مؤكد', '')
+        add_payment(i + 1, 100.0, 100.0, 'نقدي', 0, 0)
+    # تاريخ الدفعة = تاريخ الموعد (add_payment يستخدم الوقت الحالي)
+    with strict_plans.begin() as conn:
+        conn.execute(update(Payment).values(date_paid=Appointment.date).where(Payment.appointment_id == Appointment.id))
+    return strict_plans
+
+def test_get_appointments_without_n_plus_one(seeded):
+    # قائمة كل المواعيد تمر على الجدول بطبيعتها؛ المطلوب عدم تحميل المريض/الطبيب/العلاج لكل موعد
+    with assert_queries(max_queries=3, allow_scans=('appointments',), name='get_appointments'):
+        appointments = get_appointments()
+        names = [(a.patient.name, a.doctor.name, a.treatment.name) for a in appointments]
+    assert len(names) == APPOINTMENTS
+
+def test_generate_report_uses_date_index(seeded):
+    # على SQLite تضيف لقطة القراءة BEGIN وقراءة تثبيتها
+    with assert_queries(max_queries=3, name='generate_report'):
+        df = generate_report(datetime.date(2025, 1, 10), datetime.date(2025, 1, 19))
+    assert len(df) == 10
+    with assert_queries(max_queries=2, name='aggregate_report'):
+        aggregate_report(datetime.date(2025, 1, 1), datetime.date(2025, 1, 31), group_by='doctor')
+
+def test_paged_screens(seeded):
+    with assert_queries(max_queries=3, name='list_appointments'):
+        page = list_appointments(page_size=10)
+        list_appointments(cursor=page.next_cursor, page_size=10)
+    with assert_queries(max_queries=2, name='calendar'):
+        get_calendar(datetime.date(2025, 1, 4), days=7, doctor_id=1)
+
+def _all_pages(list_page, page_size, **kwargs):
+    ids, cursor = [], None
+    while True:
+        page = list_page(cursor=cursor, page_size=page_size, **kwargs)
+        items = page.items
+        ids += list(items['id']) if hasattr(items, 'columns') else [item.id for item in items]
+        if page.next_cursor is None:
+            return ids
+        cursor = page.next_cursor
+
+@pytest.mark.parametrize('descending', [True, False])
+def test_paging_keeps_rows_without_date(seeded, descending):
+    # مواعيد ودفعات بدون تاريخ (مستوردة مثلاً) تظهر في آخر القائمة في الاتجاهين
+    with seeded.begin() as conn:
+        for _ in range(3):
+            appointment_id = conn.execute(insert(Appointment.__table__).values(
+                patient_id=1, doctor_id=1, treatment_id=1, status='مؤكد')).inserted_primary_key[0]
+            conn.execute(insert(Payment.__table__).values(appointment_id=appointment_id, total_amount=10.0))
+    for list_page, model in ((list_appointments, Appointment), (appointments_frame, Appointment),
+                             (list_payments, Payment), (payments_frame, Payment)):
+        with assert_queries(name=list_page.__name__):
+            ids = _all_pages(list_page, 7, descending=descending)
+        assert len(ids) == len(set(ids)) == APPOINTMENTS + 3
+        assert ids[-3:] == sorted(ids[-3:], reverse=descending)
+        assert sorted(ids[-3:]) == list(range(APPOINTMENTS + 1, APPOINTMENTS + 4))
+    assert len(appointments_frame(page_size=None).items) == APPOINTMENTS + 3
+
+def test_lazy_loading_loop_is_reported(seeded):
+    # التحقق من أن الفحص نفسه يعمل: تحميل المريض لكل موعد على حدة
+    with pytest.raises(AssertionError, match='N\\+1'):
+        with assert_queries(allow_scans=('appointments',), name='lazy'):
+            with unit_of_work() as session:
+                for appointment in session.query(Appointment).all():
+                    appointment.patient.name
+
+def test_cte_queries_are_explained(seeded):
+    from sqlalchemy import text
+    with pytest.raises(AssertionError, match='appointments'):
+        with assert_queries(name='cte'):
+            with unit_of_work() as session:
+                session.execute(text('WITH recent AS (SELECT id, notes FROM appointments) '
+                                     "SELECT count(*) FROM recent WHERE notes LIKE '%x%'")).scalar()
+
+def test_failed_explain_keeps_the_transaction(seeded, monkeypatch):
+    # EXPLAIN الفاشل لا يعطّل معاملة المستدعي (PostgreSQL: داخل SAVEPOINT)
+    import instrumentation
+    from sqlalchemy import func
+    monkeypatch.setitem(instrumentation.EXPLAIN_PREFIX, seeded.dialect.name, 'EXPLAIN NOT VALID ')
+    with instrumentation.diagnostics.watch('bad_explain'):
+        with unit_of_work() as session:
+            session.query(func.count(Appointment.id)).filter(Appointment.doctor_id == 1).scalar()
+            assert session.query(func.count(Payment.id)).scalar() == APPOINTMENTS
+
+def test_rows_are_counted_only_inside_watch(seeded):
+    # خارج diagnostics.watch لا تُحمَّل نتائج SELECT كاملة لعدّها
+    from instrumentation import diagnostics
+
+    def appointment_rows():
+        return sum(stat['rows'] for stat in diagnostics.query_stats() if 'FROM appointments' in stat['sql'])
+
+    diagnostics.reset()
+    list_appointments(page_size=10)
+    assert appointment_rows() == 0
+    with diagnostics.watch('rows'):
+        list_appointments(page_size=10)
+    assert appointment_rows() == 11
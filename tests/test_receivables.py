@@ -0,0 +1,34 @@
+import datetime
+from sqlalchemy import update
+from models import Payment
+from functions import add_payment
+from instrumentation import assert_queries
+from receivables import receivables_report, receivables_summary, patient_receivables
+
+def test_unpaid_invoices_without_paid_amount(strict_plans):
+    from functions import add_doctor, add_treatment, add_patient, add_appointment
+    add_doctor('د. سامي', 'تقويم', '', '')
+    add_treatment('حشو', 100.0, 30)
+    add_patient('أحمد علي', 30, 'ذكر', '', '', '', None)
+    add_appointment(1, 1, 1, datetime.datetime(2025, 3, 3, 9), 'مؤكد', '')
+    add_payment(1, 100.0, 0.0, 'نقدي', 0, 0)
+    add_payment(1, 100.0, None, 'نقدي', 0, 0)  # مستورد بدون مبلغ مدفوع
+    add_payment(1, 100.0, 100.0, 'نقدي', 0, 0)
+    with strict_plans.begin() as conn:
+        conn.execute(update(Payment).values(date_paid=datetime.datetime(2025, 3, 3, 10)))
+    as_of = datetime.date(2025, 4, 20)
+    with assert_queries(name='receivables'):
+        summary = receivables_summary(as_of)
+        report = receivables_report(as_of)
+    assert (summary['patients'], summary['balance'], summary['due_31_60']) == (1, 200.0, 200.0)
+    assert report['balance'].tolist() == [200.0]
+    assert len(patient_receivables(1, as_of)) == 2
+
+def test_display_page_is_limited_in_sql(clinic):
+    # الشاشة تقرأ أعلى الأرصدة فقط (LIMIT في الاستعلام)، والتصدير كل المرضى
+    as_of = datetime.date.today()
+    for appointment_id in (1, 2, 3):
+        add_payment(appointment_id, 500.0 * appointment_id, 0.0, 'نقدي', 0, 0)
+    assert len(receivables_report(as_of)) == 3
+    top = receivables_report(as_of, limit=2)
+    assert top['patient_id'].tolist() == [3, 2]
@@ -0,0 +1,75 @@
+import datetime
+import glob
+import logging
+import os
+import tempfile
+import pytest
+from sqlalchemy import update
+import jobs
+import reports
+from functions import edit_doctor, edit_treatment
+from models import Payment
+
+def _temp_files():
+    return set(glob.glob(os.path.join(tempfile.gettempdir(), 'cura_report_*')))
+
+def test_missing_pdf_font_is_reported(monkeypatch, caplog):
+    monkeypatch.setattr(reports, 'PDF_FONT_PATH', '/nonexistent/font.ttf')
+    monkeypatch.setattr(reports, '_font_warning_logged', False)
+    assert reports.pdf_font_path() is None
+    with caplog.at_level(logging.WARNING, logger='cura.reports'):
+        assert reports._pdf_font() == 'Helvetica'
+        reports._pdf_font()
+    assert len([r for r in caplog.records if 'Arabic' in r.getMessage()]) == 1
+
+@pytest.mark.parametrize('export', [reports.export_report_pdf, reports.export_report_csv, reports.export_report_excel,
+                                    reports.export_report_parquet])
+def test_failed_export_removes_temp_file(clinic, monkeypatch, export):
+    def failing_progress(rows_done):
+        raise RuntimeError('cancelled')
+    # الدفعات مسجلة بتاريخ اليوم
+    today = datetime.date.today()
+    before = _temp_files()
+    with pytest.raises(RuntimeError):
+        export(today, today, progress=failing_progress)
+    assert _temp_files() == before
+    path = export(today, today)
+    assert os.path.getsize(path) > 0
+    os.remove(path)
+
+def test_fingerprint_tracks_edits_outside_daily_revenue(clinic):
+    today = datetime.date.today()
+    seen = {reports.report_fingerprint(today, today)[0]}
+    edit_doctor(1, 'د. سامي حسن', 'أسنان', '', '')
+    seen.add(reports.report_fingerprint(today, today)[0])
+    edit_treatment(1, 'تنظيف عميق', 300.0)
+    seen.add(reports.report_fingerprint(today, today)[0])
+    with clinic.begin() as conn:  # رقم الموعد في الدفعة لا يدخل في جدول التجميع اليومي
+        conn.execute(update(Payment).where(Payment.id == 1).values(appointment_id=3))
+    seen.add(reports.report_fingerprint(today, today)[0])
+    assert len(seen) == 4
+
+def test_evicted_result_files_outlive_the_cache(clinic, monkeypatch):
+    today = datetime.date.today()
+    manager = jobs.ExportJobManager(max_workers=1, max_cached=1)
+    first = manager.submit('csv', today, today)
+    first.future.result()
+    second = manager.submit('csv', today - datetime.timedelta(days=1), today)
+    second.future.result()
+    assert manager.get(first.key) is None
+    assert os.path.exists(first.path)  # قد تكون جلسة أخرى تنزّله
+    monkeypatch.setattr(jobs, 'EVICTED_FILE_GRACE', 0)
+    manager.submit('csv', today - datetime.timedelta(days=2), today).future.result()
+    assert not os.path.exists(second.path)
+    os.remove(first.path)
+
+def test_failed_excel_export_closes_workbook(clinic):
+    from openpyxl.worksheet._writer import ALL_TEMP_FILES
+
+    def failing_progress(rows_done):
+        raise RuntimeError('cancelled')
+    before = list(ALL_TEMP_FILES)
+    today = datetime.date.today()
+    with pytest.raises(RuntimeError):
+        reports.export_report_excel(today, today, progress=failing_progress)
+    assert ALL_TEMP_FILES == before
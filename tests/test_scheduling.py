@@ -0,0 +1,57 @@
+import datetime
+import threading
+import pytest
+from sqlalchemy import func, insert
+from database import Session
+from models import Appointment
+from functions import add_appointment, edit_appointment
+from scheduling import AppointmentConflict, scheduler
+
+DAY = datetime.datetime(2025, 3, 3)
+
+def _count(doctor_id):
+    session = Session()
+    try:
+        return session.query(func.count(Appointment.id)).filter(Appointment.doctor_id == doctor_id).scalar()
+    finally:
+        session.close()
+
+def test_conflict_with_booking_from_another_process(clinic):
+    # الفهرس في الذاكرة محمّل قبل حجز تم من عملية أخرى (لا يُحدَّث فيه)
+    scheduler.find_free_slots(30, DAY, [1])
+    with clinic.begin() as conn:
+        conn.execute(insert(Appointment.__table__).values(patient_id=1, doctor_id=1, treatment_id=1,
+                                                          date=DAY.replace(hour=15), duration=30, status='مؤكد'))
+    with pytest.raises(AppointmentConflict):
+        add_appointment(2, 1, 1, DAY.replace(hour=15, minute=15), 'مؤكد', '')
+    add_appointment(2, 1, 1, DAY.replace(hour=15, minute=30), 'مؤكد', '')  # بعد انتهاء الموعد مباشرة
+
+def test_edit_and_cancelled(clinic):
+    # الموعد 1: الطبيب 1 من 9:00 إلى 9:30، الموعد 3: الطبيب 1 من 11:00
+    with pytest.raises(AppointmentConflict):
+        edit_appointment(3, 3, 1, 1, DAY.replace(hour=9, minute=15), 'مؤكد', '')
+    edit_appointment(1, 1, 1, 1, DAY.replace(hour=9, minute=10), 'مؤكد', '')  # لا يتعارض مع نفسه
+    add_appointment(2, 1, 1, DAY.replace(hour=9, minute=20), 'ملغى', '')
+    edit_appointment(1, 1, 1, 1, DAY.replace(hour=9), 'ملغى', '')
+    add_appointment(2, 1, 1, DAY.replace(hour=9), 'مؤكد', '')
+
+def test_concurrent_bookings_for_same_slot(clinic):
+    before = _count(2)
+    barrier = threading.Barrier(4)
+    outcomes = []
+
+    def book():
+        barrier.wait()
+        try:
+            add_appointment(1, 2, 1, DAY.replace(hour=16), 'مؤكد', '')
+            outcomes.append('booked')
+        except AppointmentConflict:
+            outcomes.append('conflict')
+
+    threads = [threading.Thread(target=book) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(outcomes) == ['booked', 'conflict', 'conflict', 'conflict']
+    assert _count(2) == before + 1
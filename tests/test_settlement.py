@@ -0,0 +1,95 @@
+import datetime
+import threading
+import pytest
+from sqlalchemy import update
+from database import Session
+from models import DoctorLedger, Payment
+from functions import (add_doctor, add_treatment, add_patient, add_appointment, add_payment, add_payout, edit_payment,
+                       delete_payout, edit_appointment, get_appointment)
+from importer import import_file
+from settlement import rebuild_doctor_ledger, doctor_balances, PeriodClosed, close_period, doctor_statement
+
+def _ledger():
+    session = Session()
+    try:
+        return sorted((row.doctor_id, row.month, row.payments_count, row.earned, row.paid_out, row.balance)
+                      for row in session.query(DoctorLedger))
+    finally:
+        session.close()
+
+@pytest.fixture
+def doctor(db):
+    add_doctor('د. سامي', 'تقويم', '', '')
+    add_treatment('حشو', 300.0, 30)
+    add_patient('أحمد علي', 30, 'ذكر', '', '', '', None)
+    start = datetime.datetime(2025, 3, 3, 9)
+    for i in range(4):
+        add_appointment(1, 1, 1, start + datetime.timedelta(hours=i), 'مؤكد', '')
+    return db
+
+def test_concurrent_first_payments_of_month(doctor):
+    # أول دفعات الشهر لنفس الطبيب في نفس اللحظة: صف واحد في الدفتر بدون تعارض على المفتاح
+    barrier = threading.Barrier(4)
+    errors = []
+
+    def pay(appointment_id):
+        barrier.wait()
+        try:
+            add_payment(appointment_id, 200.0, 200.0, 'نقدي', 0, 0)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=pay, args=(i,)) for i in range(1, 5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    ledger = _ledger()
+    assert [(row[2], row[3]) for row in ledger] == [(4, 400.0)]
+    rebuild_doctor_ledger(engine=doctor)
+    assert _ledger() == ledger
+    add_payout(1, 150.0)
+    assert doctor_balances() == {1: 250.0}
+
+def test_close_period_then_edit(doctor):
+    add_payment(1, 200.0, 200.0, 'نقدي', 0, 0)
+    payout_id = add_payout(1, 50.0, date_paid=datetime.datetime(2025, 3, 20))
+    with doctor.begin() as conn:
+        conn.execute(update(Payment).values(date_paid=datetime.datetime(2025, 3, 10)))
+    rebuild_doctor_ledger(engine=doctor)
+    today = datetime.date.today()
+    with pytest.raises(ValueError):
+        close_period(today)  # الشهر الحالي لم ينتهِ
+    with pytest.raises(ValueError):
+        close_period(datetime.date(2025, 3, 1), today=datetime.date(2025, 3, 31))
+    assert close_period(datetime.date(2025, 3, 1)) == 1
+    with pytest.raises(PeriodClosed):
+        close_period(datetime.date(2025, 2, 1))
+    with pytest.raises(PeriodClosed):
+        edit_payment(1, 999.0, 999.0, 'نقدي', 0, 0)
+    with pytest.raises(PeriodClosed):
+        delete_payout(payout_id)
+    with pytest.raises(PeriodClosed):
+        add_payout(1, 10.0, date_paid=datetime.datetime(2025, 3, 25))
+    add_doctor('د. منى', 'جراحة', '', '')
+    with pytest.raises(PeriodClosed):  # نقل دفعات الموعد إلى طبيب آخر في شهر مقفل
+        edit_appointment(1, 1, 2, 1, datetime.datetime(2025, 3, 3, 9), 'مؤكد', '')
+    assert get_appointment(1).doctor_id == 1
+    edit_appointment(1, 1, 1, 1, datetime.datetime(2025, 3, 3, 9), 'مؤكد', 'ملاحظة')  # بدون نقل
+    statement = doctor_statement(1, datetime.date(2025, 3, 1))
+    assert (statement['closed'], statement['earned'], statement['paid_out']) == (True, 100.0, 50.0)
+    # الأشهر المفتوحة تعمل كالمعتاد
+    add_payment(2, 300.0, 300.0, 'نقدي', 0, 0)
+    assert doctor_balances() == {1: 200.0}
+
+def test_import_rejects_payments_in_closed_period(doctor, tmp_path):
+    add_payout(1, 50.0, date_paid=datetime.datetime(2025, 3, 20))
+    assert close_period(datetime.date(2025, 3, 1)) == 1
+    source = tmp_path / 'payments.csv'
+    source.write_text('appointment_id,total_amount,date_paid\n1,100,2025-03-15\n2,200,2025-04-02\n3,300,\n',
+                      encoding='utf-8')
+    result = import_file('payments', str(source))
+    assert result.inserted == 2
+    assert [(error.row, error.message) for error in result.errors] == [(2, 'date_paid: في فترة مقفلة')]
+    assert doctor_balances() == {1: 200.0}